@@ -1,18 +1,10 @@
-import csv
+import argparse
+import asyncio
 import curses
 import logging
 import pathlib
-import sys
 
-from sheet import engine, views, models
-
-
-def read_csv(fname, sheet):
-    with open(fname) as f:
-        reader = csv.reader(f)
-        for row, values in enumerate(reader):
-            for col, value in enumerate(values):
-                sheet.set(models.Index(row, col), value)
+from sheet import csvimport, engine, replay, server, sharding, views, watch, workbook
 
 
 def setup_logging():
@@ -27,22 +19,132 @@ def setup_logging():
     )
 
 
-if __name__ == "__main__":
-    setup_logging()
-    logging.info("--------------------")
-    logging.info("Spreadsheet starting")
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m sheet")
+    parser.add_argument("csv", nargs="?", help="a CSV file to load at startup")
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep loading the rows appended to the CSV file",
+    )
+    serving = parser.add_mutually_exclusive_group()
+    serving.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="instead of opening the UI, serve the sheet on a Unix socket",
+    )
+    serving.add_argument(
+        "--port",
+        type=int,
+        help="instead of opening the UI, serve the sheet on a TCP port",
+    )
+    parser.add_argument(
+        "--host", default="127.0.0.1", help="the address to bind with --port"
+    )
+    parser.add_argument(
+        "--record",
+        metavar="PATH",
+        help="write a trace of the keys pressed in the UI to PATH",
+    )
+    serving.add_argument(
+        "--replay",
+        metavar="PATH",
+        help="instead of opening the UI, replay the trace at PATH without a "
+        "terminal and print the latency of each type of action",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        metavar="N",
+        help="split the rows of the sheet between N worker processes",
+    )
+    parser.add_argument(
+        "--manual",
+        action="store_true",
+        help="only recalculate formulas when asked to, with ^E in the UI",
+    )
+    parser.add_argument(
+        "--sheets",
+        metavar="NAMES",
+        type=lambda names: names.split(","),
+        help="open a workbook of the comma-separated sheet NAMES, which "
+        "formulas can read with references like Name!A1; the CSV file is "
+        "loaded into the first, which is also the one served",
+    )
+    args = parser.parse_args(argv)
+    if args.watch and not args.csv:
+        parser.error("--watch needs a CSV file")
+    if args.manual and args.shards:
+        parser.error("--manual can't be used with --shards")
+    if args.sheets and args.shards:
+        parser.error("--sheets can't be used with --shards")
+    return args
+
 
+def run_viewer(sheet, tail=None, record=None):
     @curses.wrapper
     def main(stdscr):
         curses.raw()
+        recorder = None
         try:
-            sheet = engine.Spreadsheet()
-            if len(sys.argv) > 1:
-                fname = sys.argv[1]
-                read_csv(fname, sheet)
-            viewer = views.Viewer(sheet, stdscr)
+            if record is not None:
+                recorder = replay.Recorder(open(record, "w"))
+            viewer = views.Viewer(sheet, stdscr, watch=tail, recorder=recorder)
             viewer.loop()
 
             logging.info("Exiting.")
         finally:
             curses.noraw()
+            if recorder is not None:
+                recorder.close()
+                recorder.file.close()
+
+
+def run_replay(sheet, path):
+    with open(path) as f:
+        trace = replay.read_trace(f)
+    latencies, failed, diverged = replay.replay(trace, sheet)
+    print(replay.report(latencies))
+    print(f"{len(trace)} keys, {failed} failed, {diverged} diverged from the trace")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    setup_logging()
+    logging.info("--------------------")
+    logging.info("Spreadsheet starting")
+
+    if args.shards:
+        sheet = sharding.ShardedSpreadsheet(workers=args.shards)
+    else:
+        if args.sheets:
+            sheets = list(workbook.Workbook(args.sheets).sheets.values())
+        else:
+            sheets = [engine.Spreadsheet()]
+        sheet = sheets[0]
+        if args.manual:
+            for each in sheets:
+                each.set_calculation(engine.MANUAL)
+    tail = None
+    if args.watch:
+        tail = watch.CsvTail(args.csv, sheet)
+        tail.poll()
+    elif args.csv:
+        csvimport.import_csv(args.csv, sheet)
+    if args.socket or args.port:
+        try:
+            asyncio.run(
+                server.serve(
+                    sheet,
+                    path=args.socket,
+                    host=args.host,
+                    port=args.port,
+                    watch=tail,
+                )
+            )
+        except KeyboardInterrupt:
+            logging.info("Exiting.")
+    elif args.replay:
+        run_replay(sheet, args.replay)
+    else:
+        run_viewer(sheet, tail, record=args.record)
@@ -0,0 +1,197 @@
+"""Rectangular blocks of values produced by array formulas.
+
+An `Array` stores its values as one Python list per column. Arithmetic between
+arrays runs as a single ``map`` over each pair of column buffers instead of one
+formula evaluation per cell; only columns containing blanks, text or errors
+fall back to a per-element loop that reports errors cell by cell.
+"""
+
+import operator
+
+from . import errors as err
+from .formula import display
+
+__all__ = ["Array", "RangeArray", "ShapeError"]
+
+_NUMERIC_TYPES = frozenset({int, float, bool})
+
+# Operator from `_ordered` -> the plain operator, for numbers
+_ORDERED = {}
+
+
+class ShapeError(ValueError):
+    """Raised when combining arrays of different shapes."""
+
+
+def _binary(op):
+    def forward(self, other):
+        return self._combine(op, other, reflected=False)
+
+    def reflected(self, other):
+        return self._combine(op, other, reflected=True)
+
+    return forward, reflected
+
+
+def _ordered(op):
+    """Make the comparison `op` work on any two formula values: blanks count
+    as 0 or as empty text, numbers sort before text and text ignores case."""
+
+    def compare(left, right):
+        return op(_order_key(left, right), _order_key(right, left))
+
+    _ORDERED[compare] = op
+    return compare
+
+
+def _order_key(value, other):
+    if value is None:
+        value = "" if isinstance(other, str) else 0
+    if isinstance(value, str):
+        return (1, value.casefold())
+    return (0, value)
+
+
+def _unary(op):
+    def apply(self):
+        return Array([[_apply_one(op, v) for v in column] for column in self.columns])
+
+    return apply
+
+
+class Array:
+    """A `height` x `width` block of formula values.
+
+    >>> a = Array([[1, 2, 3]])
+    >>> (a * 2 + Array([[1, 1, 1]])).columns
+    [[3, 5, 7]]
+    >>> (Array([[1, None, "x"]]) / Array([[0, 1, 1]])).columns
+    [['#DIV/0!', 0.0, '#VALUE!']]
+    >>> (Array([[1, None, "x", "#N/A"]]) > 0).columns
+    [[True, False, True, '#N/A']]
+
+    Args:
+        columns (list of lists): one buffer per column, all the same length.
+    """
+
+    __slots__ = ("columns",)
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    @property
+    def height(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    @property
+    def width(self):
+        return len(self.columns)
+
+    def display(self, row, col):
+        """The string shown in the cell `row` rows and `col` columns from the
+        top-left of the array."""
+        return display(self.columns[col][row])
+
+    def _combine(self, op, other, reflected):
+        if isinstance(other, Array):
+            if other.height == 1 and other.width == 1:
+                other = other.columns[0][0]
+            elif (other.height, other.width) != (self.height, self.width):
+                raise ShapeError(
+                    f"Cannot combine {self.height}x{self.width} array with "
+                    f"{other.height}x{other.width} array"
+                )
+        columns = []
+        for n, column in enumerate(self.columns):
+            if isinstance(other, Array):
+                operand = other.columns[n]
+            else:
+                operand = [other] * len(column)
+            if reflected:
+                columns.append(_apply(op, operand, column))
+            else:
+                columns.append(_apply(op, column, operand))
+        return Array(columns)
+
+    __add__, __radd__ = _binary(operator.add)
+    __sub__, __rsub__ = _binary(operator.sub)
+    __mul__, __rmul__ = _binary(operator.mul)
+    __truediv__, __rtruediv__ = _binary(operator.truediv)
+    __floordiv__, __rfloordiv__ = _binary(operator.floordiv)
+    __mod__, __rmod__ = _binary(operator.mod)
+    __pow__, __rpow__ = _binary(operator.pow)
+    __neg__ = _unary(operator.neg)
+    __pos__ = _unary(operator.pos)
+    __abs__ = _unary(operator.abs)
+    # Python reflects ``1 < array`` to ``array > 1`` by itself.
+    __lt__, _ = _binary(_ordered(operator.lt))
+    __le__, _ = _binary(_ordered(operator.le))
+    __gt__, _ = _binary(_ordered(operator.gt))
+    __ge__, _ = _binary(_ordered(operator.ge))
+    __eq__, _ = _binary(_ordered(operator.eq))
+    __ne__, _ = _binary(_ordered(operator.ne))
+    __hash__ = None
+
+
+class RangeArray(Array):
+    """The values of a range of cells, read from `sheet` only when first
+    needed.
+
+    Formulas receive ranges as RangeArrays, so that functions which only need
+    a few of the cells, like the lookups in `sheet.lookup`, can use `sheet`
+    and `range` directly instead of evaluating the whole range.
+    """
+
+    __slots__ = ("sheet", "range", "visited_cells", "_columns")
+
+    def __init__(self, sheet, cell_range, visited_cells):
+        self.sheet = sheet
+        self.range = cell_range
+        self.visited_cells = visited_cells
+        self._columns = None
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            array = self.sheet.get_array(self.range, self.visited_cells)
+            self._columns = array.columns
+        return self._columns
+
+    @property
+    def height(self):
+        return self.range.height
+
+    @property
+    def width(self):
+        return self.range.width
+
+
+def _numeric(values):
+    return set(map(type, values)) <= _NUMERIC_TYPES
+
+
+def _apply(op, left, right):
+    """Apply `op` pairwise to two equally long column buffers."""
+    if _numeric(left) and _numeric(right):
+        try:
+            return list(map(_ORDERED.get(op, op), left, right))
+        except ArithmeticError:
+            pass
+    return list(map(_apply_one, [op] * len(left), left, right))
+
+
+def _apply_one(op, *args):
+    for arg in args:
+        if err.is_error(arg):
+            return arg
+    if op in _ORDERED:
+        return op(*args)
+    args = [0 if arg is None else arg for arg in args]
+    if any(isinstance(arg, str) for arg in args):
+        return err.VALUE
+    try:
+        return op(*args)
+    except ZeroDivisionError:
+        return err.DIV0
+    except (ArithmeticError, TypeError, ValueError):
+        return err.VALUE
@@ -2,8 +2,10 @@ import re
 import logging
 from datetime import datetime
 
-from .models import Index
+from .arrays import Array, RangeArray, ShapeError
 from . import errors as err
+from . import formula as fm
+from .models import Range
 
 
 class Cell:
@@ -15,12 +17,20 @@ class Cell:
 
     def __init__(self):
         self.raw_data = ""
+        self.formula = None
         self.format_type = "default"
         self.format_spec = None
 
     def set_data(self, data):
         logging.debug(f"Setting cell data: {data}")
         self.raw_data = data
+        self.formula = fm.parse(data[1:]) if data.startswith("=") else None
+
+    def set_formula(self, formula):
+        """Replace the formula with `formula`, already parsed, and the raw
+        data with its text."""
+        self.raw_data = "=" + formula.render()
+        self.formula = formula
 
     def get_raw_data(self):
         return self.raw_data
@@ -39,67 +49,31 @@ class Cell:
         self.format_type = format_type
         self.format_spec = format_spec
 
-    def get_formatted_data(self, spreadsheet, visited_cells=None):
-        # Check for circular references
-        if visited_cells is None:
-            visited_cells = set()
-
-        if self in visited_cells:
-            logging.warning("Circular reference detected.")
-            return err.CIRCULAR_REFERENCE
-
-        visited_cells.add(self)
-
-        if self.raw_data.startswith('='):
-            return self.evaluate_formula(self.raw_data[1:], spreadsheet, visited_cells)
-
-        return self.apply_format(self.raw_data)
+    def is_plain(self):
+        """Return True if the cell displays its raw data unchanged."""
+        return (
+            self.formula is None
+            and self.format_type == "default"
+            and self.raw_data != ""
+        )
+
+    def get_value(self, spreadsheet, visited_cells=None):
+        """Return the unformatted value of the cell.
+
+        Formulas are evaluated against `spreadsheet`; an array formula returns
+        the whole `Array`, which the spreadsheet spills into neighbouring
+        cells.
+        """
+        if self.formula is None:
+            return self.raw_data
+        return self.evaluate_formula(self.formula, spreadsheet, visited_cells)
 
     def evaluate_formula(self, formula, spreadsheet, visited_cells):
-        logging.debug(f"Evaluating formula: {formula}")
-
-        # Extract all cell references and other components of the formula
-        components = re.findall(r'[A-Za-z]+[0-9]+|\d+|\D+', formula)
-
-        for comp in components:
-            if re.match(r'[A-Za-z]+[0-9]+', comp):
-                try:
-                    ref_index = Index.parse(comp)
-                except ValueError as e:
-                    logging.error(f"Invalid cell reference '{comp}': {e}")
-                    return err.REF
-
-                if ref_index not in spreadsheet.cells:
-                    return err.REF
-
-                cell = spreadsheet.cells[ref_index]
-                cell_value = cell.get_formatted_data(spreadsheet, visited_cells)
-
-                if cell_value.strip() == '':
-                    return err.NULL
-
-                if isinstance(cell_value, str) and not cell_value.isdigit():
-                    # Add quote to non digit
-                    cell_value = f'"{cell_value}"'
-                elif isinstance(cell_value, datetime):
-                    # Convert datetime to a string
-                    cell_value = f'"{cell_value.isoformat()}"'
-
-                formula = formula.replace(comp, str(cell_value))
-            else:
-                pass
-
-        try:
-            result = eval(formula)
-            return str(result)
-        except ZeroDivisionError:
-            return err.DIV0
-        except Exception as e:
-            logging.error(f"Error evaluating formula '{formula}': {e}")
-            return err.ERROR
+        logging.debug(f"Evaluating formula: {self.raw_data}")
+        return evaluate_formula(formula, spreadsheet, visited_cells)
 
     def apply_format(self, data):
-        if self.format_type == 'default':
+        if self.format_type == "default" or data == "" or err.is_error(data):
             return data
 
         if self.format_type == 'number':
@@ -137,3 +111,80 @@ class Cell:
                 return err.VALUE
 
         return data
+
+
+def evaluate_formula(formula, spreadsheet, visited_cells, offset=None):
+    """Evaluate a parsed formula against `spreadsheet`.
+
+    If `offset` is given, every reference in the formula is first moved by
+    that many rows and columns; this evaluates one row of a shared formula
+    without building a `Formula` for it.
+
+    Returns:
+        str or Array: the displayed result, or an `Array` to spill.
+    """
+    if formula.error is not None:
+        return formula.error
+
+    if formula.external and offset is not None:
+        formula = formula.shifted(offset)
+        offset = None
+
+    namespace = {}
+    try:
+        for n, ref_index in enumerate(formula.refs):
+            if offset is not None:
+                ref_index += offset
+            namespace[f"_r{n}"] = _read_ref(spreadsheet, ref_index, visited_cells)
+    except err.FormulaError as e:
+        return e.code
+    for n, ref_range in enumerate(formula.ranges):
+        if offset is not None:
+            ref_range = Range(ref_range.first + offset, ref_range.last + offset)
+        namespace[f"_g{n}"] = RangeArray(spreadsheet, ref_range, visited_cells)
+    for n, (name, ref) in enumerate(formula.external):
+        sheet, visited = spreadsheet.external_sheet(name, visited_cells)
+        if sheet is None:
+            return err.REF
+        if isinstance(ref, Range):
+            namespace[f"_x{n}"] = RangeArray(sheet, ref, visited)
+            continue
+        try:
+            namespace[f"_x{n}"] = _read_ref(sheet, ref, visited)
+        except err.FormulaError as e:
+            return e.code
+
+    try:
+        result = eval(formula.code, fm.FUNCTIONS, namespace)
+    except ZeroDivisionError:
+        return err.DIV0
+    except err.FormulaError as e:
+        return e.code
+    except NameError as e:
+        logging.error(f"Error evaluating formula '={formula.render(offset)}': {e}")
+        return err.NAME
+    except ShapeError as e:
+        logging.error(f"Error evaluating formula '={formula.render(offset)}': {e}")
+        return err.VALUE
+    except Exception as e:
+        logging.error(f"Error evaluating formula '={formula.render(offset)}': {e}")
+        return err.ERROR
+    if isinstance(result, Array):
+        return result
+    return fm.display(result)
+
+
+def _read_ref(spreadsheet, index, visited_cells):
+    """Return the value of the cell at `index` as a formula reads it.
+
+    Raises:
+        errors.FormulaError: if the cell is empty or holds an error code.
+    """
+    cell_value = spreadsheet.get_formatted(index, visited_cells)
+    if cell_value.strip() == "":
+        if spreadsheet.get_raw(index) or index in spreadsheet.cells:
+            raise err.FormulaError(err.NULL)
+        raise err.FormulaError(err.REF)
+    if err.is_error(cell_value):
+        raise err.FormulaError(cell_value)
+    return fm.coerce(cell_value)
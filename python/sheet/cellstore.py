@@ -0,0 +1,425 @@
+"""The mapping of Index to Cell behind `Spreadsheet.cells`.
+
+Most cells of a loaded CSV are plain: text or numbers without a formula or
+a format, often a handful of distinct strings repeated down a column. A
+`Cell` object and a dict entry per cell cost a few hundred bytes each, so
+plain cells are dictionary-encoded instead: each column keeps an
+``array('i')`` of codes into one table of distinct strings, about 4 bytes
+per cell. They are turned back into Cells only when asked for, and `plain`
+reads their text without even that. Empty cells, which a CSV file is full
+of, get a code of their own.
+
+Cells are stored at physical positions, which rows and columns inserted or
+deleted before them don't change: see `structure.Axis`.
+"""
+
+from array import array
+from collections.abc import MutableMapping
+
+from .cell import Cell
+from .models import Index
+from .structure import Axis
+
+__all__ = ["CellStore", "decode_columns"]
+
+# Codes of rows holding no encoded cell, and of empty cells without a format
+_MISSING = -1
+_EMPTY = -2
+
+# How far past the end of a column a cell may be and still be encoded; rows
+# further away are kept as Cells rather than filling the gap with codes
+MAX_GAP = 4096
+
+
+def decode_columns(first_row, texts, columns):
+    """Iterate over ``(Index, raw)`` for the cells of `columns`, in the form
+    taken by `CellStore.load_columns`, from `first_row` down.
+
+    >>> list(decode_columns(4, ["x"], [array("i", [2, 0]), array("i", [1])]))
+    [(Index(row=4, col=0), 'x'), (Index(row=4, col=1), '')]
+    """
+    raws = [""] + texts
+    for col, codes in enumerate(columns):
+        for row, code in enumerate(codes, first_row):
+            if code:
+                yield Index(row, col), raws[code - 1]
+
+
+class _Codes:
+    """The codes of the encoded cells of one column, from row `lo` down.
+
+    Snapshots read the codes without the sheet's lock, so `lo` and `codes`
+    are kept together in `span`: a change that moves `lo` builds new codes
+    and replaces both at once, and readers read `span` once.
+    """
+
+    __slots__ = ("span", "count")
+
+    def __init__(self, lo):
+        # (lo, codes)
+        self.span = (lo, array("i"))
+        # The number of codes that aren't _MISSING
+        self.count = 0
+
+    def get(self, row):
+        lo, codes = self.span
+        i = row - lo
+        if 0 <= i < len(codes):
+            return codes[i]
+        return _MISSING
+
+    def set(self, row, code):
+        """Store `code` at `row`. Returns False if `row` is too far from the
+        other rows to be stored."""
+        lo, codes = self.span
+        i = row - lo
+        if i < 0:
+            if -i > MAX_GAP + len(codes):
+                return False
+            codes = array("i", [_MISSING]) * -i + codes
+            codes[0] = code
+            self.count += 1
+            self.span = (row, codes)
+            return True
+        if i >= len(codes):
+            if i - len(codes) > MAX_GAP + len(codes):
+                return False
+            codes.extend(array("i", [_MISSING]) * (i + 1 - len(codes)))
+        if codes[i] == _MISSING:
+            self.count += 1
+        codes[i] = code
+        return True
+
+    def load(self, row, codes):
+        """Store `codes` from `row` down, over rows past the last one."""
+        lo, current = self.span
+        if not self.count:
+            self.span = (row, array("i", codes))
+            self.count = len(codes) - codes.count(_MISSING)
+            return
+        if row - lo < len(current):
+            # Past the last cell, there are only _MISSING codes.
+            current = current[: row - lo]
+            self.span = (lo, current)
+        current.extend(array("i", [_MISSING]) * (row - lo - len(current)))
+        current.extend(codes)
+        self.count += len(codes) - codes.count(_MISSING)
+
+    def clear(self, row):
+        lo, codes = self.span
+        i = row - lo
+        if 0 <= i < len(codes) and codes[i] != _MISSING:
+            codes[i] = _MISSING
+            self.count -= 1
+
+    def clear_rows(self, first, last):
+        """Clear the rows `first` to `last`."""
+        lo, codes = self.span
+        start = max(first - lo, 0)
+        stop = min(last + 1 - lo, len(codes))
+        if start >= stop:
+            return
+        self.count -= stop - start - codes[start:stop].count(_MISSING)
+        codes[start:stop] = array("i", [_MISSING]) * (stop - start)
+
+    def rows(self, first=None, last=None):
+        """Iterate over the rows holding a code, from `first` to `last` if
+        given."""
+        lo, codes = self.span
+        start = 0 if first is None else max(first - lo, 0)
+        stop = len(codes) if last is None else min(last + 1 - lo, len(codes))
+        return (lo + i for i in range(start, stop) if codes[i] != _MISSING)
+
+    def last_row(self, first=None, last=None):
+        """Return the last row holding a code, between `first` and `last` if
+        given, or None."""
+        lo, codes = self.span
+        start = 0 if first is None else max(first - lo, 0)
+        stop = len(codes) if last is None else min(last + 1 - lo, len(codes))
+        for i in range(stop - 1, start - 1, -1):
+            if codes[i] != _MISSING:
+                return lo + i
+        return None
+
+
+class CellStore(MutableMapping):
+    """A mapping of Index to Cell that stores plain cells (see
+    `Cell.is_plain`) dictionary-encoded.
+
+    Cells are never changed in place (see `Spreadsheet._edit_cell`): a Cell
+    read from the store is a copy for plain cells, and storing it again is
+    what changes the store.
+
+    >>> cells = CellStore()
+    >>> for row in range(3):
+    ...     cell = Cell()
+    ...     cell.set_data("east")
+    ...     cells[Index(row, 0)] = cell
+    >>> cells.plain(Index(2, 0)), cells[Index(1, 0)].raw_data, len(cells)
+    ('east', 'east', 3)
+    >>> cells.plain(Index(2, 1)) is None, sorted(cells)[-1]
+    (True, Index(row=2, col=0))
+
+    Rows and columns can be inserted or deleted with `shift`:
+
+    >>> from sheet.structure import Shift
+    >>> cells.shift(Shift(0, 1, 2))
+    >>> [cells.plain(Index(row, 0)) for row in range(5)], cells.last_row()
+    (['east', None, None, 'east', 'east'], 4)
+    """
+
+    def __init__(self):
+        # Physical Index -> Cell, for the cells that aren't plain
+        self._cells = {}
+        # Physical col -> _Codes
+        self._columns = {}
+        # Distinct texts of plain cells, and code -> text
+        self._codes = {}
+        self._texts = []
+        # The structure.Axis of rows and columns, and True while both store
+        # every position at its own position
+        self.rows = Axis()
+        self.cols = Axis()
+        self._identity = True
+
+    @property
+    def layout(self):
+        """``(rows, cols)``, the current `structure.Axis` of each direction,
+        for `physical`. They don't change once returned."""
+        return (self.rows, self.cols)
+
+    def physical(self, index, layout=None):
+        """Return the physical position of the cell at `index`, according to
+        `layout` (see `layout`) if given."""
+        if layout is None:
+            if self._identity:
+                return index
+            layout = (self.rows, self.cols)
+        rows, cols = layout
+        return Index(rows.physical(index.row), cols.physical(index.col))
+
+    def logical(self, index):
+        """Return the position of the cell stored at the physical `index`, or
+        None if none is."""
+        if self._identity:
+            return index
+        row = self.rows.logical(index.row)
+        col = self.cols.logical(index.col)
+        return None if row is None or col is None else Index(row, col)
+
+    def plain(self, index):
+        """Return the text of the cell at `index` if it is plain, or None."""
+        if not self._identity:
+            index = self.physical(index)
+        cell = self._cells.get(index)
+        if cell is not None:
+            return cell.raw_data if cell.is_plain() else None
+        column = self._columns.get(index.col)
+        if column is None:
+            return None
+        code = column.get(index.row)
+        return None if code < 0 else self._texts[code]
+
+    def last_row(self, col=None):
+        """Return the last row holding a cell, in column `col` if given, or
+        -1."""
+        if col is None:
+            columns = self._columns.values()
+            cells = self._cells
+        else:
+            col = self.cols.physical(col)
+            columns = [self._columns[col]] if col in self._columns else []
+            cells = [index for index in self._cells if index.col == col]
+        rows = [self._last_row(column) for column in columns]
+        rows.extend(self.rows.logical(index.row) for index in cells)
+        return max((row for row in rows if row is not None), default=-1)
+
+    def _last_row(self, column):
+        """Return the last row holding a code in `column`, or None."""
+        if self.rows.identity:
+            return column.last_row()
+        # Runs are listed from the last row up.
+        for start, length in self.rows.runs():
+            last = None if length is None else start + length - 1
+            row = column.last_row(start, last)
+            if row is not None:
+                return self.rows.logical(row)
+        return None
+
+    def get(self, index, default=None):
+        if not self._identity:
+            index = self.physical(index)
+        cell = self.stored(index)
+        return default if cell is None else cell
+
+    def stored(self, index):
+        """Return the Cell stored at the physical position `index` (see
+        `physical`), or None."""
+        cell = self._cells.get(index)
+        if cell is not None:
+            return cell
+        column = self._columns.get(index.col)
+        if column is None:
+            return None
+        code = column.get(index.row)
+        if code == _MISSING:
+            return None
+        cell = Cell()
+        if code != _EMPTY:
+            cell.raw_data = self._texts[code]
+        return cell
+
+    def __getitem__(self, index):
+        cell = self.get(index)
+        if cell is None:
+            raise KeyError(index)
+        return cell
+
+    def __setitem__(self, index, cell):
+        if not self._identity:
+            index = self.physical(index)
+        if cell.is_plain():
+            encoded = self._encode(index, self._intern(cell.raw_data))
+        elif cell.raw_data == "" and cell.format_type == "default":
+            encoded = self._encode(index, _EMPTY)
+        else:
+            encoded = False
+        if encoded:
+            self._cells.pop(index, None)
+            return
+        self._cells[index] = cell
+        column = self._columns.get(index.col)
+        if column is not None:
+            column.clear(index.row)
+
+    def __delitem__(self, index):
+        if not self._identity:
+            index = self.physical(index)
+        if self._cells.pop(index, None) is not None:
+            return
+        column = self._columns.get(index.col)
+        if column is None or column.get(index.row) == _MISSING:
+            raise KeyError(index)
+        column.clear(index.row)
+
+    def __contains__(self, index):
+        if not self._identity:
+            index = self.physical(index)
+        if index in self._cells:
+            return True
+        column = self._columns.get(index.col)
+        return column is not None and column.get(index.row) != _MISSING
+
+    def __iter__(self):
+        logical = self.logical
+        yield from map(logical, self._cells)
+        for col, column in self._columns.items():
+            for row in column.rows():
+                yield logical(Index(row, col))
+
+    def within(self, axis, first, last):
+        """Iterate over the indices of the cells in rows (`axis` 0) or
+        columns (`axis` 1) `first` to `last`."""
+        spans = (self.rows, self.cols)[axis].spans(first, last)
+        for index in self._cells:
+            position = index[axis]
+            if any(lo <= position < lo + length for _, lo, length in spans):
+                yield self.logical(index)
+        if axis == 0:
+            for col, column in self._columns.items():
+                col = self.cols.logical(col)
+                for start, lo, length in spans:
+                    for row in column.rows(lo, lo + length - 1):
+                        yield Index(start + row - lo, col)
+        else:
+            for start, lo, length in spans:
+                for col in range(lo, lo + length):
+                    column = self._columns.get(col)
+                    if column is not None:
+                        for row in column.rows():
+                            yield Index(self.rows.logical(row), start + col - lo)
+
+    def shift(self, shift):
+        """Insert or delete rows or columns as the `structure.Shift` `shift`
+        says, dropping the cells of deleted ones. The other cells stay where
+        they are stored; only the map of positions changes."""
+        axis = (self.rows, self.cols)[shift.axis]
+        if shift.count > 0:
+            axis = axis.inserted(shift.at, shift.count)
+        else:
+            count = -shift.count
+            self._drop(shift.axis, axis.spans(shift.at, shift.at + count - 1))
+            axis = axis.deleted(shift.at, count)
+        if shift.axis == 0:
+            self.rows = axis
+        else:
+            self.cols = axis
+        self._identity = self.rows.identity and self.cols.identity
+
+    def _drop(self, axis, spans):
+        """Drop the cells stored at the physical positions of `spans` (see
+        `structure.Axis.spans`) along `axis`."""
+        ranges = [(lo, lo + length - 1) for _, lo, length in spans]
+        for index in [
+            index
+            for index in self._cells
+            if any(lo <= index[axis] <= hi for lo, hi in ranges)
+        ]:
+            del self._cells[index]
+        for lo, hi in ranges:
+            if axis == 0:
+                for column in self._columns.values():
+                    column.clear_rows(lo, hi)
+            else:
+                for col in range(lo, hi + 1):
+                    self._columns.pop(col, None)
+
+    def __len__(self):
+        return len(self._cells) + sum(c.count for c in self._columns.values())
+
+    def load_columns(self, row, texts, columns):
+        """Store the cells of rows from `row` down, over rows past the last
+        cell of each column, from an ``array('i')`` of codes per column from
+        column A: 0 for no cell, 1 for an empty cell, or 2 + i for a plain
+        cell holding ``texts[i]``.
+
+        `texts` are added to the table without looking for them among the
+        texts already there. A file loaded in chunks mostly brings new texts
+        with each chunk, and the few repeated ones cost less than looking up
+        every text.
+
+        The rows from `row` down must be stored one after the other, after
+        every other row: see `structure.Axis.contiguous_from`.
+
+        >>> cells = CellStore()
+        >>> cells.load_columns(2, ["x", "y"], [array("i"), array("i", [3, 0, 1, 2])])
+        >>> [cells.plain(Index(row, 1)) for row in range(2, 6)], len(cells)
+        (['y', None, None, 'x'], 3)
+        """
+        base = len(self._texts)
+        self._texts.extend(texts)
+        mapping = array("i", [_MISSING, _EMPTY])
+        mapping.extend(range(base, base + len(texts)))
+        row = self.rows.physical(row)
+        for col, codes in enumerate(columns):
+            col = self.cols.physical(col)
+            column = self._columns.get(col)
+            if column is None:
+                column = self._columns[col] = _Codes(row)
+            column.load(row, array("i", map(mapping.__getitem__, codes)))
+
+    def _intern(self, text):
+        """Return the code of `text`, adding it to the table if needed."""
+        code = self._codes.get(text)
+        if code is None:
+            code = self._codes[text] = len(self._texts)
+            self._texts.append(text)
+        return code
+
+    def _encode(self, index, code):
+        """Store `code` for the cell at `index`. Returns False if the cell is
+        too far from the column's other encoded cells."""
+        column = self._columns.get(index.col)
+        if column is None:
+            column = self._columns[index.col] = _Codes(index.row)
+        return column.set(index.row, code)
@@ -0,0 +1,294 @@
+"""Summaries of the formatted values of a column, kept up to date as it
+changes.
+
+Fitting a column's width to its values, or adding up a selection, by reading
+every cell would cost a scan of the column on every frame. Instead, each
+column the viewer asks about gets a `ColumnStats`, which reads the column
+once and then keeps a `Summary` per block of `BLOCK` rows. The engine tells
+it which rows changed (see `ColumnStats.discard`), and which were evaluated
+since they were read (see `ColumnStats.evaluated`). Only
+those rows are read again, and only their blocks summarized again, the next
+time the column is summarized. A range of rows is summarized from the
+summaries of the blocks it covers, plus the rows at either end.
+
+Only values already known are read (see `Spreadsheet.get_cached`), so that
+fitting a column doesn't evaluate every formula in it: formulas not evaluated
+yet count as blanks until the viewer draws them. Summarizing a selection
+evaluates the rows selected.
+"""
+
+from collections import defaultdict
+from typing import NamedTuple
+
+from . import errors as err
+from .formula import coerce
+from .models import Index
+
+__all__ = ["BLOCK", "ColumnStats", "Summary", "combine", "summarize"]
+
+# Rows per block
+BLOCK = 1024
+
+
+class Summary(NamedTuple):
+    """The counts and totals of some formatted values. Blanks only count
+    towards `width`, as 0."""
+
+    cells: int
+    """The number of values that aren't blank."""
+    numbers: int
+    """The number of numeric values."""
+    errors: int
+    """The number of error codes."""
+    total: float
+    """The sum of the numbers."""
+    min: float
+    """The smallest number, or None."""
+    max: float
+    """The largest number, or None."""
+    width: int
+    """The length of the longest value."""
+
+    @property
+    def text(self):
+        """The number of values that are neither numbers nor errors."""
+        return self.cells - self.numbers - self.errors
+
+    @property
+    def average(self):
+        """The average of the numbers, or None."""
+        return self.total / self.numbers if self.numbers else None
+
+
+EMPTY = Summary(0, 0, 0, 0, None, None, 0)
+
+
+def summarize(values, kinds=None):
+    """Return the `Summary` of the formatted `values`, in which None counts
+    as a blank.
+
+    `kinds` caches what each distinct value counts as, and can be shared
+    between calls.
+
+    >>> summarize(["3", "x", "", "#N/A", "1.5"])
+    Summary(cells=4, numbers=2, errors=1, total=4.5, min=1.5, max=3, width=4)
+    """
+    if kinds is None:
+        kinds = {}
+    cells = errors = width = 0
+    numbers = []
+    for value in values:
+        if not value:
+            continue
+        kind = kinds.get(value)
+        if kind is None:
+            kind = kinds[value] = _kind(value)
+        cells += 1
+        if kind[0] > width:
+            width = kind[0]
+        if kind[1] is _ERROR:
+            errors += 1
+        elif kind[1] is not None:
+            numbers.append(kind[1])
+    if not numbers:
+        return Summary(cells, 0, errors, 0, None, None, width)
+    return Summary(
+        cells, len(numbers), errors, sum(numbers), min(numbers), max(numbers), width
+    )
+
+
+def combine(summaries):
+    """Return the `Summary` of all the values summarized by `summaries`.
+
+    >>> combine([summarize(["1", "22"]), EMPTY, summarize(["x"])])
+    Summary(cells=3, numbers=2, errors=0, total=23, min=1, max=22, width=2)
+    """
+    summaries = list(summaries)
+    numeric = [s for s in summaries if s.numbers]
+    if not numeric:
+        return Summary(
+            sum(s.cells for s in summaries),
+            0,
+            sum(s.errors for s in summaries),
+            0,
+            None,
+            None,
+            max((s.width for s in summaries), default=0),
+        )
+    return Summary(
+        sum(s.cells for s in summaries),
+        sum(s.numbers for s in numeric),
+        sum(s.errors for s in summaries),
+        sum(s.total for s in numeric),
+        min(s.min for s in numeric),
+        max(s.max for s in numeric),
+        max(s.width for s in summaries),
+    )
+
+
+_ERROR = object()
+
+
+def _kind(value):
+    """Return ``(width, number)`` for a formatted value, with `_ERROR` as
+    the number of error codes and None that of text."""
+    if err.is_error(value):
+        return (len(value), _ERROR)
+    number = coerce(value)
+    return (len(value), None if isinstance(number, str) else number)
+
+
+class ColumnStats:
+    """Summaries of the formatted values of column `col` of a sheet.
+
+    >>> from sheet.engine import Spreadsheet
+    >>> sheet = Spreadsheet()
+    >>> for row, value in enumerate(["4", "pear", "=A1*2"]):
+    ...     sheet.set(Index(row, 0), value)
+    >>> stats = ColumnStats(sheet, 0)
+    >>> stats.summary().total, stats.summary(1, 2).width
+    (4, 4)
+    >>> stats.summary(1, 2, evaluate=True).total, stats.summary().total
+    (8, 12)
+    """
+
+    def __init__(self, sheet, col):
+        self.sheet = sheet
+        self.col = col
+        # The formatted value of each row, from the first to the last one
+        # read, or None if it wasn't evaluated when read
+        self._values = []
+        # block -> the rows of that block whose values are None
+        self._unevaluated = defaultdict(set)
+        self._store(0, self._read(0, sheet.last_row(col)))
+        # The Summary of each block of rows, or None if it changed since
+        self._blocks = [None] * -(-len(self._values) // BLOCK)
+        # Rows whose values may have changed, or been evaluated, since they
+        # were read
+        self._stale = set()
+        # The Summary of the whole column, or None if it changed since
+        self._total = None
+        # Formatted value -> what it counts as, see `summarize`
+        self._kinds = {}
+
+    def discard(self, row):
+        """Note that the value at `row` may have changed."""
+        self._stale.add(row)
+        if row < len(self._values):
+            self._blocks[row // BLOCK] = None
+        self._total = None
+
+    def evaluated(self, row):
+        """Note that the value at `row` was evaluated, in case it wasn't when
+        it was read."""
+        if row in self._unevaluated.get(row // BLOCK, ()):
+            self.discard(row)
+
+    def shift(self, at, count):
+        """Move the rows from `at` on by `count` rows, inserting empty rows
+        before `at`, or if `count` is negative, deleting ``-count`` rows from
+        `at` on."""
+        values = self._values
+        if at < len(values):
+            if count > 0:
+                values[at:at] = [""] * count
+            else:
+                del values[at : at - count]
+            first_block = at // BLOCK
+            blocks = -(-len(values) // BLOCK)
+            self._blocks[first_block:] = [None] * (blocks - first_block)
+        self._stale = {
+            row if row < at else row + count
+            for row in self._stale
+            if row < at or row >= at - count
+        }
+        unevaluated = defaultdict(set)
+        for rows in self._unevaluated.values():
+            for row in rows:
+                if row < at or row >= at - count:
+                    row = row if row < at else row + count
+                    unevaluated[row // BLOCK].add(row)
+        self._unevaluated = unevaluated
+        self._total = None
+
+    def summary(self, first_row=0, last_row=None, evaluate=False):
+        """Return the `Summary` of the values from `first_row` to `last_row`,
+        or to the last row holding anything if `last_row` is None.
+
+        Rows not evaluated yet count as blanks, unless `evaluate` is True:
+        then those from `first_row` to `last_row` are evaluated first."""
+        self._refresh()
+        if last_row is None or last_row >= len(self._values):
+            last_row = len(self._values) - 1
+        if evaluate:
+            self._evaluate(first_row, last_row)
+        if first_row == 0 and last_row == len(self._values) - 1:
+            if self._total is None:
+                self._total = self._summarize(0, last_row)
+            return self._total
+        return self._summarize(first_row, last_row)
+
+    def _summarize(self, first_row, last_row):
+        if first_row > last_row:
+            return EMPTY
+        first_block = -(-first_row // BLOCK)
+        last_block = (last_row + 1) // BLOCK
+        if first_block >= last_block:
+            return summarize(self._values[first_row : last_row + 1], self._kinds)
+        parts = [
+            summarize(self._values[first_row : first_block * BLOCK], self._kinds),
+            summarize(self._values[last_block * BLOCK : last_row + 1], self._kinds),
+        ]
+        for block in range(first_block, last_block):
+            summary = self._blocks[block]
+            if summary is None:
+                start = block * BLOCK
+                values = self._values[start : start + BLOCK]
+                summary = self._blocks[block] = summarize(values, self._kinds)
+            parts.append(summary)
+        return combine(parts)
+
+    def _refresh(self):
+        """Read the rows that changed again."""
+        if not self._stale:
+            return
+        stale, self._stale = self._stale, set()
+        values = self._values
+        last = max(stale)
+        if last >= len(values):
+            values.extend([""] * (last + 1 - len(values)))
+            blocks = -(-len(values) // BLOCK)
+            self._blocks.extend([None] * (blocks - len(self._blocks)))
+        for row in stale:
+            self._store(row, self._read(row, row))
+            self._blocks[row // BLOCK] = None
+        self._total = None
+
+    def _evaluate(self, first_row, last_row):
+        """Evaluate the rows from `first_row` to `last_row` that weren't
+        evaluated when read."""
+        get_formatted = self.sheet.get_formatted
+        for block in range(first_row // BLOCK, last_row // BLOCK + 1):
+            rows = self._unevaluated.get(block)
+            if not rows:
+                continue
+            for row in [row for row in rows if first_row <= row <= last_row]:
+                self._values[row] = get_formatted(Index(row, self.col))
+                rows.discard(row)
+            self._blocks[block] = None
+            self._total = None
+
+    def _read(self, first_row, last_row):
+        get_cached = self.sheet.get_cached
+        return [
+            get_cached(Index(row, self.col)) for row in range(first_row, last_row + 1)
+        ]
+
+    def _store(self, first_row, values):
+        """Store `values`, read from `first_row` down."""
+        self._values[first_row : first_row + len(values)] = values
+        for row, value in enumerate(values, first_row):
+            if value is None:
+                self._unevaluated[row // BLOCK].add(row)
+            elif row in self._unevaluated.get(row // BLOCK, ()):
+                self._unevaluated[row // BLOCK].discard(row)
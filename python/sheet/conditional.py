@@ -0,0 +1,218 @@
+"""Conditional aggregates (SUMIF, COUNTIF, AVERAGEIF) over indexed columns.
+
+A criterion like ``"apple"``, ``5``, ``"<>0"`` or ``">100"`` selects rows
+of a single-column criteria range. Instead of scanning the range, each
+function asks the `lookup.ColumnIndex` of the column, which the lookup
+functions and every other conditional aggregate over the same column share:
+
+- ``=`` criteria are a dict lookup plus a binary search for the rows inside
+  the range;
+- ``<``, ``<=``, ``>`` and ``>=`` criteria are a binary search in the
+  column's `ColumnIndex.sorted` values, which also keeps the sums needed by
+  ``SUMIF`` over the criteria range itself;
+- ``<>`` criteria count the rest of the range.
+
+Indexes are patched row by row as cells change (see `ColumnIndex.discard`),
+so recalculating a thousand SUMIFs after an edit doesn't rescan the column.
+Other ranges, like multi-column or computed arrays, are scanned.
+"""
+
+import operator
+import re
+
+from . import errors as err
+from .arrays import Array, RangeArray
+from .formula import coerce, function
+from .lookup import ERROR_KEYS, value_key
+
+__all__ = ["matching_rows", "parse_criterion"]
+
+CRITERION_RE = re.compile(r"(<=|>=|<>|<|>|=)?(.*)", re.DOTALL)
+
+_OPERATORS = {
+    "=": operator.eq,
+    "<>": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def parse_criterion(criterion):
+    """Return the comparison operator and the `lookup.value_key` of the value that
+    `criterion` compares cells with.
+
+    >>> parse_criterion(">100"), parse_criterion("Apple"), parse_criterion(3)
+    (('>', (1, 100)), ('=', (2, 'apple')), ('=', (1, 3)))
+    >>> parse_criterion("<>")
+    ('<>', (0, 0))
+    """
+    if isinstance(criterion, Array):
+        criterion = criterion.columns[0][0]
+    if err.is_error(criterion):
+        raise err.FormulaError(criterion)
+    if not isinstance(criterion, str):
+        return "=", value_key(criterion)
+    op, operand = CRITERION_RE.fullmatch(criterion).groups()
+    return op or "=", value_key(coerce(operand))
+
+
+def _matches(op, key, value_key):
+    """Return True if a cell whose value has the key `value_key` meets the
+    criterion ``(op, key)``. Values are only ordered against values of the
+    same type, as in Excel."""
+    if op not in ("=", "<>") and value_key[0] != key[0]:
+        return False
+    return _OPERATORS[op](value_key, key)
+
+
+def _aggregate(criteria, criterion, sum_range=None):
+    """Return ``(count, numbers, total)``: the number of cells in `criteria`
+    meeting `criterion`, and the count and sum of the numbers in the same
+    positions of `sum_range` (or `criteria` itself)."""
+    op, key = parse_criterion(criterion)
+    if isinstance(criteria, RangeArray) and criteria.width == 1:
+        index = criteria.sheet.column_index(criteria.range.first.col)
+        if not index.busy:
+            return _aggregate_indexed(index, criteria, op, key, sum_range)
+    return _aggregate_scanned(criteria, op, key, sum_range)
+
+
+def _aggregate_indexed(index, criteria, op, key, sum_range):
+    first, last = criteria.range
+    visited_cells = criteria.visited_cells
+    same_cells = sum_range is None or (
+        isinstance(sum_range, RangeArray) and sum_range.range == criteria.range
+    )
+    if op == "=" and same_cells:
+        rows = index.rows_with(key, first.row, last.row, visited_cells)
+        numbers = len(rows) if key[0] == 1 else 0
+        return len(rows), numbers, numbers and key[1] * numbers
+    if op == "<>" and sum_range is None and key[0] != 1 and key not in ERROR_KEYS:
+        # Excluding non-numbers doesn't change the sum of the numbers.
+        excluded = index.rows_with(key, first.row, last.row, visited_cells)
+        keys = index.keys(first.row, last.row, visited_cells)
+        return (criteria.height - len(excluded),) + _sum_keys(keys)
+    if op not in ("=", "<>") and key[0] != 0 and same_cells:
+        items = index.sorted(first.row, last.row, visited_cells)
+        if first.row <= index.lo and index.hi <= last.row:
+            # The index covers just this range.
+            start, stop = _bounds(items, op, key)
+            numbers = stop - start if key[0] == 1 else 0
+            return stop - start, numbers, items.sum(start, stop)
+    rows = matching_rows(index, op, key, first.row, last.row, visited_cells)
+    offsets = [row - first.row for row in rows]
+    return (len(rows),) + _sum_rows(sum_range or criteria, offsets)
+
+
+def matching_rows(index, op, key, first_row, last_row, visited_cells=None):
+    """Return the rows from `first_row` to `last_row`, in order, whose values
+    in the column of `index`, a `lookup.ColumnIndex`, meet the criterion
+    ``(op, key)`` returned by `parse_criterion`."""
+    if op == "=":
+        return index.rows_with(key, first_row, last_row, visited_cells)
+    if op == "<>":
+        excluded = set(index.rows_with(key, first_row, last_row, visited_cells))
+        return [row for row in range(first_row, last_row + 1) if row not in excluded]
+    if key[0] == 0:
+        # Blanks are neither less nor greater than anything.
+        return []
+    items = index.sorted(first_row, last_row, visited_cells)
+    start, stop = _bounds(items, op, key)
+    if first_row <= index.lo and index.hi <= last_row:
+        return sorted(row for _, row in items.islice(start, stop))
+    if stop - start < last_row - first_row + 1:
+        return sorted(
+            row for _, row in items.islice(start, stop) if first_row <= row <= last_row
+        )
+    keys = index.keys(first_row, last_row, visited_cells)
+    return [
+        row
+        for row, value_key in enumerate(keys, first_row)
+        if _matches(op, key, value_key)
+    ]
+
+
+def _bounds(items, op, key):
+    """Return the positions in `items`, a `ColumnIndex.sorted` list, of the
+    first and after the last value of the type of `key` meeting ``(op,
+    key)``."""
+    lowest = items.bisect_left(((key[0],),))
+    highest = items.bisect_left(((key[0] + 1,),))
+    below = items.bisect_left((key, -1))
+    above = items.bisect_left((key, float("inf")))
+    return {
+        "<": (lowest, below),
+        "<=": (lowest, above),
+        ">": (above, highest),
+        ">=": (below, highest),
+    }[op]
+
+
+def _sum_rows(sum_range, offsets):
+    """Sum the numbers at `offsets` down the first column of `sum_range`."""
+    if not offsets:
+        return 0, 0
+    if isinstance(sum_range, RangeArray):
+        first = sum_range.range.first
+        index = sum_range.sheet.column_index(first.col)
+        if not index.busy:
+            last_row = first.row + offsets[-1]
+            keys = index.keys(first.row, last_row, sum_range.visited_cells)
+            return _sum_keys(keys[offset] for offset in offsets)
+    column = sum_range.columns[0]
+    return _sum_keys(
+        value_key(column[offset]) for offset in offsets if offset < len(column)
+    )
+
+
+def _sum_keys(keys):
+    """Return the count and sum of the numbers among `keys`."""
+    numbers = total = 0
+    for key in keys:
+        if key[0] == 1:
+            numbers += 1
+            total += key[1]
+        elif key in ERROR_KEYS:
+            raise err.FormulaError(ERROR_KEYS[key])
+    return numbers, total
+
+
+def _aggregate_scanned(criteria, op, key, sum_range):
+    if sum_range is None:
+        sum_range = criteria
+    elif (sum_range.height, sum_range.width) != (criteria.height, criteria.width):
+        raise err.FormulaError(err.VALUE)
+    count = 0
+    selected = []
+    for column, sum_column in zip(criteria.columns, sum_range.columns):
+        for value, summed in zip(column, sum_column):
+            if _matches(op, key, value_key(value)):
+                count += 1
+                selected.append(value_key(summed))
+    return (count,) + _sum_keys(selected)
+
+
+@function("COUNTIF")
+def countif(criteria, criterion):
+    """Count the cells in `criteria` meeting `criterion`."""
+    count, _, _ = _aggregate(criteria, criterion)
+    return count
+
+
+@function("SUMIF")
+def sumif(criteria, criterion, sum_range=None):
+    """Sum the numbers in `sum_range` (or `criteria`) in the rows where
+    `criteria` meets `criterion`."""
+    _, _, total = _aggregate(criteria, criterion, sum_range)
+    return total
+
+
+@function("AVERAGEIF")
+def averageif(criteria, criterion, average_range=None):
+    """The average of the numbers that `SUMIF` would add up."""
+    _, numbers, total = _aggregate(criteria, criterion, average_range)
+    if not numbers:
+        return err.DIV0
+    return total / numbers
@@ -0,0 +1,136 @@
+"""Load large CSV files with a pool of worker processes.
+
+`csv.reader` parses a few hundred thousand cells a second on one core, so
+`import_csv` splits the file into chunks that each start at the beginning
+of a row (see `split_csv`) and parses them in parallel. Each worker returns
+its chunk dictionary-encoded, as `CellStore` keeps plain cells: a table of
+its distinct texts and an ``array('i')`` of codes per column, which cost a
+few bytes per cell to send back instead of a Python string each. Chunks are
+stored in the sheet in row order as they come back, while the workers
+carry on with the next ones.
+"""
+
+import contextlib
+import csv
+import io
+import multiprocessing
+import os
+from array import array
+
+from .cellstore import decode_columns
+from .engine import Spreadsheet
+from .models import Index
+
+__all__ = ["import_csv", "split_csv"]
+
+# Smallest chunk worth sending to a worker, in bytes
+MIN_CHUNK = 1 << 20
+
+# Bytes read at a time while counting quotes
+_BLOCK = 1 << 20
+
+
+def split_csv(path, count):
+    """Return up to `count` ``(start, end)`` byte ranges of the CSV file at
+    `path`, covering all of it, that each begin at the start of a row.
+
+    A newline ends a row only outside quotes, and quotes only ever appear in
+    pairs around or inside a quoted value, so a newline ends a row if the
+    number of quotes before it is even. Finding the boundaries counts the
+    quotes of the whole file, which is much faster than parsing it.
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        # The number of quotes in the bytes before `pos`
+        quotes = pos = 0
+        for n in range(1, count):
+            target = size * n // count
+            if target <= bounds[-1]:
+                continue
+            while pos < target:
+                block = f.read(min(_BLOCK, target - pos))
+                quotes += block.count(b'"')
+                pos += len(block)
+            while True:
+                line = f.readline()
+                quotes += line.count(b'"')
+                pos += len(line)
+                if not line or quotes % 2 == 0:
+                    break
+            if pos >= size:
+                break
+            bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _parse_chunk(job):
+    """Parse the rows in bytes `start` to `end` of the CSV file at `path`.
+
+    Returns:
+        tuple: the number of rows, the chunk's distinct texts, an
+        ``array('i')`` of codes per column as taken by
+        `Spreadsheet.load_columns`, and ``(row, col, raw)`` for each formula,
+        with rows counted from the start of the chunk.
+    """
+    path, start, end = job
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    text = data.decode("utf-8", errors="replace")
+    codes = {}
+    columns = []
+    formulas = []
+    rows = 0
+    for row, values in enumerate(csv.reader(io.StringIO(text, newline=""))):
+        rows += 1
+        for col, value in enumerate(values):
+            if col == len(columns):
+                columns.append(array("i", [0]) * row)
+            if not value:
+                code = 1
+            elif value[0] == "=":
+                formulas.append((row, col, value))
+                code = 0
+            else:
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(codes) + 2
+            columns[col].append(code)
+        for col in range(len(values), len(columns)):
+            columns[col].append(0)
+    return rows, list(codes), columns, formulas
+
+
+def import_csv(path, sheet, workers=None):
+    """Set the cells of `sheet` from the CSV file at `path`, from row 1 down,
+    in one batch, parsing the file with up to `workers` processes (by
+    default, one per CPU).
+
+    Returns:
+        int: the number of rows read.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = max(1, min(os.path.getsize(path) // MIN_CHUNK, 4 * workers))
+    jobs = [(path, start, end) for start, end in split_csv(path, chunks)]
+    first_row = 0
+    with sheet.batch(), contextlib.ExitStack() as stack:
+        results = map(_parse_chunk, jobs)
+        if workers > 1 and len(jobs) > 1:
+            pool = stack.enter_context(multiprocessing.Pool(min(workers, len(jobs))))
+            results = pool.imap(_parse_chunk, jobs)
+        for rows, texts, columns, formulas in results:
+            _store(sheet, first_row, texts, columns, formulas)
+            first_row += rows
+    return first_row
+
+
+def _store(sheet, first_row, texts, columns, formulas):
+    if isinstance(sheet, Spreadsheet):
+        sheet.load_columns(first_row, texts, columns)
+    else:
+        for index, raw in decode_columns(first_row, texts, columns):
+            sheet.set(index, raw)
+    for row, col, raw in formulas:
+        sheet.set(Index(first_row + row, col), raw)
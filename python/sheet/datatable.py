@@ -0,0 +1,94 @@
+"""What-if data tables: a sheet's outputs for many values of its inputs.
+
+A sensitivity analysis sets one or two input cells to each of hundreds of
+values in turn and records some output cells each time. Doing it with `set`
+would commit, and recalculate, hundreds of versions of the sheet. Instead,
+`data_table` evaluates every scenario on a `engine.Fork` of the sheet, which
+only evaluates again the cells computed from the inputs and reads everything
+else from a snapshot, and leaves the sheet itself alone.
+
+Scenarios are spread across a pool of worker processes. The workers are
+forked from this one once the first scenario has been evaluated here, so
+they start with the fork, and with every value it read from the snapshot,
+without copying anything until they write to it. Only the outputs of each
+scenario are sent back. Where processes can't be forked, every scenario is
+evaluated here.
+"""
+
+import contextlib
+import multiprocessing
+import os
+
+from .models import Index
+
+__all__ = ["data_table"]
+
+# The Fork, inputs and outputs of the table being evaluated, for the worker
+# processes to inherit
+_table = None
+
+
+def data_table(sheet, inputs, scenarios, outputs, target=None, workers=None):
+    """Evaluate the cells `outputs` of `sheet` with its cells `inputs` set to
+    each scenario of `scenarios` in turn, a raw value per input, with up to
+    `workers` processes (by default, one per CPU).
+
+    If `target` is given, a row per scenario is written from there down, in
+    one batch: its values of the inputs, then those of the outputs.
+
+    >>> from sheet.engine import Spreadsheet
+    >>> sheet = Spreadsheet()
+    >>> sheet.set(Index(0, 0), "100")
+    >>> sheet.set(Index(0, 1), "5")
+    >>> sheet.set(Index(0, 2), "=A1*B1")
+    >>> data_table(sheet, [Index(0, 1)], [["2"], ["3"]], [Index(0, 2)], workers=1)
+    [['200'], ['300']]
+    >>> sheet.get_formatted(Index(0, 2))
+    '500'
+
+    Returns:
+        list: the formatted values of `outputs` for each scenario.
+
+    Raises:
+        ValueError: if a scenario hasn't one value per input.
+    """
+    global _table
+    inputs = list(inputs)
+    outputs = list(outputs)
+    scenarios = [list(scenario) for scenario in scenarios]
+    for scenario in scenarios:
+        if len(scenario) != len(inputs):
+            raise ValueError(f"{scenario} doesn't have a value per input")
+    workers = workers or os.cpu_count() or 1
+    _table = (sheet.fork(inputs), inputs, outputs)
+    try:
+        with contextlib.ExitStack() as stack:
+            results = list(map(_evaluate, scenarios[:1]))
+            rest = scenarios[1:]
+            if workers > 1 and len(rest) > 1 and _can_fork():
+                context = multiprocessing.get_context("fork")
+                pool = stack.enter_context(context.Pool(min(workers, len(rest))))
+                chunksize = -(-len(rest) // (4 * workers))
+                results.extend(pool.imap(_evaluate, rest, chunksize))
+            else:
+                results.extend(map(_evaluate, rest))
+    finally:
+        _table = None
+    if target is not None:
+        with sheet.batch():
+            for row, (scenario, values) in enumerate(zip(scenarios, results)):
+                for col, raw in enumerate(scenario + values):
+                    sheet.set(target + (row, col), raw)
+    return results
+
+
+def _can_fork():
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def _evaluate(scenario):
+    """Return the outputs of the table being evaluated for `scenario`."""
+    fork, inputs, outputs = _table
+    for index, raw in zip(inputs, scenario):
+        fork.set(index, raw)
+    return [fork.get_formatted(index) for index in outputs]
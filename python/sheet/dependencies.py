@@ -0,0 +1,252 @@
+"""Tracking which formula cells reference which other cells."""
+
+import bisect
+from collections import defaultdict
+
+from .models import Index, Range
+
+__all__ = ["DependencyGraph"]
+
+
+class DependencyGraph:
+    """The references between cells, in both directions.
+
+    Single-cell references are stored as direct edges. Each distinct range
+    is stored once with the set of formulas reading it, and indexed by the
+    rows it covers in each of its columns (see `_Intervals`), so finding the
+    dependents of a cell doesn't have to check every range in its column.
+
+    >>> from sheet.models import Index, Range
+    >>> graph = DependencyGraph()
+    >>> graph.set_precedents(Index(0, 2), [Index(0, 0)], [Range.parse("B1:B9")])
+    >>> graph.dependents(Index(0, 0)) == graph.dependents(Index(4, 1)) == {Index(0, 2)}
+    True
+    >>> graph.dependents(Index(4, 0))
+    set()
+    """
+
+    def __init__(self):
+        # formula Index -> (refs, ranges) it reads
+        self._precedents = {}
+        # referenced Index -> set of formula Indexes
+        self._dependents = defaultdict(set)
+        # Range -> set of formula Indexes reading it
+        self._range_readers = {}
+        # column -> _Intervals of the Ranges covering that column
+        self._range_rows = defaultdict(_Intervals)
+        # column -> {SharedFormula: [Range, ...]}, like `_range_dependents` but
+        # the ranges are those read by the first row of the shared formula
+        self._shared_dependents = defaultdict(dict)
+        # SharedFormula -> the columns it has entries for
+        self._shared_columns = {}
+        # Incremented whenever a reference is added or removed
+        self.version = 0
+
+    def set_precedents(self, index, refs=(), ranges=()):
+        """Replace the cells and ranges that the formula at `index` reads."""
+        self.remove(index)
+        if not refs and not ranges:
+            return
+        self.version += 1
+        self._precedents[index] = (tuple(refs), tuple(ranges))
+        for ref in refs:
+            self._dependents[ref].add(index)
+        for rng in ranges:
+            readers = self._range_readers.get(rng)
+            if readers is None:
+                readers = self._range_readers[rng] = set()
+                for col in range(rng.first.col, rng.last.col + 1):
+                    self._range_rows[col].add(rng.first.row, rng.last.row, rng)
+            readers.add(index)
+
+    def remove(self, index):
+        """Forget everything that the cell at `index` reads."""
+        entry = self._precedents.pop(index, None)
+        if entry is None:
+            return
+        self.version += 1
+        refs, ranges = entry
+        for ref in refs:
+            dependents = self._dependents[ref]
+            dependents.discard(index)
+            if not dependents:
+                del self._dependents[ref]
+        for rng in ranges:
+            readers = self._range_readers.get(rng)
+            if readers is None:
+                # The formula read the same range twice.
+                continue
+            readers.discard(index)
+            if readers:
+                continue
+            del self._range_readers[rng]
+            for col in range(rng.first.col, rng.last.col + 1):
+                intervals = self._range_rows[col]
+                intervals.remove(rng.first.row, rng.last.row, rng)
+                if not intervals:
+                    del self._range_rows[col]
+
+    def set_shared_precedents(self, shared):
+        """Record the references of every row of a `SharedFormula`.
+
+        The edges are stored once for the whole run of rows, so a copy of
+        `shared` with another `last_row` can take them over with
+        `replace_shared`.
+        """
+        self.version += 1
+        columns = set()
+        for rng in _shared_ranges(shared):
+            for col in range(rng.first.col, rng.last.col + 1):
+                self._shared_dependents[col].setdefault(shared, []).append(rng)
+                columns.add(col)
+        self._shared_columns[shared] = columns
+
+    def replace_shared(self, old, new):
+        """Move the references of `old` to `new`, a SharedFormula with the same
+        formula and first row."""
+        self.version += 1
+        columns = self._shared_columns.pop(old)
+        for col in columns:
+            bucket = self._shared_dependents[col]
+            bucket[new] = bucket.pop(old)
+        self._shared_columns[new] = columns
+
+    def remove_shared(self, shared):
+        """Forget the references of a `SharedFormula`."""
+        self.version += 1
+        for col in self._shared_columns.pop(shared, ()):
+            bucket = self._shared_dependents[col]
+            bucket.pop(shared, None)
+            if not bucket:
+                del self._shared_dependents[col]
+
+    def formulas(self):
+        """Return the set of formula cells whose references were recorded
+        with `set_precedents`."""
+        return set(self._precedents)
+
+    def precedents(self, index):
+        """Return ``(refs, ranges)`` read by the formula at `index`."""
+        return self._precedents.get(index, ((), ()))
+
+    def dependents(self, index, seen=None):
+        """Return the set of formula cells that directly read `index`.
+
+        A caller asking about many cells, like an invalidation walk, can pass
+        the same dict as `seen` to every call: the readers of a range are then
+        only returned the first time, instead of once per cell in the range.
+
+        >>> graph = DependencyGraph()
+        >>> for row in range(3):
+        ...     graph.set_precedents(Index(row, 1), ranges=[Range.parse("A1:A3")])
+        >>> seen = {}
+        >>> len(graph.dependents(Index(0, 0), seen))
+        3
+        >>> graph.dependents(Index(1, 0), seen)
+        set()
+        """
+        result = set(self._dependents.get(index, ()))
+        intervals = self._range_rows.get(index.col)
+        if intervals:
+            for rng in intervals.containing(index.row):
+                if seen is not None:
+                    if rng in seen:
+                        continue
+                    seen[rng] = True
+                result.update(self._range_readers[rng])
+        bucket = self._shared_dependents.get(index.col)
+        if bucket:
+            for shared, ranges in bucket.items():
+                # Row first_row + k reads each range moved down k rows.
+                for rng in ranges:
+                    lo = max(index.row - rng.last.row, 0)
+                    hi = min(
+                        index.row - rng.first.row, shared.last_row - shared.first_row
+                    )
+                    if lo > hi:
+                        continue
+                    spans = [(lo, hi)]
+                    if seen is not None:
+                        spans = _unseen(seen, (shared, rng), lo, hi)
+                    for lo, hi in spans:
+                        result.update(
+                            Index(shared.first_row + k, shared.col)
+                            for k in range(lo, hi + 1)
+                        )
+        return result
+
+
+def _unseen(seen, key, lo, hi):
+    """Return the parts of ``lo..hi`` not returned before for `key`, and
+    remember them in `seen`.
+
+    Only one run of rows is remembered per key, so rows may occasionally be
+    returned twice, but a walk over neighbouring cells returns each row once.
+    """
+    known = seen.get(key)
+    if known is None:
+        seen[key] = (lo, hi)
+        return [(lo, hi)]
+    known_lo, known_hi = known
+    if hi < known_lo - 1 or lo > known_hi + 1:
+        seen[key] = (lo, hi)
+        return [(lo, hi)]
+    seen[key] = (min(lo, known_lo), max(hi, known_hi))
+    return [
+        span
+        for span in [(lo, min(hi, known_lo - 1)), (max(lo, known_hi + 1), hi)]
+        if span[0] <= span[1]
+    ]
+
+
+class _Intervals:
+    """Row intervals with a value each, found by the rows they contain.
+
+    Intervals are grouped by length in powers of two, and each group is kept
+    sorted by first row. An interval containing row ``r`` whose length is
+    less than ``2**(k + 1)`` starts after ``r - 2**(k + 1)``, so finding the
+    intervals containing a row is a binary search per group, followed by a
+    short scan.
+
+    >>> intervals = _Intervals()
+    >>> intervals.add(0, 9, "A1:A10")
+    >>> intervals.add(4, 4, "A5")
+    >>> intervals.add(6, 7, "A7:A8")
+    >>> sorted(intervals.containing(4)), sorted(intervals.containing(7))
+    (['A1:A10', 'A5'], ['A1:A10', 'A7:A8'])
+    >>> intervals.remove(0, 9, "A1:A10")
+    >>> list(intervals.containing(2))
+    []
+    """
+
+    def __init__(self):
+        # k -> sorted list of (first, last, value) with length < 2**(k + 1)
+        self._groups = {}
+
+    def __bool__(self):
+        return bool(self._groups)
+
+    def add(self, first, last, value):
+        k = (last - first + 1).bit_length() - 1
+        bisect.insort(self._groups.setdefault(k, []), (first, last, value))
+
+    def remove(self, first, last, value):
+        k = (last - first + 1).bit_length() - 1
+        group = self._groups[k]
+        del group[bisect.bisect_left(group, (first, last, value))]
+        if not group:
+            del self._groups[k]
+
+    def containing(self, row):
+        """Iterate over the values of the intervals containing `row`."""
+        for k, group in self._groups.items():
+            start = bisect.bisect_left(group, (row - 2 ** (k + 1) + 2,))
+            stop = bisect.bisect_left(group, (row + 1,))
+            for first, last, value in group[start:stop]:
+                if last >= row:
+                    yield value
+
+
+def _shared_ranges(shared):
+    formula = shared.formula
+    return [Range(ref, ref) for ref in formula.refs] + list(formula.ranges)
@@ -1,35 +1,126 @@
-__all__ = ["Spreadsheet"]
+__all__ = ["AUTOMATIC", "MANUAL", "Fork", "Spreadsheet", "Snapshot"]
 
-from .models import Index
-from .cell import Cell
+import bisect
+import collections
+import contextlib
+import copy
+import logging
+import threading
+import weakref
 
+from .arrays import Array
+from .cell import Cell, evaluate_formula
+from .cellstore import CellStore, decode_columns
+from .columnstats import ColumnStats, combine
+from .dependencies import DependencyGraph
+from .kernels import kernel
+from . import conditional, functions, moving, statistical  # register functions
+from .formula import coerce
+from .lookup import ColumnIndex
+from .models import Index, Range
+from .pivot import Pivot
+from .shared import SharedFormula, SharedFormulas
+from .structure import Shift
+from .subscriptions import Subscription
+from . import errors as err
 
-class Spreadsheet:
-    """The spreadsheet engine. This is your job to implement!
-    
-    These functions are called by the spreadsheet UI.  Each time a value or 
-    format is changed, `get_formatted` will be called for every cell in the 
-    spreadsheet in sequence.
-    """
+# Calculation modes, see `Spreadsheet.set_calculation`
+AUTOMATIC = "automatic"
+MANUAL = "manual"
 
-    def __init__(self):
-        # Initialize the spreadsheet engine.
-        self.cells = {}
-        pass
+
+class _Evaluator:
+    """Formula evaluation, shared by `Spreadsheet` and its `Snapshot` views.
+
+    Subclasses provide ``cells`` (a mapping of Index to Cell with a
+    `CellStore.plain` method), ``_shared``,
+    ``_spills``, ``_values``, ``_arrays``, ``_shared_in_progress``,
+    ``_unevaluated`` and ``_column_indexes`` as described in
+    `Spreadsheet.__init__`, plus `_lookup`,
+    `_store`, `_invalidate` and `_sheet_named`.
+    """
 
     def get_formatted(self, index, visited_cells=None):
         """Get the evaluated and formatted value at the given cell ref.
 
         Arguments:
             index (Index): the cell to evaluate
-            visited_cells (Cells): The cells already visited
+            visited_cells (set): the indices already being evaluated, used to
+                detect circular references
 
         Returns:
             str: the cell value, evaluated (if a formula) and formatted
             according to the format set with `set_format`.
         """
-        cell = self.cells.get(index, Cell())
-        return cell.get_formatted_data(self, visited_cells)
+        value = self._lookup(index)
+        if value is not None:
+            return value
+        if visited_cells is None:
+            visited_cells = set()
+        if index in visited_cells:
+            logging.warning("Circular reference detected.")
+            return err.CIRCULAR_REFERENCE
+        visited_cells.add(index)
+        try:
+            value = self._evaluate(index, visited_cells)
+        finally:
+            visited_cells.discard(index)
+        self._store(index, value)
+        return value
+
+    def get_array(self, cell_range, visited_cells=None):
+        """Get the evaluated values of every cell in a range.
+
+        Arguments:
+            cell_range (Range): the cells to evaluate
+            visited_cells (set): the cells already being evaluated
+
+        Returns:
+            Array: one buffer per column of the range, holding None for empty
+            cells, numbers for numeric cells and strings for everything else.
+        """
+        columns = []
+        first, last = cell_range
+        cells = self.cells
+        values = self._values
+        for col in range(first.col, last.col + 1):
+            column = []
+            for row in range(first.row, last.row + 1):
+                index = Index(row, col)
+                value = values.get(index)
+                if value is None:
+                    value = cells.plain(index)
+                    if value is None:
+                        value = self.get_formatted(index, visited_cells)
+                column.append(coerce(value))
+            columns.append(column)
+        return Array(columns)
+
+    def column_index(self, col):
+        """Return the `lookup.ColumnIndex` of column `col`, creating it the
+        first time a lookup searches the column."""
+        index = self._column_indexes.get(col)
+        if index is None:
+            index = self._column_indexes[col] = ColumnIndex(self, col)
+        return index
+
+    def external_sheet(self, name, visited_cells):
+        """Return the sheet called `name` in the same `workbook.Workbook`, or
+        None if there is none, and the visited set to read its cells with
+        from a formula evaluated with `visited_cells`.
+
+        The cells of other sheets are kept in the same set, as ``(name,
+        Index)``, so that a circular reference through several sheets is
+        found too.
+        """
+        sheet = self._sheet_named(name)
+        if sheet is None or sheet is self:
+            return sheet, visited_cells
+        if visited_cells is None:
+            visited_cells = set()
+        if isinstance(visited_cells, _SheetVisited):
+            visited_cells = visited_cells.cells
+        return sheet, _SheetVisited(visited_cells, name)
 
     def get_raw(self, index):
         """Get the raw text that the user entered into the given cell.
@@ -40,9 +131,604 @@ class Spreadsheet:
         Returns:
             str: the `raw` most recently set with `set`.
         """
-        # get the cell object
-        cell = self.cells.get(index, Cell())
-        return cell.get_raw_data()
+        cell = self.cells.get(index)
+        if cell is not None and cell.raw_data != "":
+            return cell.get_raw_data()
+        shared = self._shared.find(index)
+        return "" if shared is None else shared.raw(index)
+
+    def _evaluate(self, index, visited_cells):
+        cell = self.cells.get(index)
+        if cell is None or cell.raw_data == "":
+            shared = self._shared.find(index)
+            if shared is not None:
+                return self._evaluate_shared(shared, index, visited_cells)
+            return self._evaluate_spilled(index, cell, visited_cells)
+        value = cell.get_value(self, visited_cells)
+        if isinstance(value, Array):
+            value = self._spill(index, value)
+        return cell.apply_format(value)
+
+    def _spill(self, anchor, array):
+        """Record the result of the array formula at `anchor`, and return the
+        value shown in the anchor cell itself."""
+        spill = Range(anchor, anchor + (array.height - 1, array.width - 1))
+        anchor_cell = self.cells[anchor]
+        old_spill = self._spills.get(anchor)
+        self._spills[anchor] = spill
+        if old_spill is not None and old_spill != spill:
+            self._invalidate(i for i in old_spill.indices if i != anchor)
+        if any(self._shared.overlapping(spill)):
+            return err.SPILL
+        cells = self.cells
+        for col in range(spill.first.col, spill.last.col + 1):
+            for row in range(spill.first.row, spill.last.row + 1):
+                cell = cells.get(Index(row, col))
+                if cell is not None and cell.raw_data != "" and cell is not anchor_cell:
+                    return err.SPILL
+        self._arrays[anchor] = array
+        return array.display(0, 0)
+
+    def _evaluate_shared(self, shared, index, visited_cells):
+        """Evaluate every row of a shared formula that isn't cached yet, and
+        return the value at `index`.
+
+        Rows are evaluated top to bottom, so running totals like ``=C1+B2``
+        find the row above already cached instead of recursing through every
+        row above them. Arithmetic formulas that don't read their own column
+        are evaluated by a compiled `kernels.kernel` instead.
+        """
+        if shared in self._shared_in_progress:
+            # Reached from another row of the same batch.
+            return self._evaluate_shared_row(shared, index, visited_cells)
+        self._shared_in_progress.add(shared)
+        visited_cells.discard(index)
+        try:
+            rows = self._uncached_rows(shared, index)
+            compiled = kernel(shared.formula)
+            if compiled is not None and not any(
+                ref.col == shared.col for ref in shared.formula.refs
+            ):
+                self._evaluate_kernel(shared, compiled, rows, index, visited_cells)
+                return self._lookup(index)
+            for row in rows:
+                target = Index(row, shared.col)
+                if self._lookup(target) is not None:
+                    continue
+                # The cells being evaluated further up are only ancestors of
+                # the row asked for; reaching one from another row isn't a
+                # circular reference.
+                visited = visited_cells if target == index else set()
+                visited.add(target)
+                try:
+                    self._store(
+                        target,
+                        self._evaluate_shared_row(shared, target, visited),
+                    )
+                finally:
+                    visited.discard(target)
+        except BaseException:
+            # Some rows may be left unevaluated.
+            self._unevaluated.pop(shared, None)
+            raise
+        finally:
+            self._shared_in_progress.discard(shared)
+            visited_cells.add(index)
+        return self._lookup(index)
+
+    def _uncached_rows(self, shared, index):
+        """Return the rows of `shared` without a cached value, in order, the
+        row of `index` among them.
+
+        Once every row has been evaluated, the rows whose values are dropped
+        are noted in `_unevaluated` (see `_unevaluated_row`), so that the
+        next evaluation only looks at those instead of the whole run.
+        """
+        dropped = self._unevaluated.get(shared)
+        # Rows dropped from now on are noted for the next evaluation.
+        self._unevaluated[shared] = set()
+        if dropped is None or index.row not in dropped:
+            rows = range(shared.first_row, shared.last_row + 1)
+        else:
+            rows = sorted(
+                row for row in dropped if shared.first_row <= row <= shared.last_row
+            )
+        col = shared.col
+        return [row for row in rows if self._lookup(Index(row, col)) is None]
+
+    def _unevaluated_row(self, index):
+        """Note that the cached value at `index` was dropped, if a shared
+        formula covers it."""
+        if self._unevaluated:
+            shared = self._shared.find(index)
+            if shared is not None:
+                dropped = self._unevaluated.get(shared)
+                if dropped is not None:
+                    dropped.add(index.row)
+
+    def _evaluate_kernel(self, shared, compiled, rows, index, visited_cells):
+        """Evaluate the rows `rows` of `shared`, which aren't cached yet,
+        with its compiled kernel, reading each reference's column with
+        `get_array` for each run of consecutive rows.
+
+        As in `_evaluate_shared`, only the row at `index` is evaluated with
+        `visited_cells`; the columns, read for every row, get a set of their
+        own."""
+        start = 0
+        for i in range(1, len(rows) + 1):
+            if i == len(rows) or rows[i] != rows[i - 1] + 1:
+                self._evaluate_kernel_rows(
+                    shared, compiled, rows[start:i], index, visited_cells
+                )
+                start = i
+
+    def _evaluate_kernel_rows(self, shared, compiled, rows, index, visited_cells):
+        """Evaluate `rows`, consecutive rows of `shared`, for
+        `_evaluate_kernel`."""
+        col = shared.col
+        first = shared.offset(Index(rows[0], col))
+        last = shared.offset(Index(rows[-1], col))
+        columns = [
+            self.get_array(Range(ref + first, ref + last), set()).columns[0]
+            for ref in shared.formula.refs
+        ]
+
+        def fallback(i):
+            target = Index(rows[0] + i, col)
+            visited = visited_cells if target == index else set()
+            visited.add(target)
+            try:
+                return evaluate_formula(
+                    shared.formula, self, visited, shared.offset(target)
+                )
+            finally:
+                visited.discard(target)
+
+        values = compiled(columns, fallback)
+        cells = self.cells
+        for row in rows:
+            target = Index(row, col)
+            if self._lookup(target) is not None:
+                continue
+            value = values[row - rows[0]]
+            cell = cells.get(target)
+            self._store(target, value if cell is None else cell.apply_format(value))
+
+    def _evaluate_shared_row(self, shared, index, visited_cells):
+        value = evaluate_formula(
+            shared.formula, self, visited_cells, shared.offset(index)
+        )
+        if isinstance(value, Array):
+            # Array formulas are never shared, see `_share`.
+            value = err.VALUE
+        cell = self.cells.get(index)
+        return value if cell is None else cell.apply_format(value)
+
+    def _evaluate_spilled(self, index, cell, visited_cells):
+        """Evaluate an empty cell, which may be covered by an array formula."""
+        for anchor, spill in self._spills.items():
+            if anchor != index and spill.contains(index):
+                break
+        else:
+            return ""
+        # Evaluating the anchor stores its array in `self._arrays`.
+        self.get_formatted(anchor, visited_cells)
+        array = self._arrays.get(anchor)
+        offset = index - anchor
+        if array is None or offset.row >= array.height or offset.col >= array.width:
+            return ""
+        value = array.display(*offset)
+        return value if cell is None else cell.apply_format(value)
+
+
+class _SheetVisited:
+    """The cells of the sheet `name` in a visited set shared with other
+    sheets; see `_Evaluator.external_sheet`."""
+
+    __slots__ = ("cells", "name")
+
+    def __init__(self, cells, name):
+        self.cells = cells
+        self.name = name
+
+    def __contains__(self, index):
+        return (self.name, index) in self.cells
+
+    def add(self, index):
+        self.cells.add((self.name, index))
+
+    def discard(self, index):
+        self.cells.discard((self.name, index))
+
+
+class Spreadsheet(_Evaluator):
+    """The spreadsheet engine. This is your job to implement!
+
+    These functions are called by the spreadsheet UI.  Each time a value or
+    format is changed, `get_formatted` will be called for every cell in the
+    spreadsheet in sequence.
+
+    Formatted values are cached until the cell, or anything it references,
+    changes. Array formulas like ``=A1:A3*B1:B3`` are evaluated in one pass
+    and spill their results into the cells below and to the right.
+
+    In `MANUAL` calculation, cells computed from a changed cell keep their
+    values until `recalculate` is called; see `set_calculation`.
+
+    A sheet added to a `workbook.Workbook` can read the cells of the other
+    sheets in it, with references like ``Sheet2!A1``.
+
+    The sheet may be shared between threads. Writers are serialized by a lock
+    and every `set`, `set_format` or outermost `batch` is committed as one new
+    `version`. Other threads should read through a `snapshot`, which sees a
+    single committed version and never waits for a writer.
+    """
+
+    def __init__(self):
+        # Initialize the spreadsheet engine.
+        self.cells = CellStore()
+        # Index -> formatted value, for cells evaluated since they last changed
+        self._values = {}
+        # Which formulas read which cells, so we know what to invalidate
+        self.graph = DependencyGraph()
+        # The workbook.Workbook this sheet belongs to, and its name there, or
+        # None
+        self.workbook = None
+        self.name = None
+        # sheet name -> DependencyGraph of the formulas here reading cells of
+        # that sheet, by the cells they read there
+        self._external = collections.defaultdict(DependencyGraph)
+        # anchor Index -> Range its array formula spills into
+        self._spills = {}
+        # anchor Index -> Array, for array formulas that spilled successfully
+        self._arrays = {}
+        # Formulas filled down a column, stored once instead of once per Cell
+        self._shared = SharedFormulas()
+        # SharedFormulas whose rows are being evaluated right now
+        self._shared_in_progress = set()
+        # SharedFormula -> the rows whose cached values were dropped since
+        # all its rows were last evaluated, for SharedFormulas evaluated so far
+        self._unevaluated = {}
+        # col -> lookup.ColumnIndex, for columns searched by lookup functions
+        self._column_indexes = {}
+        # col -> columnstats.ColumnStats, for columns summarized so far
+        self._column_stats = {}
+        # pivot.Pivot summaries to update after every commit
+        self._pivots = []
+        # subscriptions.Subscription callbacks to tell of changes after every
+        # commit
+        self._subscriptions = []
+        # Changed cells waiting for the end of the current `batch`
+        self._batch_depth = 0
+        self._pending = []
+        # AUTOMATIC, or MANUAL to recalculate only when asked to
+        self.calculation = AUTOMATIC
+        # Cells changed since the last recalculation, in MANUAL calculation
+        self._dirty = set()
+        # The cells out of date because of `_dirty`, once `stale_cells` has
+        # found them, or None
+        self._stale = None
+        # True if the next commit recalculates the cells out of date
+        self._recalculate = False
+        # (graph version, {Index: position}) in the order the last
+        # recalculation evaluated cells, or None; see `_recalculate_chain`
+        self._calc_chain = None
+        # The cells stored so far while recording a calc chain, or None
+        self._recording = None
+        # Held by writers, and by anything filling the caches above
+        self._lock = threading.RLock()
+        # The number of committed changes so far
+        self.version = 0
+        # (version, SharedFormulas, spills, cells.layout) as of `version`, for
+        # new snapshots; none is modified once published
+        self._head = (0, self._shared.copy(), {}, self.cells.layout)
+        # True if `_shared` or `_spills` changed since `_head` was published
+        self._restructured = False
+        # The _Changes of the version being written, or None
+        self._changes = None
+        # _Changes still needed by some snapshot, oldest first
+        self._history = []
+        # physical Index -> [(version, Cell or None before that version), ...]
+        # and Index -> [(version, (value, computed version)), ...], oldest
+        # first: what `_history` holds, indexed by cell. Lists are replaced
+        # rather than shortened, since snapshots may be searching them.
+        self._cell_history = {}
+        self._value_history = {}
+        # Index -> version a cached value was computed at, recorded only while
+        # snapshots exist or changes are pending; anything missing is older
+        # than every snapshot
+        self._value_versions = {}
+        # The version of the last change to insert or delete rows or
+        # columns: cached values are kept by position, which older snapshots
+        # don't share
+        self._layout_version = 0
+        self._snapshots = weakref.WeakSet()
+        self._snapshots_lock = threading.Lock()
+
+    def get_formatted(self, index, visited_cells=None):
+        value = self._values.get(index)
+        if value is not None:
+            return value
+        with self._lock:
+            return super().get_formatted(index, visited_cells)
+
+    def get_cached(self, index):
+        """Return the formatted value at `index` if it is known without
+        evaluating anything, or None.
+
+        >>> sheet = Spreadsheet()
+        >>> sheet.set(Index(0, 0), "2")
+        >>> sheet.set(Index(0, 1), "=A1*2")
+        >>> sheet.get_cached(Index(0, 0)), sheet.get_cached(Index(0, 1))
+        ('2', None)
+        """
+        value = self._values.get(index)
+        if value is None:
+            value = self.cells.plain(index)
+        return value
+
+    def pivot(self, source, keys, values, target):
+        """Summarize the rows of `source` grouped by the columns `keys`, and
+        keep the summary up to date as cells in `source` change.
+
+        Each group's row, written from `target` down, holds its key values
+        and then one aggregate per ``(col, name)`` pair of `values`, with
+        `name` one of ``SUM``, ``COUNT``, ``AVERAGE``, ``MIN`` or ``MAX``. A
+        change to the source only updates the rows of the groups it moves
+        cells between. See `pivot.Pivot`.
+
+        >>> sheet = Spreadsheet()
+        >>> with sheet.batch():
+        ...     for row, fruit in enumerate(["pear", "fig", "Pear"]):
+        ...         sheet.set(Index(row, 0), fruit)
+        ...         sheet.set(Index(row, 1), str(row * 3 + 2))
+        >>> summary = sheet.pivot(Range.parse("A1:B3"), [0], [(1, "SUM")], Index(0, 3))
+        >>> sheet.set(Index(1, 0), "pear")
+        >>> [sheet.get_formatted(Index(row, 4)) for row in range(3)]
+        ['15', '', '']
+
+        Returns:
+            pivot.Pivot: the summary; pass it to `remove_pivot` to stop
+            updating it.
+
+        Raises:
+            ValueError: if a column isn't in `source`, an aggregate is
+                unknown, or the summary could be written over `source`.
+        """
+        with self._lock:
+            summary = Pivot(self, source, keys, values, target)
+            self._pivots.append(summary)
+        return summary
+
+    def remove_pivot(self, summary):
+        """Stop updating a summary made by `pivot`, leaving its cells as
+        they are. Summaries whose source or target was deleted have already
+        stopped."""
+        with self._lock:
+            if summary in self._pivots:
+                self._pivots.remove(summary)
+
+    def subscribe(self, callback, cells=None):
+        """Call `callback` after every commit that changed the formatted
+        value of a cell in `cells` (a Range), or anywhere if `cells` is None.
+
+        `callback` is passed a dict of each such Index to its new formatted
+        value. It is only passed values that differ from the ones it was
+        given before, and is called on the writing thread with the sheet
+        locked, so it must not change the sheet. Watching the whole sheet
+        keeps a copy of every value that changed. Inserting or deleting rows
+        or columns moves the watched range along with its cells, and stops
+        the calls if they were all deleted.
+
+        >>> sheet = Spreadsheet()
+        >>> diffs = []
+        >>> subscription = sheet.subscribe(diffs.append, Range.parse("B1:B9"))
+        >>> with sheet.batch():
+        ...     sheet.set(Index(0, 0), "1")
+        ...     sheet.set(Index(0, 1), "=A1*2")
+        >>> sheet.set(Index(0, 0), "=2-1")
+        >>> sheet.set(Index(0, 0), "3")
+        >>> diffs
+        [{Index(row=0, col=1): '2'}, {Index(row=0, col=1): '6'}]
+
+        Returns:
+            subscriptions.Subscription: pass it to `unsubscribe` to stop the
+            calls.
+        """
+        with self._lock:
+            subscription = Subscription(self, callback, cells)
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop calling a callback registered with `subscribe`."""
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def set_calculation(self, mode):
+        """Set when formulas are recalculated: with `AUTOMATIC`, every change
+        invalidates the cells computed from it, which are evaluated again as
+        they are read. With `MANUAL`, a change only invalidates the cells
+        changed, and the others keep their values until `recalculate` is
+        called, so editing a large model doesn't wait for it. Switching back
+        to `AUTOMATIC` recalculates.
+
+        >>> sheet = Spreadsheet()
+        >>> sheet.set(Index(0, 0), "1")
+        >>> sheet.set(Index(0, 1), "=A1*2")
+        >>> sheet.get_formatted(Index(0, 1))
+        '2'
+        >>> sheet.set_calculation(MANUAL)
+        >>> sheet.set(Index(0, 0), "5")
+        >>> sheet.get_formatted(Index(0, 1)), sorted(map(str, sheet.stale_cells()))
+        ('2', ['B1'])
+        >>> sorted(map(str, sheet.recalculate()))
+        ['A1', 'B1']
+        >>> sheet.get_formatted(Index(0, 1)), sheet.stale_cells()
+        ('10', frozenset())
+
+        Raises:
+            ValueError: if `mode` is neither `AUTOMATIC` nor `MANUAL`.
+        """
+        if mode not in (AUTOMATIC, MANUAL):
+            raise ValueError(f"Unknown calculation mode {mode!r}")
+        with self._lock:
+            self.calculation = mode
+            if mode == AUTOMATIC:
+                self.recalculate()
+
+    def recalculate(self):
+        """Evaluate again every cell out of date since the last
+        recalculation in `MANUAL` calculation, and commit the new values as
+        one version. Inside a `batch`, waits for the end of the batch.
+
+        Returns:
+            set: the indices whose values may have changed.
+        """
+        with self._lock:
+            if not self._dirty:
+                return set()
+            self._begin_change()
+            self._pending.extend(self._dirty)
+            self._dirty = set()
+            self._stale = None
+            self._recalculate = True
+            if self._batch_depth:
+                return set()
+            return self._commit()
+
+    def stale_cells(self):
+        """Return the frozenset of cells whose values may be out of date
+        until the next `recalculate`: those computed from a cell changed
+        since, directly or not."""
+        with self._lock:
+            if self._stale is None:
+                self._stale = frozenset(self._computed_from(self._dirty))
+            return self._stale
+
+    def _computed_from(self, indices):
+        """Return the set of cells computed from the cells `indices`,
+        directly or not, including the cells spilled by the array formulas
+        among them."""
+        found = set()
+        seen_ranges = {}
+        pending = []
+        for index in indices:
+            pending.extend(self.graph.dependents(index, seen_ranges))
+        while pending:
+            index = pending.pop()
+            if index in found:
+                continue
+            found.add(index)
+            pending.extend(self.graph.dependents(index, seen_ranges))
+            spill = self._spills.get(index)
+            if spill is not None:
+                pending.extend(spill.indices)
+        return found
+
+    def last_row(self, col=None):
+        """Return the last row holding a value or formula, or covered by a
+        spilled array, in column `col` if given, or -1 if there is none."""
+        with self._lock:
+            rows = [self.cells.last_row(col)]
+            rows.extend(
+                shared.last_row
+                for shared in self._shared
+                if col is None or shared.col == col
+            )
+            rows.extend(
+                spill.last.row
+                for spill in self._spills.values()
+                if col is None or spill.first.col <= col <= spill.last.col
+            )
+        return max(rows, default=-1)
+
+    def column_width(self, col):
+        """Return the length of the longest formatted value in column `col`,
+        among those evaluated so far.
+
+        Like `summarize`, this only reads the cells that changed, or were
+        evaluated, since the column was last asked about.
+        """
+        with self._lock:
+            return self._stats(col).summary().width
+
+    def summarize(self, cell_range):
+        """Return a `columnstats.Summary` of the formatted values in
+        `cell_range`: how many there are of each kind, and the sum, minimum
+        and maximum of the numbers.
+
+        The summaries of each column are kept up to date as cells change,
+        in blocks of rows, so this doesn't read the whole range again. Only
+        the cells of `cell_range` are evaluated.
+
+        >>> sheet = Spreadsheet()
+        >>> for row, value in enumerate(["4", "pear", "=A1*2", "#N/A"]):
+        ...     sheet.set(Index(row, 0), value)
+        >>> summary = sheet.summarize(Range.parse("A1:B4"))
+        >>> summary.cells, summary.numbers, summary.total, summary.average
+        (4, 2, 12, 6.0)
+        """
+        first, last = cell_range
+        with self._lock:
+            return combine(
+                self._stats(col).summary(first.row, last.row, evaluate=True)
+                for col in range(first.col, last.col + 1)
+            )
+
+    def _stats(self, col):
+        stats = self._column_stats.get(col)
+        if stats is None:
+            stats = self._column_stats[col] = ColumnStats(self, col)
+        return stats
+
+    def snapshot(self):
+        """Return a read-only `Snapshot` of the last committed version.
+
+        Snapshots are cheap to take and can be read from any thread while
+        writers carry on. The history they need is kept until they are
+        garbage collected.
+        """
+        with self._snapshots_lock:
+            snapshot = Snapshot(self, *self._head)
+            self._snapshots.add(snapshot)
+        return snapshot
+
+    def fork(self, inputs):
+        """Return a `Fork` of the last committed version, in which the cells
+        `inputs` can be set to other values to see what the sheet would show
+        then, without changing it.
+
+        Only the cells computed from `inputs` are evaluated again in the
+        fork; it reads everything else from a `snapshot`. Cells of other
+        sheets of a workbook are read as they are, even if they are computed
+        from `inputs`.
+
+        >>> sheet = Spreadsheet()
+        >>> sheet.set(Index(0, 0), "2")
+        >>> sheet.set(Index(0, 1), "=A1*10")
+        >>> fork = sheet.fork([Index(0, 0)])
+        >>> fork.set(Index(0, 0), "3")
+        >>> fork.get_formatted(Index(0, 1)), sheet.get_formatted(Index(0, 1))
+        ('30', '20')
+        """
+        inputs = list(inputs)
+        with self._lock:
+            snapshot = self.snapshot()
+            # Writing into an array's spill range may block it.
+            roots = set(inputs)
+            roots.update(
+                anchor
+                for anchor, spill in self._spills.items()
+                if any(spill.contains(index) for index in inputs)
+            )
+            for anchor in list(roots):
+                spill = self._spills.get(anchor)
+                if spill is not None:
+                    roots.update(spill.indices)
+            cone = roots | self._computed_from(roots)
+        return Fork(snapshot, inputs, cone)
 
     def set(self, index, raw):
         """Set the value at the given cell.
@@ -51,9 +737,39 @@ class Spreadsheet:
             index (Index): the cell to update
             raw (str): the raw string, like ``'1'`` or ``'2018-01-01'`` or ``'=A2'``
         """
-        cell = self.cells.get(index, Cell())
-        cell.set_data(raw)
-        self.cells[index] = cell
+        with self._lock:
+            self._begin_change()
+            stale = [index]
+            self._unshare(index)
+            self.graph.remove(index)
+            for graph in self._external.values():
+                graph.remove(index)
+            old_spill = self._spills.pop(index, None)
+            if old_spill is not None:
+                self._restructured = True
+                stale.extend(old_spill.indices)
+            if not self._extend_shared(index, raw):
+                cell = self._edit_cell(index)
+                cell.set_data(raw)
+                self.cells[index] = cell
+                formula = cell.formula
+                if formula is not None:
+                    self.graph.set_precedents(index, formula.refs, formula.ranges)
+                    self._set_external_precedents(index, formula.external)
+                    if formula.spill is not None:
+                        height, width = formula.spill
+                        spill = Range(index, index + (height - 1, width - 1))
+                        self._spills[index] = spill
+                        self._restructured = True
+                    elif formula.code is not None and not formula.external:
+                        self._share(index, cell)
+            # Writing into another array's spill range may block (or unblock) it.
+            stale.extend(
+                anchor
+                for anchor, spill in self._spills.items()
+                if anchor != index and spill.contains(index)
+            )
+            self._changed(stale)
 
     def set_format(self, index, type, spec):
         """Set the format string for a given cell.
@@ -69,6 +785,1055 @@ class Spreadsheet:
                 - if `type` is ``'date'``, a string suitable for passing to
                   `datetime.strftime`, e.g. ``'%Y-%m-%d'``
         """
-        cell = self.cells.get(index, Cell())
-        cell.set_format(type, spec)
-        self.cells[index] = cell
+        with self._lock:
+            cell = self._edit_cell(index)
+            cell.set_format(type, spec)
+            self.cells[index] = cell
+            self._changed([index])
+
+    def load_columns(self, first_row, texts, columns):
+        """Set the plain and empty cells of rows from `first_row` down, as
+        read from a CSV file by `csvimport.import_csv`.
+
+        `columns` holds an ``array('i')`` of codes per column from column A,
+        as taken by `CellStore.load_columns`. If nothing is stored from
+        `first_row` down and nothing has been evaluated or watched yet, as
+        when loading a file at startup, the codes are copied into `cells` as
+        they are. Otherwise each cell is `set` on its own.
+        """
+        with self._lock:
+            self._begin_change()
+            if (
+                self.last_row() < first_row
+                and not self._values
+                and not self._column_indexes
+                and not self._column_stats
+                and not self._snapshots
+                and not self._pivots
+                and not self._subscriptions
+                and not (self.workbook and self.workbook.is_read(self.name))
+                and self.cells.rows.contiguous_from(first_row)
+            ):
+                self.cells.load_columns(first_row, texts, columns)
+                self._changed([])
+                return
+            with self.batch():
+                for index, raw in decode_columns(first_row, texts, columns):
+                    self.set(index, raw)
+
+    def insert_rows(self, row, count=1):
+        """Insert `count` empty rows before `row`, moving the rows below down.
+
+        Stored cells aren't moved: see `structure`. References to the rows
+        that moved are rewritten, and a range written across `row` grows,
+        but only the formulas that then read other cells are evaluated
+        again.
+
+        >>> sheet = Spreadsheet()
+        >>> sheet.set(Index(0, 0), "2")
+        >>> sheet.set(Index(1, 0), "3")
+        >>> sheet.set(Index(2, 1), "=SUM(A1:A2) * A2")
+        >>> sheet.insert_rows(1)
+        >>> sheet.get_raw(Index(3, 1)), sheet.get_formatted(Index(3, 1))
+        ('=SUM(A1:A3) * A3', '15')
+
+        Raises:
+            ValueError: if `row` is negative or `count` is less than 1.
+        """
+        self._restructure(_shift(0, row, count))
+
+    def delete_rows(self, row, count=1):
+        """Delete `count` rows from `row` on, moving the rows below up.
+
+        References to the deleted cells become ``#REF!``, and ranges lose
+        the rows deleted from them.
+
+        >>> sheet = Spreadsheet()
+        >>> sheet.set(Index(0, 0), "2")
+        >>> sheet.set(Index(1, 0), "3")
+        >>> sheet.set(Index(2, 1), "=SUM(A1:A2)")
+        >>> sheet.set(Index(2, 2), "=A1 + 1")
+        >>> sheet.delete_rows(0)
+        >>> sheet.get_raw(Index(1, 1)), sheet.get_formatted(Index(1, 1))
+        ('=SUM(A1:A1)', '3')
+        >>> sheet.get_raw(Index(1, 2)), sheet.get_formatted(Index(1, 2))
+        ('=#REF! + 1', '#REF!')
+
+        Raises:
+            ValueError: if `row` is negative or `count` is less than 1.
+        """
+        self._restructure(_shift(0, row, -count))
+
+    def insert_columns(self, col, count=1):
+        """Insert `count` empty columns before `col`, like `insert_rows`.
+
+        Raises:
+            ValueError: if `col` is negative or `count` is less than 1.
+        """
+        self._restructure(_shift(1, col, count))
+
+    def delete_columns(self, col, count=1):
+        """Delete `count` columns from `col` on, like `delete_rows`.
+
+        Raises:
+            ValueError: if `col` is negative or `count` is less than 1.
+        """
+        self._restructure(_shift(1, col, -count))
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Group several `set` and `set_format` calls into one recalculation.
+
+        Cached values are invalidated once, when the outermost batch ends,
+        so values read inside the batch are those from before it. The whole
+        batch is committed as one version, and other threads can't write
+        until it ends. The
+        context manager yields a set that, once the batch has ended, holds
+        every cell whose value may have changed.
+
+        >>> sheet = Spreadsheet()
+        >>> with sheet.batch() as changed:
+        ...     sheet.set(Index(0, 0), "1")
+        ...     sheet.set(Index(0, 1), "=A1+1")
+        >>> sorted(str(index) for index in changed)
+        ['A1', 'B1']
+        """
+        changed = set()
+        with self._lock:
+            self._batch_depth += 1
+            try:
+                yield changed
+            finally:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    changed.update(self._commit())
+
+    def _changed(self, indices):
+        self._pending.extend(indices)
+        if not self._batch_depth:
+            self._commit()
+
+    def _commit(self):
+        """Invalidate everything changed since the last commit, and publish
+        the result as a new version.
+
+        Returns:
+            set: the indices whose values may have changed.
+        """
+        pending, self._pending = self._pending, []
+        if self._recalculate:
+            self._recalculate = False
+            changed = self._invalidate(pending)
+            # Every value the walk dropped was logged in `changes.values`.
+            self._recalculate_chain(set(self._changes.values))
+        elif self.calculation == MANUAL:
+            # The cells computed from `pending` are left for `recalculate`.
+            changed = self._invalidate(pending, dependents=False)
+            self._dirty.update(pending)
+            self._stale = None
+        else:
+            changed = self._invalidate(pending)
+        return self._publish(changed)
+
+    def _publish(self, changed, propagate=True):
+        """Publish the version being written, if any, and tell the other
+        sheets of the workbook (unless `propagate` is False), the pivots and
+        the subscriptions that the cells in `changed` may have changed.
+
+        Returns:
+            set: `changed`, plus the cells changed by pivots.
+        """
+        changes = self._changes
+        if changes is not None:
+            if self._restructured:
+                self._restructured = False
+                shared, spills = self._shared.copy(), dict(self._spills)
+            else:
+                _, shared, spills, _ = self._head
+            self._head = (changes.version, shared, spills, self.cells.layout)
+            self.version = changes.version
+            self._changes = None
+            self._collect_garbage()
+        if (
+            propagate
+            and self.workbook is not None
+            and (changed or self.workbook._rewritten)
+        ):
+            self.workbook._propagate(self, changed)
+        for pivot in list(self._pivots):
+            # Their output may feed other pivots, in a commit of its own.
+            changed |= pivot.update(changed)
+        if changed:
+            for subscription in list(self._subscriptions):
+                subscription.publish(changed)
+        return changed
+
+    def _recalculate_chain(self, dropped):
+        """Evaluate the cells in `dropped` again.
+
+        Formulas are evaluated on demand, so the cells a formula reads are
+        evaluated before it, and the order cells are stored in is an order
+        of the dependency graph. That order is kept as the calc chain, and
+        while the graph doesn't change, the next recalculation evaluates the
+        cells in it in the same order: every formula then finds the cells it
+        reads already evaluated instead of recursing into them.
+        """
+        chain = self._calc_chain
+        if (
+            chain is not None
+            and chain[0] == self.graph.version
+            and all(index in chain[1] for index in dropped)
+        ):
+            order = sorted(dropped, key=chain[1].__getitem__)
+        else:
+            chain = None
+            order = sorted(dropped)
+            self._recording = []
+        try:
+            for index in order:
+                self.get_formatted(index)
+        finally:
+            recorded, self._recording = self._recording, None
+        if chain is None:
+            positions = {index: position for position, index in enumerate(recorded)}
+            self._calc_chain = (self.graph.version, positions)
+
+    def _set_external_precedents(self, index, external):
+        """Record the cells of other sheets that the formula at `index`
+        reads, given as `Formula.external`."""
+        by_sheet = collections.defaultdict(lambda: ([], []))
+        for name, ref in external:
+            refs, ranges = by_sheet[name]
+            (ranges if isinstance(ref, Range) else refs).append(ref)
+        for name, (refs, ranges) in by_sheet.items():
+            self._external[name].set_precedents(index, refs, ranges)
+
+    def _external_changed(self, name, changed=None):
+        """Invalidate the cached values computed from the cells `changed` of
+        the sheet called `name` (from any of its cells if `changed` is None),
+        leaving the new version unpublished.
+
+        Returns:
+            set: the cells whose values were dropped. In `MANUAL`
+            calculation or inside a batch, the cells reading `changed` are
+            only marked until `recalculate` or the end of the batch, and
+            nothing is dropped yet.
+        """
+        graph = self._external.get(name)
+        if graph is None:
+            return set()
+        if changed is None:
+            readers = graph.formulas()
+        else:
+            readers = set()
+            seen_ranges = {}
+            for index in changed:
+                readers.update(graph.dependents(index, seen_ranges))
+        return self._readers_changed(readers)
+
+    def _readers_changed(self, readers):
+        """Invalidate the formulas `readers`, which read cells of another
+        sheet that changed, as `_external_changed` does."""
+        # Anything not cached is evaluated afresh when read.
+        readers = [index for index in readers if index in self._values]
+        if not readers:
+            return set()
+        if self._batch_depth:
+            self._pending.extend(readers)
+            return set()
+        if self.calculation == MANUAL:
+            self._dirty.update(readers)
+            self._stale = None
+            return set()
+        self._begin_change()
+        return self._invalidate(readers)
+
+    def _sheet_named(self, name):
+        if self.workbook is None:
+            return None
+        return self.workbook.sheets.get(name)
+
+    def _begin_change(self):
+        """Return the _Changes of the version being written."""
+        if self._changes is None:
+            self._changes = _Changes(self.version + 1)
+            self._history.append(self._changes)
+        return self._changes
+
+    def _edit_cell(self, index):
+        """Return a copy of the Cell at `index`, or a new Cell, for the caller
+        to change and store back. Cells are never changed in place, since
+        snapshots may be reading them."""
+        cell = self.cells.get(index)
+        changes = self._begin_change()
+        physical = self.cells.physical(index)
+        if physical not in changes.cells:
+            changes.cells[physical] = cell
+            _log(self._cell_history, physical, changes.version, cell)
+        return Cell() if cell is None else copy.copy(cell)
+
+    def _store(self, index, value):
+        if self._recording is not None:
+            self._recording.append(index)
+        if self._changes is not None:
+            self._value_versions[index] = self.version + 1
+        elif self._snapshots:
+            self._value_versions[index] = self.version
+        self._values[index] = value
+        if self._column_stats:
+            stats = self._column_stats.get(index.col)
+            if stats is not None:
+                stats.evaluated(index.row)
+
+    def _lookup(self, index):
+        return self._values.get(index)
+
+    def _cell_at(self, physical, version):
+        """Return the Cell stored at the physical Index `physical` (see
+        `CellStore.physical`) as of `version`, or None."""
+        # Read the cell before the history: a writer logs the old cell
+        # before storing the new one, so a cell stored after `version` is
+        # always found logged.
+        cell = self.cells.stored(physical)
+        entry = _logged_after(self._cell_history, physical, version)
+        if entry is not None:
+            return entry[1]
+        return cell
+
+    def _value_at(self, index, version):
+        """Return the cached value at `index` if it is known to be the value
+        as of `version`, or None."""
+        if version < self._layout_version:
+            # The values have moved since.
+            return None
+        entry = _logged_after(self._value_history, index, version)
+        if entry is not None:
+            value, computed = entry[1]
+            return value if computed <= version else None
+        # Read the value before its version: a value recomputed in between
+        # then looks too new, which is safe.
+        value = self._values.get(index)
+        if value is not None and self._value_versions.get(index, 0) <= version:
+            # Unless rows or columns moved while reading it.
+            return value if version >= self._layout_version else None
+        return None
+
+    def _collect_garbage(self):
+        """Forget the changes that no remaining snapshot is old enough to
+        need."""
+        with self._snapshots_lock:
+            if not self._snapshots:
+                # A snapshot taken from now on starts at the current version.
+                self._history = []
+                self._cell_history = {}
+                self._value_history = {}
+                if self._value_versions:
+                    self._value_versions.clear()
+                return
+            versions = [snapshot.version for snapshot in self._snapshots]
+        oldest = min(versions, default=self.version)
+        keep = 0
+        while keep < len(self._history) and self._history[keep].version <= oldest:
+            keep += 1
+        if not keep:
+            return
+        dropped, self._history = self._history[:keep], self._history[keep:]
+        _forget(self._cell_history, (c.cells for c in dropped))
+        _forget(self._value_history, (c.values for c in dropped))
+
+    def _extend_shared(self, index, raw):
+        """Fast path for a formula filled down a column: if `raw` is the shared
+        formula above `index` moved down one row, extend it without parsing
+        `raw` or creating a Cell."""
+        if index.row == 0 or not raw.startswith("="):
+            return False
+        shared = self._shared.find(index - (1, 0))
+        if shared is None or raw != shared.raw(index):
+            return False
+        shared = self._resize_shared(shared, index.row)
+        if index in self.cells:
+            self._clear_raw(index)
+        below = self._shared.find(index + (1, 0))
+        if below is not None and below.key() == shared.key():
+            self._remove_shared(below)
+            self._resize_shared(shared, below.last_row)
+        return True
+
+    def _share(self, index, cell):
+        """Merge the formula at `index` with the same relative formula in the
+        rows directly above and below into one SharedFormula."""
+        key = cell.formula.relative_to(index)
+        above = self._shareable(index - (1, 0), key) if index.row > 0 else None
+        below = self._shareable(index + (1, 0), key)
+        if above is None and below is None:
+            return
+        self.graph.remove(index)
+        if above is None:
+            shared = SharedFormula(cell.formula, index.col, index.row, index.row)
+            self._add_shared(shared)
+        else:
+            shared = self._resize_shared(above, index.row)
+        self._clear_raw(index)
+        if below is not None:
+            self._remove_shared(below)
+            self._resize_shared(shared, below.last_row)
+
+    def _shareable(self, index, key):
+        """Return the SharedFormula at `index` if it matches `key`, turning a
+        lone formula Cell into a one-row SharedFormula if necessary."""
+        shared = self._shared.find(index)
+        if shared is not None:
+            return shared if shared.key() == key else None
+        cell = self.cells.get(index)
+        formula = None if cell is None else cell.formula
+        if (
+            formula is None
+            or formula.code is None
+            or formula.spill is not None
+            or formula.external
+            or formula.relative_to(index) != key
+        ):
+            return None
+        self.graph.remove(index)
+        shared = SharedFormula(formula, index.col, index.row, index.row)
+        self._add_shared(shared)
+        self._clear_raw(index)
+        return shared
+
+    def _unshare(self, index):
+        """Take the row at `index` out of the SharedFormula covering it."""
+        shared = self._shared.find(index)
+        if shared is None:
+            return
+        dropped = self._unevaluated.get(shared)
+        self._remove_shared(shared)
+        for part in shared.without(index.row):
+            self._add_shared(part)
+            if dropped is not None:
+                self._unevaluated[part] = {
+                    row for row in dropped if part.first_row <= row <= part.last_row
+                }
+
+    def _add_shared(self, shared):
+        self._shared.add(shared)
+        self._restructured = True
+        self.graph.set_shared_precedents(shared)
+
+    def _remove_shared(self, shared):
+        self._shared.remove(shared)
+        self._unevaluated.pop(shared, None)
+        self._restructured = True
+        self.graph.remove_shared(shared)
+
+    def _resize_shared(self, shared, last_row):
+        """Replace `shared` by the same formula ending at `last_row`.
+        SharedFormulas are never changed in place, since snapshots may be
+        reading them."""
+        resized = SharedFormula(shared.formula, shared.col, shared.first_row, last_row)
+        self._shared.replace(shared, resized)
+        dropped = self._unevaluated.pop(shared, None)
+        if dropped is not None:
+            # The rows added haven't been evaluated.
+            dropped.update(range(shared.last_row + 1, last_row + 1))
+            self._unevaluated[resized] = dropped
+        self.graph.replace_shared(shared, resized)
+        self._restructured = True
+        return resized
+
+    def _clear_raw(self, index):
+        """Drop the raw data of a Cell whose formula is now shared, keeping
+        the Cell only if it still holds a format."""
+        cell = self._edit_cell(index)
+        if cell.format_type == "default":
+            del self.cells[index]
+        else:
+            cell.set_data("")
+            self.cells[index] = cell
+
+    def _restructure(self, shift):
+        """Insert or delete rows or columns, as the `structure.Shift` `shift`
+        says, and commit the change.
+
+        The cells stay where they are stored. What the engine keeps by
+        position, which is only kept for formulas and cached values, is moved
+        along, and the formulas whose references moved are rewritten. Only
+        those of them reading other cells than before are invalidated, along
+        with the cells computed from them.
+        """
+        with self._lock:
+            changes = self._begin_change()
+            move = shift.moved
+            at, count = shift.at, shift.count
+            roots = set()
+
+            graphs = [self.graph] + list(self._external.values())
+            formulas = set().union(*(graph.formulas() for graph in graphs))
+            rewritten = []
+            for index in formulas:
+                formula = self.cells[index].formula
+                moved = formula.moved(move, sheet=self.name)
+                new = move(index)
+                if new != index or moved is not formula:
+                    rewritten.append((new, formula, moved))
+                    for graph in graphs:
+                        graph.remove(index)
+            if count < 0 and self._snapshots:
+                # Log the cells about to be dropped, for snapshots.
+                for index in list(self.cells.within(shift.axis, at, at - count - 1)):
+                    self._edit_cell(index)
+            self.cells.shift(shift)
+            for new, formula, moved in rewritten:
+                if new is None:
+                    continue
+                if moved is not formula:
+                    cell = self._edit_cell(new)
+                    cell.set_formula(moved)
+                    self.cells[new] = cell
+                self.graph.set_precedents(new, moved.refs, moved.ranges)
+                self._set_external_precedents(new, moved.external)
+                if shift.rereads(formula, sheet=self.name):
+                    roots.add(new)
+
+            self._move_shared(shift, roots)
+            self._move_spills(shift, roots)
+
+            # Values are cached by position: older snapshots mustn't read
+            # them from now on.
+            self._layout_version = changes.version
+            self._values = _moved_keys(self._values, move)
+            self._unevaluated = {}
+            self._value_versions = _moved_keys(self._value_versions, move)
+            self._pending = [
+                index for index in map(move, self._pending) if index is not None
+            ]
+            self._dirty = {
+                index for index in map(move, self._dirty) if index is not None
+            }
+            self._stale = None
+            self._calc_chain = None
+            if shift.axis == 0:
+                # Lookups index the column again when they next search it.
+                self._column_indexes = {}
+                for stats in self._column_stats.values():
+                    stats.shift(at, count)
+            else:
+                self._column_indexes = _moved_columns(self._column_indexes, shift)
+                self._column_stats = _moved_columns(self._column_stats, shift)
+
+            self._pivots = [pivot for pivot in self._pivots if pivot.move(shift)]
+            self._subscriptions = [
+                subscription
+                for subscription in self._subscriptions
+                if subscription.move(shift)
+            ]
+            if self.workbook is not None:
+                self.workbook._shifted(self, shift)
+            self._changed(roots)
+
+    def _move_shared(self, shift, roots):
+        """Move the SharedFormulas for `_restructure`, adding the rows that
+        read other cells than before to `roots`.
+
+        A run is cut where its rows start moving differently, or their
+        references do, and each part is moved as one. Rows whose ranges
+        lose their first or last rows to a deletion keep the same range
+        whatever their row, and are each given a run of their own.
+        """
+        move = shift.moved
+        edges = shift.edges
+        replaced = []
+        for shared in self._shared:
+            formula = shared.formula
+            length = shared.last_row - shared.first_row + 1
+            rows = [ref.row for ref in formula.refs]
+            for rng in formula.ranges:
+                rows.extend((rng.first.row, rng.last.row))
+            if shift.axis == 1:
+                cols = [ref.col for ref in formula.refs]
+                cols.extend(rng.last.col for rng in formula.ranges)
+                if max(cols + [shared.col]) < shift.at:
+                    continue
+                cuts = []
+            else:
+                if max(rows + [shared.first_row]) + length - 1 < shift.at:
+                    continue
+                cuts = {
+                    edge - row
+                    for edge in edges
+                    for row in rows + [shared.first_row]
+                    if 0 < edge - row < length
+                }
+            bounds = [0] + sorted(cuts) + [length]
+            parts = []
+            for start, stop in zip(bounds, bounds[1:]):
+                part = formula.shifted((start, 0))
+                top = move(shared.top + (start, 0))
+                if top is None:
+                    continue
+                rereads = shift.rereads(part)
+                clamped = (
+                    shift.axis == 0
+                    and shift.count < 0
+                    and any(
+                        shift.position(bound.row) is None
+                        for rng in part.ranges
+                        for bound in rng
+                    )
+                )
+                step = 1 if clamped else stop - start
+                for first in range(0, stop - start, step):
+                    row_formula = part.shifted((first, 0)).moved(move)
+                    parts.append(
+                        SharedFormula(
+                            row_formula,
+                            top.col,
+                            top.row + first,
+                            top.row + first + step - 1,
+                        )
+                    )
+                if rereads:
+                    roots.update(
+                        Index(row, top.col)
+                        for row in range(top.row, top.row + stop - start)
+                    )
+            replaced.append((shared, parts))
+        for shared, _ in replaced:
+            self._remove_shared(shared)
+        for _, parts in replaced:
+            for part in parts:
+                self._add_shared(part)
+
+    def _move_spills(self, shift, roots):
+        """Move the array formulas' spill ranges for `_restructure`, adding
+        the cells of those that spill differently to `roots`."""
+        move = shift.moved
+        spills = {}
+        arrays = {}
+        for anchor, spill in self._spills.items():
+            new = move(anchor)
+            moved = move(spill)
+            if new is not None and new not in roots and not shift.changes(spill):
+                spills[new] = moved
+                if anchor in self._arrays:
+                    arrays[new] = self._arrays[anchor]
+                continue
+            # Spilling again may block other cells or unblock them.
+            if moved is not None:
+                roots.update(moved.indices)
+            if new is None:
+                continue
+            roots.add(new)
+            shape = self.cells[new].formula.spill
+            if shape is not None:
+                height, width = shape
+                spills[new] = Range(new, new + (height - 1, width - 1))
+            elif moved is not None:
+                spills[new] = moved
+        self._spills = spills
+        self._arrays = arrays
+        self._restructured = True
+
+    def _external_shifted(self, name, shift):
+        """Rewrite the references to cells of the sheet called `name`, in
+        which the `structure.Shift` `shift` inserted or deleted rows or
+        columns, and invalidate the formulas that read other cells than
+        before, as `_external_changed` does.
+
+        Returns:
+            set: the cells whose values were dropped, or None if no formula
+            was rewritten.
+        """
+        graph = self._external.get(name)
+        if not graph:
+            return None
+        move = shift.moved
+        readers = []
+        rewritten = False
+        for index in graph.formulas():
+            formula = self.cells[index].formula
+            moved = formula.moved(move, local=False, sheet=name)
+            if moved is formula:
+                continue
+            rewritten = True
+            cell = self._edit_cell(index)
+            cell.set_formula(moved)
+            self.cells[index] = cell
+            for external in self._external.values():
+                external.remove(index)
+            self.graph.set_precedents(index, moved.refs, moved.ranges)
+            self._set_external_precedents(index, moved.external)
+            if moved.spill != formula.spill:
+                old_spill = self._spills.pop(index, None)
+                if old_spill is not None:
+                    readers.extend(old_spill.indices)
+                if moved.spill is not None:
+                    height, width = moved.spill
+                    self._spills[index] = Range(index, index + (height - 1, width - 1))
+                self._restructured = True
+            if shift.rereads(formula, local=False, sheet=name):
+                readers.append(index)
+        if not rewritten:
+            return None
+        return self._readers_changed(readers)
+
+    def _invalidate(self, indices, dependents=True):
+        """Drop the cached values of `indices` and, unless `dependents` is
+        False, of every cell computed from them.
+
+        A cell without a cached value can't have been read by any cell that
+        does have one, so the walk stops there.
+
+        Returns:
+            set: the indices whose cached values were dropped, plus `indices`.
+        """
+        pending = list(indices)
+        roots = set(pending)
+        seen = set()
+        values = self._values
+        changes = self._changes
+        column_indexes = self._column_indexes
+        column_stats = self._column_stats
+        # Ranges whose readers were already added to `pending`
+        seen_ranges = {}
+        while pending:
+            index = pending.pop()
+            if index in seen:
+                continue
+            seen.add(index)
+            if column_indexes and index.col in column_indexes:
+                column_indexes[index.col].discard(index.row)
+            if column_stats and index.col in column_stats:
+                column_stats[index.col].discard(index.row)
+            value = values.get(index)
+            if value is not None:
+                if changes is not None:
+                    # Log the old value before dropping it, for snapshots.
+                    if index not in changes.values:
+                        old = (value, self._value_versions.get(index, 0))
+                        changes.values[index] = old
+                        _log(self._value_history, index, changes.version, old)
+                del values[index]
+                self._unevaluated_row(index)
+            elif index not in roots:
+                continue
+            if dependents:
+                pending.extend(self.graph.dependents(index, seen_ranges))
+            spill = self._spills.get(index)
+            if spill is not None:
+                self._arrays.pop(index, None)
+                for col in range(spill.first.col, spill.last.col + 1):
+                    for row in range(spill.first.row, spill.last.row + 1):
+                        spilled = Index(row, col)
+                        if spilled in values:
+                            pending.append(spilled)
+        return seen
+
+
+class Snapshot(_Evaluator):
+    """A read-only view of a `Spreadsheet` as of one committed version.
+
+    A snapshot sees neither later versions nor a batch still in progress, and
+    reading it never waits for a writer. Values the sheet has already cached
+    are reused while they are still valid for this version; anything else is
+    evaluated into a cache private to the snapshot.
+
+    >>> sheet = Spreadsheet()
+    >>> sheet.set(Index(0, 0), "1")
+    >>> before = sheet.snapshot()
+    >>> sheet.set(Index(0, 0), "2")
+    >>> before.get_formatted(Index(0, 0)), sheet.snapshot().get_formatted(Index(0, 0))
+    ('1', '2')
+    """
+
+    def __init__(self, sheet, version, shared, spills, layout):
+        self.version = version
+        self._sheet = sheet
+        self.cells = _CellsAt(sheet, version, layout)
+        self._values = {}
+        self._spills = dict(spills)
+        self._arrays = {}
+        self._shared = shared
+        self._shared_in_progress = set()
+        self._unevaluated = {}
+        self._column_indexes = {}
+        # sheet name -> Snapshot of that sheet of the workbook, taken when a
+        # formula first reads it
+        self._external = {}
+
+    def get_formatted(self, index, visited_cells=None):
+        value = self._lookup(index)
+        if value is not None:
+            return value
+        sheet = self._sheet
+        # While this is still the latest version, evaluate in the sheet itself
+        # so that the result is cached for everyone, unless a writer is busy.
+        if sheet.version == self.version and sheet._lock.acquire(blocking=False):
+            try:
+                if sheet.version == self.version and sheet._changes is None:
+                    return sheet.get_formatted(index)
+            finally:
+                sheet._lock.release()
+        return super().get_formatted(index, visited_cells)
+
+    def _lookup(self, index):
+        value = self._values.get(index)
+        if value is None:
+            value = self._sheet._value_at(index, self.version)
+            if value is not None:
+                self._values[index] = value
+        return value
+
+    def _store(self, index, value):
+        self._values[index] = value
+
+    def _sheet_named(self, name):
+        sheet = self._sheet._sheet_named(name)
+        if sheet is None:
+            return None
+        if sheet is self._sheet:
+            return self
+        snapshot = self._external.get(name)
+        if snapshot is None:
+            snapshot = self._external[name] = sheet.snapshot()
+        return snapshot
+
+    def _invalidate(self, indices):
+        # Only reached when an array spills differently than its formula's
+        # static shape; nothing else here ever changes.
+        for index in indices:
+            self._values.pop(index, None)
+            self._unevaluated_row(index)
+
+
+class Fork(_Evaluator):
+    """A copy of a `Snapshot` in which the cells `inputs` can be set, made
+    by `Spreadsheet.fork`.
+
+    Copying is on write: the fork reads the cells and values of the
+    snapshot, except for the cells set with `set` and those in `cone`, the
+    cells computed from them, which it evaluates again in a cache of its
+    own. Setting inputs again drops that cache, so one fork can evaluate
+    many scenarios in turn.
+    """
+
+    def __init__(self, snapshot, inputs, cone):
+        self.version = snapshot.version
+        self._base = snapshot
+        self._inputs = frozenset(inputs)
+        self._cone = frozenset(cone)
+        # Index -> Cell set in the fork
+        self._set = {}
+        self.cells = _ForkCells(snapshot.cells, self._set)
+        shared = snapshot._shared
+        if any(shared.find(index) for index in self._inputs):
+            # The inputs are evaluated on their own.
+            shared = shared.copy()
+            for index in self._inputs:
+                run = shared.find(index)
+                if run is not None:
+                    shared.remove(run)
+                    for part in run.without(index.row):
+                        shared.add(part)
+        self._shared = shared
+        self._shared_in_progress = set()
+        # SharedFormula -> its rows in the cone: the others are read from the
+        # snapshot, so only those are ever evaluated
+        self._cone_rows = collections.defaultdict(set)
+        for index in self._cone:
+            run = shared.find(index)
+            if run is not None:
+                self._cone_rows[run].add(index.row)
+        self._reset()
+
+    def set(self, index, raw):
+        """Set the cell at `index`, one of the fork's inputs, to `raw`, as
+        `Spreadsheet.set` would.
+
+        Raises:
+            ValueError: if `index` isn't one of the inputs.
+        """
+        if index not in self._inputs:
+            raise ValueError(f"{index} isn't an input of this fork")
+        cell = self._base.cells.get(index)
+        cell = Cell() if cell is None else copy.copy(cell)
+        cell.set_data(raw)
+        self._set[index] = cell
+        self._reset()
+
+    def get_formatted(self, index, visited_cells=None):
+        if index not in self._cone:
+            return self._base.get_formatted(index)
+        return super().get_formatted(index, visited_cells)
+
+    def _reset(self):
+        """Drop everything evaluated since the inputs were last set."""
+        self._values = {}
+        self._spills = {
+            anchor: spill
+            for anchor, spill in self._base._spills.items()
+            if anchor not in self._set
+        }
+        self._arrays = {}
+        self._unevaluated = {run: set(rows) for run, rows in self._cone_rows.items()}
+        self._column_indexes = {}
+
+    def _lookup(self, index):
+        if index not in self._cone:
+            # Evaluated in the snapshot, even when reached from a shared
+            # formula that runs into the cone.
+            return self._base.get_formatted(index)
+        return self._values.get(index)
+
+    def _store(self, index, value):
+        self._values[index] = value
+
+    def _sheet_named(self, name):
+        sheet = self._base._sheet_named(name)
+        return self if sheet is self._base else sheet
+
+    def _invalidate(self, indices):
+        for index in indices:
+            self._values.pop(index, None)
+            self._unevaluated_row(index)
+
+
+class _ForkCells:
+    """The ``cells`` of a `Fork`: those of the snapshot it was made from,
+    except for the ones set in the fork."""
+
+    __slots__ = ("_base", "_set")
+
+    def __init__(self, base, cells):
+        self._base = base
+        self._set = cells
+
+    def get(self, index, default=None):
+        cell = self._set.get(index)
+        if cell is None:
+            return self._base.get(index, default)
+        return cell
+
+    def __getitem__(self, index):
+        cell = self.get(index)
+        if cell is None:
+            raise KeyError(index)
+        return cell
+
+    def __contains__(self, index):
+        return self.get(index) is not None
+
+    def plain(self, index):
+        """Return the text of the cell at `index` if it is plain, or None."""
+        cell = self._set.get(index)
+        if cell is None:
+            return self._base.plain(index)
+        return cell.raw_data if cell.is_plain() else None
+
+
+class _CellsAt:
+    """The ``cells`` of a `Snapshot`: a read-only mapping of the sheet's cells
+    as of `version`, when they were stored as `layout` says (see
+    `CellStore.layout`)."""
+
+    __slots__ = ("_sheet", "_version", "_layout")
+
+    def __init__(self, sheet, version, layout):
+        self._sheet = sheet
+        self._version = version
+        self._layout = layout
+
+    def get(self, index, default=None):
+        physical = self._sheet.cells.physical(index, self._layout)
+        cell = self._sheet._cell_at(physical, self._version)
+        return default if cell is None else cell
+
+    def __getitem__(self, index):
+        cell = self.get(index)
+        if cell is None:
+            raise KeyError(index)
+        return cell
+
+    def __contains__(self, index):
+        return self.get(index) is not None
+
+    def plain(self, index):
+        """Return the text of the cell at `index` if it is plain, or None."""
+        cell = self.get(index)
+        return cell.raw_data if cell is not None and cell.is_plain() else None
+
+
+def _shift(axis, at, count):
+    """Return the `structure.Shift` asked for by `Spreadsheet.insert_rows`
+    and the like."""
+    if at < 0 or abs(count) < 1:
+        raise ValueError(f"Can't move {abs(count)} rows or columns at {at}")
+    return Shift(axis, at, count)
+
+
+def _moved_keys(mapping, move):
+    """Return a copy of `mapping` with each Index key moved by `move`, and
+    without the keys it deletes."""
+    moved = {}
+    for index, value in mapping.items():
+        index = move(index)
+        if index is not None:
+            moved[index] = value
+    return moved
+
+
+def _moved_columns(by_col, shift):
+    """Return a copy of `by_col`, of ColumnIndex or ColumnStats by column,
+    after the columns inserted or deleted by `shift`."""
+    moved = {}
+    for col, value in by_col.items():
+        col = shift.position(col)
+        if col is not None:
+            value.col = col
+            moved[col] = value
+    return moved
+
+
+def _log(history, index, version, old):
+    entries = history.get(index)
+    if entries is None:
+        history[index] = [(version, old)]
+    else:
+        entries.append((version, old))
+
+
+def _logged_after(history, index, version):
+    """Return the first ``(version, old)`` entry for `index` in `history`
+    logged by a version after `version`, or None."""
+    entries = history.get(index)
+    if entries is None:
+        return None
+    i = bisect.bisect_left(entries, (version + 1,))
+    return entries[i] if i < len(entries) else None
+
+
+def _forget(history, logs):
+    """Drop the oldest entries of `history`, those logged in `logs`."""
+    counts = collections.Counter()
+    for log in logs:
+        counts.update(log.keys())
+    for index, count in counts.items():
+        entries = history[index]
+        if count == len(entries):
+            del history[index]
+        else:
+            history[index] = entries[count:]
+
+
+class _Changes:
+    """What one version changed, kept for as long as older snapshots need
+    it."""
+
+    __slots__ = ("version", "cells", "values")
+
+    def __init__(self, version):
+        self.version = version
+        # physical Index -> the Cell, or None, before this version
+        self.cells = {}
+        # Index -> (formatted value, version it was computed at), for the
+        # cached values this version dropped
+        self.values = {}
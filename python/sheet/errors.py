@@ -10,3 +10,33 @@ ERROR = "#ERROR!"
 GETTING_DATA = "#GETTING_DATA"
 SPILL = "#SPILL!"
 CIRCULAR_REFERENCE = "#CIRCULAR REFERENCE"
+
+ALL = frozenset(
+    {
+        DIV0,
+        NA,
+        NAME,
+        NULL,
+        NUM,
+        REF,
+        VALUE,
+        ERROR,
+        GETTING_DATA,
+        SPILL,
+        CIRCULAR_REFERENCE,
+    }
+)
+
+
+def is_error(value):
+    """Return True if `value` is one of the error codes above."""
+    return isinstance(value, str) and value in ALL
+
+
+class FormulaError(Exception):
+    """Raised by a formula function to make the formula evaluate to the error
+    code `code`."""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
@@ -0,0 +1,37 @@
+"""Filtering the rows of a sheet by the values in one column.
+
+The rows are found with the column's `lookup.ColumnIndex` (see
+`conditional.matching_rows`) and returned as a compact ``array('l')``, which
+`views.Viewer` draws through instead of copying any cells.
+"""
+
+from array import array
+
+from .conditional import matching_rows, parse_criterion
+
+__all__ = ["filter_rows"]
+
+
+def filter_rows(sheet, col, criterion):
+    """Return the rows of `sheet` whose value in column `col` meets
+    `criterion`, a criterion like those of ``COUNTIF`` such as ``">100"``.
+
+    >>> from sheet.engine import Spreadsheet
+    >>> from sheet.models import Index
+    >>> sheet = Spreadsheet()
+    >>> for row, value in enumerate(["5", "150", "x", "200"]):
+    ...     sheet.set(Index(row, 1), value)
+    >>> filter_rows(sheet, 1, ">100")
+    array('l', [1, 3])
+
+    Raises:
+        errors.FormulaError: if `criterion` is an error code.
+        NotImplementedError: if `sheet` can't search its columns, like a
+            `sharding.ShardedSpreadsheet`.
+    """
+    last_row = sheet.last_row()
+    if last_row < 0:
+        return array("l")
+    op, key = parse_criterion(criterion)
+    index = sheet.column_index(col)
+    return array("l", matching_rows(index, op, key, 0, last_row))
@@ -0,0 +1,336 @@
+"""Parsing and compilation of cell formulas.
+
+A formula like ``=A1*B1`` is compiled once into a Python code object in which
+every cell reference is replaced by a placeholder variable (``_r0 * _r1``).
+Range references like ``A1:A10`` become ``_g0``, ``_g1``, ... and are bound to
+`arrays.Array` values when the formula is evaluated. References to the cells of
+another sheet of a `workbook.Workbook`, like ``Sheet2!A1`` or
+``'Q1 sales'!B2:B9``, become ``_x0``, ``_x1``, ... Compiled code is cached by
+placeholder expression, so formulas that only differ in the cells they
+reference share one code object.
+
+References to deleted cells (see `Formula.moved`) are written ``#REF!``, and
+a formula holding one evaluates to that error.
+"""
+
+import ast
+import functools
+import re
+from typing import NamedTuple
+
+from . import errors as err
+from .models import Index, Range
+
+__all__ = [
+    "Formula",
+    "parse",
+    "coerce",
+    "display",
+    "function",
+    "sheet_label",
+    "FUNCTIONS",
+]
+
+TOKEN_RE = re.compile(
+    r"""
+(?P<string>"[^"]*")
+|
+(?P<deleted>\#REF!)
+|
+(?<![\w.])
+(?:(?P<sheet>[A-Za-z_]\w*|'[^']+')!)?
+(?P<first>[A-Za-z]+[0-9]+)
+(?::(?P<last>[A-Za-z]+[0-9]+))?
+(?![\w(])
+""",
+    re.VERBOSE,
+)
+
+# Sheet names that references don't need to quote
+SHEET_NAME_RE = re.compile(r"[A-Za-z_]\w*")
+
+NUMBER_RE = re.compile(
+    r"""
+[+-]?
+(?:[0-9]+(?P<fraction>\.[0-9]*)?|(?P<point>\.[0-9]+))
+(?P<exponent>[eE][+-]?[0-9]+)?
+""",
+    re.VERBOSE,
+)
+
+# The only names available to formulas, besides their references. Python's
+# builtins are left out, and so is attribute access (see `_compile`), so that
+# formulas from untrusted clients can't reach anything else.
+FUNCTIONS = {"__builtins__": {}}
+
+
+def function(name):
+    """Decorator making a Python function callable from formulas as `name`.
+
+    Range arguments are passed as `arrays.RangeArray`, single cells as their
+    values (see `coerce`).
+    """
+
+    def register(fn):
+        FUNCTIONS[name] = fn
+        return fn
+
+    return register
+
+
+class Formula(NamedTuple):
+    """A parsed formula, ready to be evaluated by `Cell.evaluate_formula`."""
+
+    code: object
+    """The compiled expression, or None if the formula is invalid."""
+    refs: tuple
+    """The `Index` bound to each ``_r{n}`` placeholder."""
+    ranges: tuple
+    """The `Range` bound to each ``_g{n}`` placeholder."""
+    spill: tuple
+    """``(height, width)`` of the array this formula spills, or None."""
+    error: str
+    """The error code to display if the formula cannot be compiled."""
+    template: str
+    """The formula text with each reference replaced by ``{_r0}``, ``{_g0}``
+    etc, for rendering the formula at another position."""
+    external: tuple = ()
+    """The ``(sheet name, Index or Range)`` bound to each ``_x{n}``
+    placeholder."""
+
+    def render(self, offset=None):
+        """Return the formula text with every reference moved by `offset`.
+
+        >>> parse("A1 * B2").render((2, 0))
+        'A3 * B4'
+        """
+        formula = self if offset is None else self.shifted(offset)
+        labels = {f"_r{n}": str(ref) for n, ref in enumerate(formula.refs)}
+        for n, rng in enumerate(formula.ranges):
+            labels[f"_g{n}"] = str(rng)
+        for n, (name, ref) in enumerate(formula.external):
+            labels[f"_x{n}"] = f"{sheet_label(name)}!{ref}"
+        return self.template.format(**labels)
+
+    def shifted(self, offset):
+        """Return this formula with every reference moved by `offset`."""
+        return self._replace(
+            refs=tuple(ref + offset for ref in self.refs),
+            ranges=tuple(_moved(rng, offset) for rng in self.ranges),
+            external=tuple((name, _moved(ref, offset)) for name, ref in self.external),
+        )
+
+    def relative_to(self, index):
+        """Return a key that is equal for formulas that are copies of each
+        other filled to different cells, i.e. the formula in R1C1 notation.
+
+        >>> d2 = parse("B2*C2").relative_to(Index(1, 3))
+        >>> d3 = parse("B3*C3").relative_to(Index(2, 3))
+        >>> d2 == d3
+        True
+        """
+        return (
+            self.template,
+            tuple(ref - index for ref in self.refs),
+            tuple((rng.first - index, rng.last - index) for rng in self.ranges),
+            tuple(
+                (name, _moved(ref, (-index.row, -index.col)))
+                for name, ref in self.external
+            ),
+        )
+
+    def moved(self, move, local=True, sheet=None):
+        """Return this formula with each reference `ref` replaced by
+        ``move(ref)``, or this formula itself if none moved.
+
+        `move` returns where an Index or Range moved, or None if its cells
+        were deleted, which makes the reference ``#REF!``, like
+        `structure.Shift.moved`. References to the formula's own sheet are
+        moved unless `local` is False, and so are the references to the
+        sheet called `sheet`.
+
+        >>> from sheet.structure import Shift
+        >>> f = parse("SUM(A1:A4) * B3")
+        >>> f.moved(Shift(0, 2, 1).moved).render()
+        'SUM(A1:A5) * B4'
+        >>> f = f.moved(Shift(0, 2, -1).moved)
+        >>> f.render(), f.error
+        ('SUM(A1:A3) * #REF!', '#REF!')
+        """
+        refs, ranges = self.refs, self.ranges
+        if local:
+            refs = tuple(map(move, refs))
+            ranges = tuple(map(move, ranges))
+        external = tuple(
+            (name, move(ref) if name == sheet else ref) for name, ref in self.external
+        )
+        if refs == self.refs and ranges == self.ranges and external == self.external:
+            return self
+        deleted = (
+            None in refs or None in ranges or any(ref is None for _, ref in external)
+        )
+        if not deleted and self.spill is None:
+            return self._replace(refs=refs, ranges=ranges, external=external)
+        # Parse the formula again for its new error or spill.
+        labels = {}
+        for n, ref in enumerate(refs):
+            labels[f"_r{n}"] = err.REF if ref is None else str(ref)
+        for n, rng in enumerate(ranges):
+            labels[f"_g{n}"] = err.REF if rng is None else str(rng)
+        for n, (name, ref) in enumerate(external):
+            label = f"{sheet_label(name)}!{ref}"
+            labels[f"_x{n}"] = err.REF if ref is None else label
+        return parse(self.template.format(**labels))
+
+
+def parse(text):
+    """Parse the body of a formula (without the leading ``=``).
+
+    >>> f = parse("A1*2 + B2")
+    >>> f.refs
+    (Index(row=0, col=0), Index(row=1, col=1))
+    >>> f.spill is None
+    True
+    >>> parse("A1:A3*B1:B3").spill
+    (3, 1)
+    >>> parse("ZY1").error
+    '#REF!'
+    >>> parse("A1.__class__").error
+    '#ERROR!'
+    >>> f = parse("Sheet2!A1 * 'Q1 sales'!B1")
+    >>> f.external[1]
+    ('Q1 sales', Index(row=0, col=1))
+    >>> f.render((1, 0))
+    "Sheet2!A2 * 'Q1 sales'!B2"
+    >>> parse("#REF! + A1").error
+    '#REF!'
+
+    Returns:
+        Formula:
+    """
+    refs = []
+    ranges = []
+    external = []
+    pieces = []
+    pos = 0
+    deleted = False
+    for match in TOKEN_RE.finditer(text):
+        if match["string"] is not None:
+            continue
+        if match["deleted"] is not None:
+            deleted = True
+            continue
+        pieces.append(text[pos : match.start()])
+        pos = match.end()
+        try:
+            first = Index.parse(match["first"])
+            last = None if match["last"] is None else Index.parse(match["last"])
+        except ValueError:
+            return Formula(None, (), (), None, err.REF, _escape(text))
+        if match["sheet"] is not None:
+            pieces.append(f"_x{len(external)}")
+            ref = first if last is None else Range(first, last)
+            external.append((match["sheet"].strip("'"), ref))
+        elif last is None:
+            pieces.append(f"_r{len(refs)}")
+            refs.append(first)
+        else:
+            pieces.append(f"_g{len(ranges)}")
+            ranges.append(Range(first, last))
+    pieces.append(text[pos:])
+    template = "".join(
+        "{%s}" % piece if n % 2 else _escape(piece) for n, piece in enumerate(pieces)
+    )
+    refs = tuple(refs)
+    ranges = tuple(ranges)
+    external = tuple(external)
+    if deleted:
+        return Formula(None, refs, ranges, None, err.REF, template, external)
+    try:
+        code, nested = _compile("".join(pieces))
+    except SyntaxError:
+        return Formula(None, refs, ranges, None, err.ERROR, template, external)
+    spill = _spill(ranges, external, nested)
+    return Formula(code, refs, ranges, spill, None, template, external)
+
+
+def sheet_label(name):
+    """Return the sheet called `name` as written in references, quoted if it
+    isn't a plain name.
+
+    >>> sheet_label("Sheet2"), sheet_label("Q1 sales")
+    ('Sheet2', "'Q1 sales'")
+    """
+    return name if SHEET_NAME_RE.fullmatch(name) else f"'{name}'"
+
+
+def _moved(ref, offset):
+    """Return the Index or Range `ref` moved by `offset`."""
+    if isinstance(ref, Range):
+        return Range(ref.first + offset, ref.last + offset)
+    return ref + offset
+
+
+def _escape(text):
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile(expression):
+    # Returns the code object and the names that appear as (part of) a
+    # function call argument; ranges passed to functions don't spill.
+    tree = ast.parse(expression.strip(), mode="eval")
+    nested = set()
+    for call in ast.walk(tree):
+        if isinstance(call, ast.Attribute):
+            raise SyntaxError("Formulas can't access attributes")
+        if isinstance(call, ast.Call):
+            for arg in call.args + [kw.value for kw in call.keywords]:
+                nested.update(
+                    node.id for node in ast.walk(arg) if isinstance(node, ast.Name)
+                )
+    return compile(tree, "<formula>", "eval"), frozenset(nested)
+
+
+def _spill(ranges, external, nested):
+    operands = [r for n, r in enumerate(ranges) if f"_g{n}" not in nested]
+    operands.extend(
+        ref
+        for n, (_, ref) in enumerate(external)
+        if isinstance(ref, Range) and f"_x{n}" not in nested
+    )
+    if not operands:
+        return None
+    return (max(r.height for r in operands), max(r.width for r in operands))
+
+
+def coerce(text):
+    """Convert a formatted cell value into the value formulas operate on.
+
+    Empty cells become None, decimal numbers become int or float, and
+    anything else (including error codes) stays a string.
+
+    >>> [coerce(s) for s in ["", "3", "-2.5", "1e3", "abc"]]
+    [None, 3, -2.5, 1000.0, 'abc']
+    >>> [coerce(s) for s in ["nan", "inf", "1_000", " 3"]]
+    ['nan', 'inf', '1_000', ' 3']
+    """
+    if text == "":
+        return None
+    match = NUMBER_RE.fullmatch(text)
+    if match is None:
+        return text
+    if match["fraction"] or match["point"] or match["exponent"]:
+        return float(text)
+    return int(text)
+
+
+def display(value):
+    """Convert a formula result back into the string shown in the cell.
+
+    >>> [display(v) for v in [None, 3, 2.5, "abc"]]
+    ['0', '3', '2.5', 'abc']
+    """
+    if value is None:
+        return "0"
+    return str(value)
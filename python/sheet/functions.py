@@ -0,0 +1,90 @@
+"""Basic numeric functions available to formulas.
+
+Arguments may be single values or ranges (`arrays.Array`). Inside ranges,
+blanks and text are skipped as in Excel; an error anywhere makes the whole
+function return that error.
+"""
+
+import math
+
+from . import errors as err
+from .arrays import Array
+from .formula import function
+
+__all__ = ["numbers"]
+
+
+def numbers(args):
+    """Return the numbers in `args`, flattening ranges column by column.
+
+    >>> numbers([1, Array([[2, None, "x"], [True, 3.5, 4]])])
+    [1, 2, True, 3.5, 4]
+
+    Raises:
+        errors.FormulaError: if any argument is or holds an error, or a
+            single value isn't a number.
+    """
+    result = []
+    for arg in args:
+        if isinstance(arg, Array):
+            for column in arg.columns:
+                for value in column:
+                    if isinstance(value, str):
+                        if err.is_error(value):
+                            raise err.FormulaError(value)
+                    elif value is not None:
+                        result.append(value)
+        elif isinstance(arg, str):
+            raise err.FormulaError(arg if err.is_error(arg) else err.VALUE)
+        elif arg is not None:
+            result.append(arg)
+    return result
+
+
+@function("SUM")
+def sum_(*args):
+    return sum(numbers(args))
+
+
+@function("COUNT")
+def count(*args):
+    return len(numbers(args))
+
+
+@function("AVERAGE")
+def average(*args):
+    values = numbers(args)
+    if not values:
+        return err.DIV0
+    return sum(values) / len(values)
+
+
+@function("MIN")
+def min_(*args):
+    return min(numbers(args), default=0)
+
+
+@function("MAX")
+def max_(*args):
+    return max(numbers(args), default=0)
+
+
+@function("ABS")
+def abs_(value):
+    (value,) = numbers([value])
+    return abs(value)
+
+
+@function("ROUND")
+def round_(value, digits=0):
+    """Round halves away from zero, as in Excel rather than Python.
+
+    >>> round_(2.5), round_(-2.5), round_(1.25, 1)
+    (3, -3, 1.3)
+    """
+    (value,) = numbers([value])
+    digits = int(digits)
+    rounded = math.floor(abs(value) * 10**digits + 0.5) / 10**digits
+    if digits <= 0:
+        rounded = int(rounded)
+    return rounded if value >= 0 else -rounded
@@ -0,0 +1,111 @@
+"""Whole-column evaluation of shared arithmetic formulas.
+
+A `SharedFormula` like ``=B2*C2-D2`` filled down a column is evaluated a row
+at a time by `cell.evaluate_formula`: each row binds its references and runs
+the formula's code object through `eval`. When the formula is plain
+arithmetic on single cells, `kernel` instead generates one Python function
+for it that loops over the columns of values the formula reads (from
+`Spreadsheet.get_array`) and computes every row in one call.
+
+Kernels only handle rows whose references all hold numbers. Any other row
+(a blank or text reference, an error, an exception other than division by
+zero) is handed back to the caller to evaluate the usual way, so every cell
+still shows the same value or error code as it would without kernels.
+"""
+
+import ast
+import functools
+import sys
+
+from . import errors as err
+from .formula import display
+
+__all__ = ["kernel"]
+
+if sys.version_info >= (3, 8):
+    _NUMBER_NODES = (ast.Constant,)
+else:
+    _NUMBER_NODES = (ast.Num,)
+
+# Nodes an expression may contain to be compiled into a kernel, besides
+# numbers and the names of its references
+_ARITHMETIC_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.operator, ast.unaryop)
+
+_GLOBALS = {
+    "__builtins__": {},
+    "_enumerate": enumerate,
+    "_zip": zip,
+    "_isinstance": isinstance,
+    "_number": (int, float),
+    "_display": display,
+    "_DIV0": err.DIV0,
+    "_ZeroDivisionError": ZeroDivisionError,
+    "_Exception": Exception,
+}
+
+_SOURCE = """\
+def kernel(_columns, _fallback):
+    _out = []
+    _append = _out.append
+    for _i, ({names},) in _enumerate(_zip(*_columns)):
+        if {checks}:
+            try:
+                _append(_display({expression}))
+                continue
+            except _ZeroDivisionError:
+                _append(_DIV0)
+                continue
+            except _Exception:
+                pass
+        _append(_fallback(_i))
+    return _out
+"""
+
+
+def kernel(formula):
+    """Return a function evaluating `formula` for many rows at once, or None
+    if the formula isn't plain arithmetic on single cells.
+
+    The function takes a list of columns, the values (see `formula.coerce`)
+    of each of the formula's references row after row, and a `fallback`
+    function returning the displayed value of row ``i`` the usual way. It
+    returns the displayed value of every row.
+
+    >>> from sheet.formula import parse
+    >>> add = kernel(parse("A1 + B1 / 2"))
+    >>> add([[1, 2, "x"], [4, 0, 1]], lambda i: "row %d" % i)
+    ['3.0', '2.0', 'row 2']
+    >>> kernel(parse("SUM(A1:A3)")) is None
+    True
+    """
+    if formula.code is None or formula.ranges or formula.external or not formula.refs:
+        return None
+    names = {f"_r{n}": f"_r{n}" for n in range(len(formula.refs))}
+    return _compile(formula.template.format(**names).strip(), len(formula.refs))
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile(expression, count):
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError:
+        return None
+    names = [f"_r{n}" for n in range(count)]
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if node.id not in names or not isinstance(node.ctx, ast.Load):
+                return None
+        elif isinstance(node, _NUMBER_NODES):
+            value = node.value if sys.version_info >= (3, 8) else node.n
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return None
+        elif not isinstance(node, (_ARITHMETIC_NODES, ast.Load)):
+            return None
+    source = _SOURCE.format(
+        names=", ".join(names),
+        checks=" and ".join(f"_isinstance({name}, _number)" for name in names),
+        expression=expression,
+    )
+    namespace = dict(_GLOBALS)
+    exec(compile(source, "<kernel>", "exec"), namespace)
+    return namespace["kernel"]
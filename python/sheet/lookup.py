@@ -0,0 +1,337 @@
+"""Lookup functions (VLOOKUP, MATCH, XLOOKUP) backed by per-column indexes.
+
+Looking a value up in a range by scanning it costs time proportional to the
+range for every lookup formula. Instead, each sheet keeps a `ColumnIndex` for
+every column that lookups have searched, built the first time it is needed.
+Exact matches are a dict lookup followed by a binary search for the first
+matching row inside the searched range, so formulas filled down a column
+whose ranges slide along with them share one index. Approximate ("sorted")
+matches are a binary search over the column's values.
+
+The engine tells an index which rows changed (see `ColumnIndex.discard`), and
+those rows are looked at again before the next lookup; the rest of the index
+is kept.
+"""
+
+import bisect
+import itertools
+
+from . import errors as err
+from .arrays import Array, RangeArray
+from .formula import coerce, function
+from .models import Index, Range
+from .sortedlist import SortedList
+from .windows import SlidingWindows
+
+__all__ = ["ColumnIndex", "ERROR_KEYS", "value_key"]
+
+
+def value_key(value):
+    """Order and compare values like lookups do: blanks, then numbers, then
+    text ignoring case.
+
+    >>> sorted(map(value_key, ["b", 2, "A", None, 10]))
+    [(0, 0), (1, 2), (1, 10), (2, 'a'), (2, 'b')]
+    """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, str):
+        return (2, value.casefold())
+    return (1, value)
+
+
+# value_key(error code) -> error code
+ERROR_KEYS = {value_key(code): code for code in err.ALL}
+
+
+def _number(item):
+    """The number in a ``(key, row)`` item of `ColumnIndex.sorted`, or 0."""
+    key = item[0]
+    return key[1] if key[0] == 1 else 0
+
+
+class ColumnIndex:
+    """The values of rows `lo` to `hi` of one column of a sheet, indexed for
+    lookups.
+
+    >>> from sheet.engine import Spreadsheet
+    >>> sheet = Spreadsheet()
+    >>> for row, value in enumerate(["pear", "apple", "pear"]):
+    ...     sheet.set(Index(row, 0), value)
+    >>> index = sheet.column_index(0)
+    >>> index.find("PEAR", 0, 2), index.find("pear", 1, 2), index.find("fig", 0, 2)
+    (0, 2, None)
+    """
+
+    def __init__(self, sheet, col):
+        self.sheet = sheet
+        self.col = col
+        # True while reading the sheet; a lookup reached from there must scan
+        self.busy = False
+        self.lo = 0
+        self.hi = -1
+        # value_key(value) of each row from `lo` to `hi`
+        self._keys = []
+        # value_key(value) -> sorted rows holding that value
+        self._rows = {}
+        # rows whose values may have changed since they were indexed
+        self._stale = set()
+        # SortedList of (key, row) for every row, once `sorted` is called
+        self._sorted = None
+        # (n, leaf, combine) -> SlidingWindows over `_keys`, see `window`
+        self._windows = {}
+
+    def find(self, value, first_row, last_row, visited_cells=None):
+        """Return the first row from `first_row` to `last_row` holding
+        `value`, or None."""
+        self._update(first_row, last_row, visited_cells)
+        rows = self._rows.get(value_key(value))
+        if not rows:
+            return None
+        i = bisect.bisect_left(rows, first_row)
+        if i < len(rows) and rows[i] <= last_row:
+            return rows[i]
+        return None
+
+    def find_sorted(self, value, first_row, last_row, visited_cells=None):
+        """Return the last row from `first_row` to `last_row` whose value is
+        not greater than `value`, assuming those rows are sorted in
+        ascending order, or None."""
+        self._update(first_row, last_row, visited_cells)
+        i = bisect.bisect_right(
+            self._keys, value_key(value), first_row - self.lo, last_row + 1 - self.lo
+        )
+        return None if i == first_row - self.lo else i - 1 + self.lo
+
+    def rows_with(self, key, first_row, last_row, visited_cells=None):
+        """Return the rows from `first_row` to `last_row` whose value has the
+        `value_key` `key`."""
+        self._update(first_row, last_row, visited_cells)
+        rows = self._rows.get(key, ())
+        start = bisect.bisect_left(rows, first_row)
+        return rows[start : bisect.bisect_right(rows, last_row, start)]
+
+    def keys(self, first_row, last_row, visited_cells=None):
+        """Return the `value_key` of the value in each row from `first_row` to
+        `last_row`."""
+        self._update(first_row, last_row, visited_cells)
+        return self._keys[first_row - self.lo : last_row + 1 - self.lo]
+
+    def sorted(self, first_row, last_row, visited_cells=None):
+        """Return a `SortedList` of ``(key, row)`` for every row from `lo` to
+        `hi`, after indexing `first_row` to `last_row`.
+
+        The list is built the first time it is asked for, and then kept up to
+        date along with the rest of the index. It keeps sums of the numbers
+        in the column, see `SortedList.sum`.
+        """
+        self._update(first_row, last_row, visited_cells)
+        if self._sorted is None:
+            items = zip(self._keys, itertools.count(self.lo))
+            self._sorted = SortedList(items, value=_number)
+        return self._sorted
+
+    def window(self, n, leaf, combine, first_row, last_row, visited_cells=None):
+        """Return the aggregate of the values of the `n` rows up to
+        `last_row`, but not above `first_row`, as computed by a
+        `windows.SlidingWindows` over their `value_key`s.
+
+        The windows of each `n`, `leaf` and `combine` are kept up to date
+        along with the rest of the index, so consecutive windows cost O(1)
+        each.
+        """
+        self._update(first_row, last_row, visited_cells)
+        n = min(n, last_row - first_row + 1)
+        windows = self._windows.get((n, leaf, combine))
+        if windows is None:
+            windows = SlidingWindows(n, leaf, combine)
+            self._windows[n, leaf, combine] = windows
+        return windows.get(self._keys, last_row - self.lo)
+
+    def discard(self, row):
+        """Note that the value at `row` may have changed."""
+        if self.lo <= row <= self.hi and row not in self._stale:
+            self._remove(row, self._keys[row - self.lo])
+            self._stale.add(row)
+            for windows in self._windows.values():
+                windows.discard(row - self.lo)
+
+    def _update(self, first_row, last_row, visited_cells):
+        self.busy = True
+        try:
+            self._read_missing(first_row, last_row, visited_cells)
+        finally:
+            self.busy = False
+
+    def _read_missing(self, first_row, last_row, visited_cells):
+        if not self._keys:
+            self.lo, self.hi = first_row, first_row - 1
+        wanted = (first_row, last_row, visited_cells)
+        if first_row < self.lo:
+            keys = self._read_rows(first_row, self.lo - 1, *wanted)
+            self._keys[:0] = keys
+            self.lo = first_row
+            # Their blocks start at a different row now.
+            self._windows.clear()
+            for row, key in enumerate(keys, first_row):
+                self._add(row, key)
+        if last_row > self.hi:
+            first = self.hi + 1
+            keys = self._read_rows(first, last_row, *wanted)
+            self._keys.extend(keys)
+            self.hi = last_row
+            for row, key in enumerate(keys, first):
+                self._add(row, key)
+        while self._stale:
+            row = self._stale.pop()
+            index = Index(row, self.col)
+            visited = visited_cells if first_row <= row <= last_row else set()
+            key = value_key(coerce(self.sheet.get_formatted(index, visited)))
+            self._keys[row - self.lo] = key
+            self._add(row, key)
+
+    def _read_rows(self, start, stop, first_row, last_row, visited_cells):
+        """Return the keys of rows `start` to `stop`.
+
+        Only rows `first_row` to `last_row` are read by the formula being
+        evaluated, so the cells it is reached from, in `visited_cells`, are
+        only their ancestors: the other rows are read with a visited set of
+        their own, or reaching one of those cells would look circular.
+        """
+        keys = []
+        for first, last, visited in (
+            (start, min(stop, first_row - 1), set()),
+            (max(start, first_row), min(stop, last_row), visited_cells),
+            (max(start, last_row + 1), stop, set()),
+        ):
+            if first <= last:
+                keys.extend(self._read(first, last, visited))
+        return keys
+
+    def _read(self, first_row, last_row, visited_cells):
+        cells = Range(Index(first_row, self.col), Index(last_row, self.col))
+        (column,) = self.sheet.get_array(cells, visited_cells).columns
+        # Rows holding the same text share one key, so a column of a few
+        # distinct strings costs a pointer per row.
+        texts = {}
+        keys = []
+        for value in column:
+            if isinstance(value, str):
+                key = texts.get(value)
+                if key is None:
+                    key = texts[value] = value_key(value)
+            else:
+                key = value_key(value)
+            keys.append(key)
+        return keys
+
+    def _add(self, row, key):
+        if self._sorted is not None:
+            self._sorted.add((key, row))
+        rows = self._rows.get(key)
+        if rows is None:
+            self._rows[key] = [row]
+        elif rows[-1] < row:
+            rows.append(row)
+        else:
+            bisect.insort(rows, row)
+
+    def _remove(self, row, key):
+        if self._sorted is not None:
+            self._sorted.remove((key, row))
+        rows = self._rows[key]
+        del rows[bisect.bisect_left(rows, row)]
+        if not rows:
+            del self._rows[key]
+
+
+def _scalar(value):
+    if isinstance(value, Array):
+        value = value.columns[0][0]
+    if err.is_error(value):
+        raise err.FormulaError(value)
+    return value
+
+
+def _match_row(value, array, mode):
+    """Return the offset of `value` down the single column `array`, or None.
+
+    `mode` is 0 for an exact match, 1 for the largest value not greater than
+    `value` in an ascending column, and -1 for the smallest value not less
+    than `value` in a descending one.
+    """
+    if isinstance(array, RangeArray) and array.width == 1 and mode >= 0:
+        first, last = array.range
+        index = array.sheet.column_index(first.col)
+        if not index.busy:
+            find = index.find if mode == 0 else index.find_sorted
+            row = find(value, first.row, last.row, array.visited_cells)
+            return None if row is None else row - first.row
+    key = value_key(value)
+    keys = [value_key(v) for v in array.columns[0]]
+    if mode == 0:
+        return keys.index(key) if key in keys else None
+    if mode == 1:
+        i = bisect.bisect_right(keys, key)
+        return i - 1 if i else None
+    found = None
+    for offset, k in enumerate(keys):
+        if k < key:
+            break
+        found = offset
+    return found
+
+
+def _value_at(array, row, col):
+    if isinstance(array, RangeArray):
+        index = array.range.first + (row, col)
+        return coerce(array.sheet.get_formatted(index, array.visited_cells))
+    return array.columns[col][row]
+
+
+@function("VLOOKUP")
+def vlookup(value, table, col_index, approximate=True):
+    """Find `value` in the first column of `table` and return the value in
+    column `col_index` (counting from 1) of the same row.
+
+    With `approximate`, the first column must be sorted and the last row not
+    greater than `value` is used, as in Excel.
+    """
+    value = _scalar(value)
+    if not 1 <= col_index <= table.width:
+        return err.REF
+    first_column = table if table.width == 1 else _first_column(table)
+    row = _match_row(value, first_column, 1 if approximate else 0)
+    if row is None:
+        return err.NA
+    return _value_at(table, row, col_index - 1)
+
+
+@function("MATCH")
+def match(value, array, match_type=1):
+    """Return the position (counting from 1) of `value` in the single column
+    `array`; see `_match_row` for `match_type`."""
+    row = _match_row(_scalar(value), array, match_type)
+    return err.NA if row is None else row + 1
+
+
+@function("XLOOKUP")
+def xlookup(value, lookup_array, return_array, if_not_found=err.NA):
+    """Find `value` in the single column `lookup_array` and return the row of
+    `return_array` at the same position."""
+    row = _match_row(_scalar(value), lookup_array, 0)
+    if row is None:
+        return if_not_found
+    if return_array.width == 1:
+        return _value_at(return_array, row, 0)
+    return Array(
+        [[_value_at(return_array, row, col)] for col in range(return_array.width)]
+    )
+
+
+def _first_column(table):
+    if isinstance(table, RangeArray):
+        first, last = table.range
+        cells = Range(first, Index(last.row, first.col))
+        return RangeArray(table.sheet, cells, table.visited_cells)
+    return Array(table.columns[:1])
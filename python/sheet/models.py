@@ -1,20 +1,12 @@
 """Support classes for working with a spreadsheet."""
 
 from typing import NamedTuple
-import re
+import functools
+import itertools
+import string
 
 __all__ = ["Index", "Range"]
 
-INDEX_RE = re.compile(
-    r"""
-^
-(?P<col>(?P<char>[A-Z])(?P=char)*)
-(?P<row>[0-9]+)
-$
-""",
-    re.VERBOSE | re.IGNORECASE,
-)
-
 
 class Index(NamedTuple):
     """A spreadsheet index, like ``'A1'`` or ``'ZZZ123'``.
@@ -44,7 +36,7 @@ class Index(NamedTuple):
         Returns:
             Index:
         """
-        return self._binop(int.__add__, other)
+        return Index(self.row + other[0], self.col + other[1])
 
     def __sub__(self, other):
         """Return a new Index with the difference of the `row` and `col`
@@ -58,7 +50,7 @@ class Index(NamedTuple):
         Returns:
             Index:
         """
-        return self._binop(int.__sub__, other)
+        return Index(self.row - other[0], self.col - other[1])
 
     def min(self, other):
         """Return a new Index with the smaller of each `row` and `col` attr.
@@ -101,9 +93,7 @@ class Index(NamedTuple):
         'BBB'
 
         """
-        nreps = (self.col // 26) + 1
-        char = chr(ord("A") + self.col % 26)
-        return nreps * char
+        return _column_label(self.col)
 
     @property
     def row_label(self):
@@ -114,13 +104,15 @@ class Index(NamedTuple):
         """
         return str(self.row + 1)
 
+    # Labels are drawn on screen and sent to clients over and over.
+    @functools.lru_cache(maxsize=1 << 16)
     def __str__(self):
         """The human readable cell label.
 
         >>> str(Index(9, 27))
         'BB10'
         """
-        return f"{self.column_label}{self.row_label}"
+        return f"{_column_label(self.col)}{self.row + 1}"
 
     @classmethod
     def parse(cls, label):
@@ -135,14 +127,31 @@ class Index(NamedTuple):
         >>> Index.parse("bb10")
         Index(row=9, col=27)
         """
-        match = INDEX_RE.match(label)
-        if match is None:
-            raise ValueError(f"{label} is not a valid spreadsheet index")
-        row = int(match["row"]) - 1
-        char = match["char"].upper()
-        num_chars = len(match["col"])
-        col = 26 * (num_chars - 1) + ord(char) - ord("A")
-        return Index(row=row, col=col)
+        return _parse_index(label)
+
+
+@functools.lru_cache(maxsize=None)
+def _column_label(col):
+    nreps = (col // 26) + 1
+    char = chr(ord("A") + col % 26)
+    return nreps * char
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_index(label):
+    """`Index.parse`, remembering the most recent labels: formulas filled
+    down a sheet mention the same cells over and over."""
+    digits = label.lstrip(string.ascii_letters)
+    letters = label[: len(label) - len(digits)].upper()
+    if (
+        not letters
+        or letters != letters[0] * len(letters)
+        or not digits.isdigit()
+        or not digits.isascii()
+    ):
+        raise ValueError(f"{label} is not a valid spreadsheet index")
+    col = 26 * (len(letters) - 1) + ord(letters[0]) - ord("A")
+    return Index(int(digits) - 1, col)
 
 
 class _Range(NamedTuple):
@@ -212,6 +221,27 @@ class Range(_Range):
             and self.first.row <= pos.row <= self.last.row
         )
 
+    def overlaps(self, other):
+        """Returns true if the range shares any cell with the range `other`.
+
+        >>> Range.parse('B2:C3').overlaps(Range.parse('C3:D4'))
+        True
+        >>> Range.parse('B2:C3').overlaps(Range.parse('D1:D9'))
+        False
+
+        Args:
+            other (Range):
+
+        Returns:
+            bool:
+        """
+        return (
+            self.first.col <= other.last.col
+            and other.first.col <= self.last.col
+            and self.first.row <= other.last.row
+            and other.first.row <= self.last.row
+        )
+
     def __str__(self):
         """The human readable syntax for the range.
 
@@ -264,8 +294,9 @@ class Range(_Range):
         Returns:
             Iterator(int):
         """
-        for i in range(self.height):
-            yield from self.row(i)
+        rows = range(self.first.row, self.last.row + 1)
+        cols = range(self.first.col, self.last.col + 1)
+        return map(Index._make, itertools.product(rows, cols))
 
     @classmethod
     def parse(cls, desc):
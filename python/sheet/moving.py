@@ -0,0 +1,115 @@
+"""Moving aggregates (MOVINGSUM, MOVINGAVG, MOVINGMIN, MOVINGMAX).
+
+``MOVINGAVG(B1:B60)`` is the average of the numbers in ``B1:B60``, like
+``AVERAGE``; ``MOVINGAVG(B1:B100, 60)`` only averages the last 60 rows of
+the range. Filled down a column, the window slides one row at a time.
+
+Each window of a single column is computed by the column's
+`lookup.ColumnIndex.window`, which keeps block-wise partial aggregates of
+the column (see `windows.SlidingWindows`). A whole column of windows then
+costs O(1) per row instead of re-adding each window, and appending a row or
+changing a cell only recalculates the windows that cover it, the dependency
+graph taking care of the rest.
+"""
+
+import functools
+import operator
+
+from . import errors as err
+from .arrays import RangeArray
+from .formula import function
+from .functions import numbers
+from .lookup import ERROR_KEYS, value_key
+
+__all__ = []
+
+# Aggregates are (count of numbers, their sum or extreme, first error code)
+_EMPTY = (0, None, None)
+
+
+def _leaf(key):
+    if key[0] == 1:
+        return (1, key[1], None)
+    if key in ERROR_KEYS:
+        return (0, None, ERROR_KEYS[key])
+    return _EMPTY
+
+
+def _combiner(op):
+    """Return a function combining two aggregates with `op`."""
+
+    def combine(a, b):
+        if not a[0] or not b[0]:
+            value = b[1] if not a[0] else a[1]
+        else:
+            value = op(a[1], b[1])
+        return (a[0] + b[0], value, a[2] or b[2])
+
+    return combine
+
+
+_add = _combiner(operator.add)
+_min = _combiner(min)
+_max = _combiner(max)
+
+
+def _window(array, n, combine):
+    """Return the count and the aggregate of the numbers in the last `n` rows
+    of the first column of `array` (all of them if `n` is None).
+
+    Raises:
+        errors.FormulaError: if `n` isn't a positive number, or the window
+            holds an error.
+    """
+    if n is None:
+        n = array.height
+    else:
+        (n,) = numbers([n])
+        n = int(n)
+        if n < 1:
+            raise err.FormulaError(err.NUM)
+    if isinstance(array, RangeArray) and array.width == 1:
+        first, last = array.range
+        index = array.sheet.column_index(first.col)
+        if not index.busy:
+            count, value, error = index.window(
+                n, _leaf, combine, first.row, last.row, array.visited_cells
+            )
+            if error:
+                raise err.FormulaError(error)
+            return count, value
+    leaves = (_leaf(value_key(value)) for value in array.columns[0][-n:])
+    count, value, error = functools.reduce(combine, leaves, _EMPTY)
+    if error:
+        raise err.FormulaError(error)
+    return count, value
+
+
+@function("MOVINGSUM")
+def movingsum(array, n=None):
+    """The sum of the numbers in the last `n` rows of `array`."""
+    count, total = _window(array, n, _add)
+    return total if count else 0
+
+
+@function("MOVINGAVG")
+def movingavg(array, n=None):
+    """The average of the numbers in the last `n` rows of `array`."""
+    count, total = _window(array, n, _add)
+    if not count:
+        return err.DIV0
+    return total / count
+
+
+@function("MOVINGMIN")
+def movingmin(array, n=None):
+    """The smallest number in the last `n` rows of `array`, or 0."""
+    count, smallest = _window(array, n, _min)
+    return smallest if count else 0
+
+
+@function("MOVINGMAX")
+def movingmax(array, n=None):
+    """The largest number in the last `n` rows of `array`, or 0."""
+    count, largest = _window(array, n, _max)
+    return largest if count else 0
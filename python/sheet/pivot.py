@@ -0,0 +1,284 @@
+"""Live group-by summaries of a range (see `Spreadsheet.pivot`).
+
+The rows of the source range are grouped by the values in their key columns,
+compared like lookups compare them (`lookup.value_key`), in one pass over the
+range's column buffers. Each group keeps the numbers of each aggregated
+column in a `SortedList`, which knows their count, sum, minimum and maximum,
+so a changed source row only moves its values between two groups. Only the
+output rows of the groups that changed are written again.
+"""
+
+import collections
+
+from . import errors as err
+from .formula import coerce
+from .lookup import value_key
+from .models import Index, Range
+from .sortedlist import SortedList
+
+__all__ = ["AGGREGATES", "Pivot"]
+
+
+def _number(value):
+    return value
+
+
+AGGREGATES = {
+    "SUM": lambda numbers: numbers.sum(0, len(numbers)),
+    "COUNT": len,
+    "AVERAGE": lambda numbers: (
+        numbers.sum(0, len(numbers)) / len(numbers) if numbers else err.DIV0
+    ),
+    "MIN": lambda numbers: numbers[0] if numbers else 0,
+    "MAX": lambda numbers: numbers[-1] if numbers else 0,
+}
+
+
+class _Group:
+    """The source rows sharing one key."""
+
+    def __init__(self, labels, width):
+        # The key values as first seen, shown in the output
+        self.labels = labels
+        self.rows = 0
+        # For each aggregated column, its numbers and a Counter of its errors
+        self.numbers = [SortedList(value=_number) for _ in range(width)]
+        self.errors = [collections.Counter() for _ in range(width)]
+
+    def add(self, values, sign=1):
+        self.rows += sign
+        for numbers, errors, value in zip(self.numbers, self.errors, values):
+            if isinstance(value, str):
+                if err.is_error(value):
+                    errors[value] += sign
+            elif value is not None:
+                if sign > 0:
+                    numbers.add(value)
+                else:
+                    numbers.remove(value)
+
+    def remove(self, values):
+        self.add(values, -1)
+
+    def extend(self, rows):
+        """Add the values of many rows to an empty group at once."""
+        self.rows = len(rows)
+        for i, column in enumerate(zip(*rows)):
+            numbers = [
+                value
+                for value in column
+                if value is not None and not isinstance(value, str)
+            ]
+            self.numbers[i] = SortedList(numbers, value=_number)
+            self.errors[i].update(filter(err.is_error, column))
+
+
+class Pivot:
+    """A summary of `source`, grouped by its columns `keys`, written to the
+    cells from `target` down and to the right.
+
+    Each output row holds the key values of a group, then one aggregate per
+    ``(col, name)`` pair of `values`, where `name` is one of `AGGREGATES`.
+    Rows whose key columns are all blank are left out. Groups are listed in
+    the order they first appear in the source.
+
+    Once built, the pivot follows changes to the source: see `update`.
+    """
+
+    def __init__(self, sheet, source, keys, values, target):
+        self.sheet = sheet
+        self.source = source
+        self.keys = list(keys)
+        self.values = [(col, name.upper()) for col, name in values]
+        self.target = target
+        for col in self.keys + [col for col, _ in self.values]:
+            if not source.first.col <= col <= source.last.col:
+                raise ValueError(f"Column {Index(0, col).column_label} not in {source}")
+        for _, name in self.values:
+            if name not in AGGREGATES:
+                raise ValueError(f"Unknown aggregate {name}")
+        width = len(self.keys) + len(self.values)
+        output = Range(target, target + (source.height - 1, width - 1))
+        if output.overlaps(source):
+            raise ValueError(f"A pivot of {source} can't be written over it")
+        # row -> (group key, aggregated values) of each source row in a group
+        self._rows = {}
+        # group key -> _Group; the keys in the order the groups are shown;
+        # and each key's position in that order
+        self._groups = {}
+        self._order = []
+        self._positions = {}
+        # The number of output rows written so far
+        self._written = 0
+        # The cells of the output to clear before building the summary again,
+        # after `move`, or None
+        self._cleared = None
+        self._build()
+
+    def move(self, shift):
+        """Follow the rows or columns inserted or deleted by the
+        `structure.Shift` `shift`, which the sheet has already moved its
+        cells by. If the source or the output moved, the summary is built
+        again by the next `update`.
+
+        Returns:
+            bool: False if the source, one of its key or value columns, or
+            the target was deleted, and the summary can't be kept up to date
+            any more.
+        """
+        source = shift.moved(self.source)
+        target = shift.moved(self.target)
+        keys = self.keys
+        values = self.values
+        if shift.axis == 1:
+            keys = [shift.position(col) for col in keys]
+            values = [(shift.position(col), name) for col, name in values]
+        if (
+            source is None
+            or target is None
+            or None in keys
+            or any(col is None for col, _ in values)
+        ):
+            return False
+        if (source, target, keys, values) == (
+            self.source,
+            self.target,
+            self.keys,
+            self.values,
+        ):
+            return True
+        width = len(self.keys) + len(self.values)
+        output = shift.moved(
+            Range(self.target, self.target + (max(self._written, 1) - 1, width - 1))
+        )
+        self._cleared = [] if output is None else list(output.indices)
+        self.source, self.target, self.keys, self.values = source, target, keys, values
+        return True
+
+    def update(self, changed):
+        """Regroup the rows of `changed` cells that are in the source, and
+        rewrite the output rows of the groups that changed.
+
+        Returns:
+            set: the cells whose values may have changed in turn.
+        """
+        if self._cleared is not None:
+            return self._rebuild()
+        source = self.source
+        rows = {index.row for index in changed if source.contains(index)}
+        dirty = set()
+        for row in rows:
+            key, labels, values = self._read_row(row)
+            old = self._rows.pop(row, None)
+            if old == (key, values):
+                self._rows[row] = old
+                continue
+            if old is not None:
+                self._groups[old[0]].remove(old[1])
+                dirty.add(old[0])
+            if key is not None:
+                self._group(key, labels).add(values)
+                self._rows[row] = (key, values)
+                dirty.add(key)
+        if not dirty:
+            return set()
+        emptied = [key for key in dirty if not self._groups[key].rows]
+        if emptied:
+            # The groups below an emptied one move up.
+            first_moved = min(self._positions[key] for key in emptied)
+            for key in emptied:
+                del self._groups[key]
+            self._order = [key for key in self._order if key in self._groups]
+            self._positions = {key: i for i, key in enumerate(self._order)}
+            dirty.difference_update(emptied)
+            dirty.update(self._order[first_moved:])
+        return self._write(sorted(self._positions[key] for key in dirty))
+
+    def _rebuild(self):
+        """Clear the output, and build the summary again from scratch."""
+        cleared, self._cleared = self._cleared, None
+        self._rows = {}
+        self._groups = {}
+        self._order = []
+        self._positions = {}
+        self._written = 0
+        with self.sheet.batch() as changed:
+            for index in cleared:
+                self.sheet.set(index, "")
+            self._build()
+        return changed
+
+    def _build(self):
+        array = self.sheet.get_array(self.source)
+        first = self.source.first
+        key_columns = [array.columns[col - first.col] for col in self.keys]
+        value_columns = [array.columns[col - first.col] for col, _ in self.values]
+        # group key -> values of its rows
+        grouped = collections.defaultdict(list)
+        for offset, labels in enumerate(zip(*key_columns)):
+            key = tuple(map(value_key, labels))
+            if not any(key_part[0] for key_part in key):
+                continue
+            values = tuple(column[offset] for column in value_columns)
+            if key not in grouped:
+                self._group(key, labels)
+            grouped[key].append(values)
+            self._rows[first.row + offset] = (key, values)
+        for key, rows in grouped.items():
+            self._groups[key].extend(rows)
+        self._write(range(len(self._order)))
+
+    def _read_row(self, row):
+        """Return the group key, key values and aggregated values of `row`,
+        with a key of None if the row's key columns are blank."""
+        sheet = self.sheet
+        labels = tuple(
+            coerce(sheet.get_formatted(Index(row, col))) for col in self.keys
+        )
+        key = tuple(map(value_key, labels))
+        if not any(key_part[0] for key_part in key):
+            key = None
+        values = tuple(
+            coerce(sheet.get_formatted(Index(row, col))) for col, _ in self.values
+        )
+        return key, labels, values
+
+    def _group(self, key, labels):
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = _Group(labels, len(self.values))
+            self._positions[key] = len(self._order)
+            self._order.append(key)
+        return group
+
+    def _write(self, positions):
+        """Write the output rows of the groups at `positions` in the order,
+        and clear any rows left below the last group. Returns the cells whose
+        values may have changed."""
+        order = self._order
+        groups = self._groups
+        with self.sheet.batch() as changed:
+            for position in positions:
+                group = groups[order[position]]
+                cells = [_text(label) for label in group.labels]
+                for (_, name), numbers, errors in zip(
+                    self.values, group.numbers, group.errors
+                ):
+                    if +errors:
+                        cells.append(min(+errors))
+                    else:
+                        cells.append(_text(AGGREGATES[name](numbers)))
+                self._write_row(position, cells)
+            width = len(self.keys) + len(self.values)
+            for position in range(len(order), self._written):
+                self._write_row(position, [""] * width)
+        self._written = len(order)
+        return changed
+
+    def _write_row(self, position, cells):
+        for offset, text in enumerate(cells):
+            self.sheet.set(self.target + (position, offset), text)
+
+
+def _text(value):
+    return "" if value is None else str(value)
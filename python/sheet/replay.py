@@ -0,0 +1,280 @@
+"""Record the keys of a viewer session, and replay them to measure latency.
+
+A `Recorder` passed to `views.Viewer` writes one JSON line per key handled:
+when it was pressed, what kind of action it was (see `action_type`) and the
+calls it made to change the sheet, e.g.::
+
+    {"time": 1.25, "key": 10, "type": "edit", "calls": [["set", "B2", "=A2*3"]]}
+
+`replay` feeds such a trace to a `Viewer` drawing on a `HeadlessScreen`,
+without a terminal, and times each key from handling it to drawing the
+result. Running a trace recorded in production against a new version of the
+engine shows its latency for the actions users actually perform. Keys are
+replayed as fast as they can be handled; the recorded times are only kept
+for reference.
+"""
+
+import collections
+import contextlib
+import curses
+import json
+import logging
+import time
+
+from . import views
+
+__all__ = [
+    "ACTION_TYPES",
+    "HeadlessScreen",
+    "Recorder",
+    "action_type",
+    "read_trace",
+    "replay",
+    "report",
+]
+
+ACTION_TYPES = (
+    "navigate",
+    "edit",
+    "paste",
+    "sort",
+    "format",
+    "filter",
+    "recalc",
+    "structure",
+    "other",
+)
+
+# The Spreadsheet methods changing the sheet, recorded in traces
+RECORDED_CALLS = {
+    "set",
+    "set_format",
+    "sort",
+    "copy",
+    "recalculate",
+    "insert_rows",
+    "delete_rows",
+    "insert_columns",
+    "delete_columns",
+}
+
+# curses.KEY_* code -> name, for `_keyname`
+_KEY_NAMES = {}
+for _name, _value in sorted(vars(curses).items()):
+    if _name.startswith("KEY_") and _name not in ("KEY_MIN", "KEY_MAX"):
+        _KEY_NAMES.setdefault(_value, _name)
+
+
+def action_type(viewer, key):
+    """Return which of `ACTION_TYPES` pressing `key` in `viewer` is."""
+    if viewer.key_handler == viewer.handle_key_edit:
+        if key in views.ARROW_KEYS and views.should_exit_editing_and_handle(key):
+            return "navigate"
+        return "edit" if viewer.edit_commit is None else "filter"
+    if viewer.key_handler == viewer.handle_key_menu:
+        if viewer.menu is viewer.formatting_menu:
+            return "format"
+        return "structure" if viewer.menu is viewer.structure_menu else "sort"
+    if key in views.ARROW_KEYS:
+        return "navigate"
+    if key in views.ENTER_KEYS or key in views.BACKSPACE_KEYS:
+        return "edit"
+    if views.key_begins_edit(key):
+        return "edit"
+    return {
+        views.KEYNAME_PASTE: "paste",
+        views.KEYNAME_SORT: "sort",
+        views.KEYNAME_FORMATTING: "format",
+        views.KEYNAME_FILTER: "filter",
+        views.KEYNAME_RECALCULATE: "recalc",
+        views.KEYNAME_NEXT_SHEET: "navigate",
+        views.KEYNAME_ROWS_COLUMNS: "structure",
+    }.get(views.get_keyname(key), "other")
+
+
+class Recorder:
+    """Writes a trace of the keys handled by a `views.Viewer` to `file`, a
+    text file open for writing, or if `file` is None only keeps the entry of
+    the last key."""
+
+    def __init__(self, file):
+        self.file = file
+        self.start = time.perf_counter()
+        # The trace entry of the key being handled, written once the next
+        # key is recorded or the recorder is closed
+        self.entry = None
+
+    def wrap(self, sheet):
+        """Return `sheet` with its calls in `RECORDED_CALLS` recorded."""
+        return _RecordingSheet(sheet, self)
+
+    def record(self, viewer, key):
+        """Record that `viewer` is about to handle `key`."""
+        self.flush()
+        self.entry = {
+            "time": round(time.perf_counter() - self.start, 6),
+            "key": key,
+            "type": action_type(viewer, key),
+            "calls": [],
+        }
+
+    def flush(self):
+        if self.entry is not None and self.file is not None:
+            self.file.write(json.dumps(self.entry) + "\n")
+        self.entry = None
+
+    close = flush
+
+
+class _RecordingSheet:
+    """A spreadsheet whose calls in `RECORDED_CALLS` are added to the entry
+    of the key being recorded."""
+
+    def __init__(self, sheet, recorder):
+        self._sheet = sheet
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        attr = getattr(self._sheet, name)
+        if name not in RECORDED_CALLS:
+            return attr
+
+        def record(*args):
+            entry = self._recorder.entry
+            if entry is not None:
+                entry["calls"].append([name] + [str(arg) for arg in args])
+            return attr(*args)
+
+        return record
+
+
+def read_trace(file):
+    """Return the entries of a trace written by `Recorder`."""
+    return [json.loads(line) for line in file if line.strip()]
+
+
+class HeadlessScreen:
+    """Enough of a curses window for `views.Viewer` to draw on, without a
+    terminal. Drawing only moves the cursor."""
+
+    def __init__(self, height=50, width=160):
+        self.height = height
+        self.width = width
+        self.y = self.x = 0
+
+    def getmaxyx(self):
+        return (self.height, self.width)
+
+    def getyx(self):
+        return (self.y, self.x)
+
+    def move(self, y, x):
+        self.y, self.x = y, x
+
+    def addstr(self, *args):
+        if len(args) >= 3:
+            self.y, self.x = args[0], args[1]
+        text = args[2] if len(args) >= 3 else args[0]
+        self.x += len(text)
+
+    def erase(self):
+        self.y = self.x = 0
+
+    def timeout(self, delay):
+        pass
+
+    def getch(self):
+        return curses.ERR
+
+
+def _keyname(key):
+    """`curses.keyname`, which needs a terminal."""
+    if key in _KEY_NAMES:
+        return _KEY_NAMES[key].encode()
+    if 0 <= key < 32:
+        return b"^" + bytes([key + 64])
+    if key == 127:
+        return b"^?"
+    if 32 <= key < 127:
+        return bytes([key])
+    if 128 <= key < 256:
+        return b"M-" + _keyname(key - 128)
+    raise ValueError(f"invalid key number {key}")
+
+
+@contextlib.contextmanager
+def _headless():
+    """Make the curses functions used by `views` work without a terminal."""
+    saved = curses.keyname, curses.curs_set
+    curses.keyname = _keyname
+    curses.curs_set = lambda visibility: 1
+    try:
+        yield
+    finally:
+        curses.keyname, curses.curs_set = saved
+
+
+def replay(trace, sheet, screen=None):
+    """Replay the keys of `trace` (see `read_trace`) in a `views.Viewer` of
+    `sheet`, drawing on `screen` (a `HeadlessScreen` by default).
+
+    Keys that raise an exception are logged and counted, and the replay goes
+    on. An entry whose calls differ from the recorded ones, for example
+    because the sheet started out differently, is counted as diverged.
+
+    Returns:
+        tuple: a dict of action type -> seconds taken by each key of that
+        type, the number of keys that failed, and the number that diverged.
+    """
+    latencies = collections.defaultdict(list)
+    failed = diverged = 0
+    recorder = Recorder(None)
+    with _headless():
+        viewer = views.Viewer(sheet, screen or HeadlessScreen(), recorder=recorder)
+        viewer.measure()
+        viewer.draw()
+        for entry in trace:
+            if viewer.quit:
+                break
+            key = entry["key"]
+            kind = action_type(viewer, key)
+            start = time.perf_counter()
+            try:
+                viewer.handle_keys([key])
+                viewer.stdscr.erase()
+                viewer.measure()
+                viewer.draw()
+            except Exception as e:
+                logging.error(f"Replaying key {key} failed: {e!r}")
+                failed += 1
+                continue
+            finally:
+                latencies[kind].append(time.perf_counter() - start)
+            if recorder.entry is None or recorder.entry["calls"] != entry["calls"]:
+                diverged += 1
+            viewer.message = ""
+    return dict(latencies), failed, diverged
+
+
+def report(latencies):
+    """Return a table of the P50, P95 and P99 latencies of each action type
+    in `latencies`, as returned by `replay`, in milliseconds.
+
+    >>> print(report({"edit": [0.002, 0.001, 0.004], "sort": []}))
+    action      keys     p50     p95     p99
+    edit           3   2.000   4.000   4.000
+    """
+    lines = ["%-8s %7s %7s %7s %7s" % ("action", "keys", "p50", "p95", "p99")]
+    for kind in ACTION_TYPES:
+        times = sorted(latencies.get(kind, ()))
+        if not times:
+            continue
+        lines.append(
+            "%-8s %7d %7.3f %7.3f %7.3f"
+            % (
+                kind,
+                len(times),
+                *(1000 * views.time_percentile(times, p) for p in (50, 95, 99)),
+            )
+        )
+    return "\n".join(lines)
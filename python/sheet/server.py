@@ -0,0 +1,325 @@
+"""Serve a `Spreadsheet` to other processes over a local socket.
+
+The protocol is newline-delimited JSON. Each line a client sends is either a
+single request object or a list of request objects; a list is answered with a
+list of responses in the same order. Every request has an ``"op"`` and may
+have an ``"id"``, which is copied into its response so that clients can
+pipeline requests without waiting for each answer.
+
+Requests:
+
+- ``{"op": "set", "cells": {"A1": "1", "B1": "=A1*2"}}``
+- ``{"op": "set_format", "range": "A1:B2", "type": "number", "spec": "%.2f"}``
+  (``"range"`` may also be a single cell, like ``"A1"``)
+- ``{"op": "get", "range": "A1:B2"}``: responds with ``"values"``, a list of
+  rows of formatted values.
+- ``{"op": "get_raw", "range": "A1:B2"}``: likewise, with raw values.
+- ``{"op": "subscribe", "range": "A1:B2"}``: responds like ``get``, then sends
+  ``{"op": "changed", "cells": {"A1": "2"}}`` whenever cells in the range
+  change, from any client.
+- ``{"op": "unsubscribe"}``: stops all notifications for this client.
+
+Consecutive writes in one message are applied as one `Spreadsheet.batch`, so a
+message that sets a thousand cells triggers one recalculation and at most one
+notification per subscribed client. The writes are checked before any is
+applied: if one is invalid, none of them are.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+
+from .cell import Cell
+from .models import Index, Range
+from .watch import POLL_INTERVAL
+
+__all__ = ["SheetServer", "SheetClient"]
+
+WRITE_OPS = {"set", "set_format"}
+
+
+class _Session:
+    """The state of one connected client."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        # Ranges this client subscribed to
+        self.subscriptions = []
+        # Index -> formatted value last sent to this client
+        self.known = {}
+
+    def send(self, message):
+        self.writer.write(json.dumps(message).encode() + b"\n")
+
+    def watches(self, index):
+        return any(rng.contains(index) for rng in self.subscriptions)
+
+
+class SheetServer:
+    """Serves `spreadsheet` to any number of concurrent clients.
+
+    Requests are handled on the event loop thread, one message at a time, so
+    each message sees the sheet as left by the previous one.
+    """
+
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+        self.sessions = set()
+
+    async def start_unix(self, path):
+        """Start listening on a Unix socket. Returns the `asyncio.Server`."""
+        return await asyncio.start_unix_server(self._serve_client, path=path)
+
+    async def start_tcp(self, host, port):
+        """Start listening on a TCP port. Returns the `asyncio.Server`."""
+        return await asyncio.start_server(self._serve_client, host, port)
+
+    async def follow(self, tail, interval=POLL_INTERVAL):
+        """Poll `tail`, a `watch.CsvTail`, every `interval` seconds until
+        cancelled, notifying subscribers of the rows it reads."""
+        while True:
+            self._notify(tail.poll())
+            await asyncio.sleep(interval)
+
+    async def _serve_client(self, reader, writer):
+        session = _Session(writer)
+        self.sessions.add(session)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except ValueError as e:
+                    session.send({"error": f"Invalid JSON: {e}"})
+                else:
+                    session.send(self.handle(session, message))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+    def handle(self, session, message):
+        """Apply a message (one request or a list of requests) and return the
+        response(s). Notifies subscribers of any cells that changed."""
+        requests = message if isinstance(message, list) else [message]
+        responses = []
+        changed = set()
+        writes = []
+        for request in requests:
+            if isinstance(request, dict) and request.get("op") in WRITE_OPS:
+                writes.append(request)
+                continue
+            changed |= self._apply_writes(writes, responses)
+            writes = []
+            responses.append(self._respond(session, request, self._read))
+        changed |= self._apply_writes(writes, responses)
+        self._notify(changed)
+        return responses if isinstance(message, list) else responses[0]
+
+    def _apply_writes(self, writes, responses):
+        """Apply `writes` as one batch if they are all valid, or else none of
+        them."""
+        if not writes:
+            return set()
+        edits = []
+        failed = []
+        for request in writes:
+            response = self._respond(None, request, self._check_write)
+            edits.append(response.pop("edits", ()))
+            failed.append("error" in response)
+            responses.append(response)
+        if any(failed):
+            for response, is_failed in zip(responses[-len(writes) :], failed):
+                if not is_failed:
+                    response.pop("ok")
+                    response["error"] = "Not applied: another write failed"
+            return set()
+        with self.spreadsheet.batch() as changed:
+            for apply, args in itertools.chain(*edits):
+                apply(*args)
+        return changed
+
+    def _respond(self, session, request, handler):
+        if not isinstance(request, dict):
+            return {"error": "Requests must be JSON objects"}
+        response = {"id": request.get("id")}
+        try:
+            response.update(handler(session, request))
+        except Exception as e:
+            logging.warning(f"Bad request {request}: {e!r}")
+            response["error"] = f"{type(e).__name__}: {e}"
+        return response
+
+    def _check_write(self, session, request):
+        """Validate a write request, returning the sheet calls that apply it
+        as ``"edits"``."""
+        sheet = self.spreadsheet
+        if request["op"] == "set":
+            cells = request["cells"]
+            if not isinstance(cells, dict):
+                raise TypeError("cells must be an object")
+            edits = [
+                (sheet.set, (Index.parse(label), _text(raw)))
+                for label, raw in cells.items()
+            ]
+        else:
+            format_type, spec = request["type"], request.get("spec")
+            specs = Cell.AVAILABLE_FORMAT_TYPES.get(format_type, ())
+            if format_type not in Cell.AVAILABLE_FORMAT_TYPES or (
+                spec is not None and spec not in specs
+            ):
+                raise ValueError(f"Invalid format {format_type!r}, {spec!r}")
+            edits = [
+                (sheet.set_format, (index, format_type, spec))
+                for index in _parse_range(request["range"]).indices
+            ]
+        return {"ok": True, "edits": edits}
+
+    def _read(self, session, request):
+        op = request["op"]
+        if op == "unsubscribe":
+            session.subscriptions.clear()
+            session.known.clear()
+            return {"ok": True}
+        cells = _parse_range(request["range"])
+        if op == "get_raw":
+            return {"values": self._block(cells, self.spreadsheet.get_raw)}
+        if op not in ("get", "subscribe"):
+            raise ValueError(f"Unknown op {op!r}")
+        values = self._block(cells, self.spreadsheet.get_formatted)
+        if op == "subscribe":
+            session.subscriptions.append(cells)
+            for index, value in zip(cells.indices, itertools.chain(*values)):
+                session.known[index] = value
+        return {"values": values}
+
+    @staticmethod
+    def _block(cells, get):
+        return [[get(index) for index in cells.row(i)] for i in range(cells.height)]
+
+    def _notify(self, changed):
+        """Send each subscriber the new values of the cells it watches that
+        actually changed."""
+        if not changed:
+            return
+        for session in self.sessions:
+            if not session.subscriptions:
+                continue
+            diff = {}
+            for index in changed:
+                if not session.watches(index):
+                    continue
+                value = self.spreadsheet.get_formatted(index)
+                if session.known.get(index) != value:
+                    session.known[index] = value
+                    diff[str(index)] = value
+            if diff:
+                session.send({"op": "changed", "cells": diff})
+
+
+class SheetClient:
+    """An asyncio client for `SheetServer`.
+
+    Requests may be pipelined: `request` and `batch` can be awaited
+    concurrently and their responses are matched up by id. Change
+    notifications for subscribed ranges are put on `notifications`.
+    """
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._ids = itertools.count(1)
+        self._waiting = {}
+        self.notifications = asyncio.Queue()
+        self._reading = asyncio.ensure_future(self._read_responses())
+
+    @classmethod
+    async def connect_unix(cls, path):
+        return cls(*await asyncio.open_unix_connection(path))
+
+    @classmethod
+    async def connect_tcp(cls, host, port):
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def request(self, op, **params):
+        """Send one request and return its response."""
+        (response,) = await self.batch([dict(params, op=op)])
+        return response
+
+    async def batch(self, requests):
+        """Send a list of requests as one message, which the server applies
+        with a single recalculation. Returns the list of responses."""
+        futures = []
+        message = []
+        for request in requests:
+            request = dict(request, id=next(self._ids))
+            future = asyncio.get_running_loop().create_future()
+            self._waiting[request["id"]] = future
+            futures.append(future)
+            message.append(request)
+        self._writer.write(json.dumps(message).encode() + b"\n")
+        await self._writer.drain()
+        return list(await asyncio.gather(*futures))
+
+    async def close(self):
+        self._writer.close()
+        self._reading.cancel()
+
+    async def _read_responses(self):
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if isinstance(message, dict) and message.get("op") == "changed":
+                self.notifications.put_nowait(message["cells"])
+                continue
+            for response in message if isinstance(message, list) else [message]:
+                future = self._waiting.pop(response.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        for future in self._waiting.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Connection closed"))
+
+
+def _parse_range(label):
+    """Parse a range like ``"A1:B2"``, or a single cell like ``"A1"``."""
+    if not isinstance(label, str):
+        raise TypeError("range must be a string")
+    if ":" in label:
+        return Range.parse(label)
+    index = Index.parse(label)
+    return Range(index, index)
+
+
+def _text(raw):
+    if raw is None:
+        return ""
+    if not isinstance(raw, (str, int, float)):
+        raise TypeError("cell values must be strings or numbers")
+    return str(raw)
+
+
+async def serve(spreadsheet, path=None, host="127.0.0.1", port=None, watch=None):
+    """Serve `spreadsheet` on a Unix socket at `path`, or on TCP `host`:`port`,
+    until cancelled, following the `watch.CsvTail` `watch` if given."""
+    server = SheetServer(spreadsheet)
+    if path is not None:
+        listener = await server.start_unix(path)
+    else:
+        listener = await server.start_tcp(host, port)
+    logging.info(f"Serving on {path or f'{host}:{port}'}")
+    if watch is not None:
+        following = asyncio.get_running_loop().create_task(server.follow(watch))
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        if watch is not None:
+            following.cancel()
@@ -0,0 +1,504 @@
+"""Splitting a very large sheet between worker processes.
+
+Rows are divided into blocks of `block_rows` rows, dealt out to the workers in
+turn. Each worker process keeps an ordinary `Spreadsheet` holding only the
+cells of its own blocks: their raw data, formats, parsed formulas, cached
+values and dependency graph.
+
+When a formula reads a cell owned by another worker, its worker asks the
+coordinator, which fetches the value from the owner and remembers who read
+it. The worker caches the value like any other, so its local dependency graph
+knows which formulas to invalidate when the coordinator later reports that the
+cell changed. Changes ripple from worker to worker this way until no cached
+value is left that depends on them.
+
+`ShardedSpreadsheet` is the coordinator. It has the interface of `Spreadsheet`
+that the `Viewer` and `SheetServer` use, and sends each request to the workers
+involved in parallel, so a batch touching many blocks is recalculated by all
+of them at once.
+
+Limitations: array formulas only spill within their own block, formulas are
+only shared (see `shared`) within a block, rows and columns can't be
+inserted or deleted, and the sheet can't be forked (see `datatable`).
+"""
+
+import contextlib
+import itertools
+import multiprocessing
+import os
+from collections import defaultdict
+from multiprocessing.connection import wait
+
+from .engine import AUTOMATIC, Spreadsheet
+from .models import Index, Range
+
+__all__ = ["ShardedSpreadsheet"]
+
+BLOCK_ROWS = 4096
+
+_NO_STRUCTURE = "Rows and columns can't be inserted or deleted in a sharded sheet"
+
+
+class ShardError(RuntimeError):
+    """An exception raised in a worker process."""
+
+
+class _Peer:
+    """One end of a worker's pipe, matching replies to requests by id.
+
+    Messages are ``(id, op, payload)`` tuples. A reply has op ``"reply"`` (or
+    ``"error"``) and the id of the request it answers; the two ends number
+    their own requests independently.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._ids = itertools.count()
+        # request id -> (ok, result) received but not yet collected
+        self.replies = {}
+
+    def request(self, op, *payload):
+        request_id = next(self._ids)
+        self.conn.send((request_id, op, payload))
+        return request_id
+
+    def receive(self, handle):
+        """Receive one message: store it if it is a reply, otherwise answer it
+        with ``handle(op, *payload)``."""
+        request_id, op, payload = self.conn.recv()
+        if op == "reply":
+            self.replies[request_id] = (True, payload)
+        elif op == "error":
+            self.replies[request_id] = (False, payload)
+        else:
+            try:
+                result = handle(op, *payload)
+            except Exception as e:
+                self.conn.send((request_id, "error", f"{type(e).__name__}: {e}"))
+            else:
+                self.conn.send((request_id, "reply", result))
+
+    def collect(self, request_id):
+        ok, result = self.replies.pop(request_id)
+        if not ok:
+            raise ShardError(result)
+        return result
+
+
+class ShardedSpreadsheet:
+    """A spreadsheet whose rows are stored and evaluated by `workers` worker
+    processes, in blocks of `block_rows` rows.
+
+    Call `close` (or use it as a context manager) to stop the workers.
+
+    >>> with ShardedSpreadsheet(workers=2, block_rows=1) as sheet:
+    ...     sheet.set(Index(0, 0), "2")
+    ...     sheet.set(Index(1, 0), "=A1*10")
+    ...     sheet.set(Index(0, 0), "3")
+    ...     sheet.get_formatted(Index(1, 0))
+    '30'
+    """
+
+    # Workers recalculate as soon as cells change; see
+    # `Spreadsheet.set_calculation`.
+    calculation = AUTOMATIC
+    # The sheet is never part of a `workbook.Workbook`.
+    workbook = None
+
+    def __init__(self, workers=None, block_rows=BLOCK_ROWS):
+        self.workers = workers or os.cpu_count() or 1
+        self.block_rows = block_rows
+        self._peers = []
+        self._processes = []
+        for shard in range(self.workers):
+            conn, worker_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_worker_main,
+                args=(worker_conn, shard, self.workers, block_rows),
+                daemon=True,
+            )
+            process.start()
+            worker_conn.close()
+            self._peers.append(_Peer(conn))
+            self._processes.append(process)
+        self._shard_of_conn = {peer.conn: n for n, peer in enumerate(self._peers)}
+        # Index -> formatted value, as last fetched from its owner
+        self._values = {}
+        # Index -> shards holding a copy of its value
+        self._readers = defaultdict(set)
+        # block number -> {(Range, shard)} for the cells of that block that
+        # shards hold copies of
+        self._range_readers = defaultdict(set)
+        # shard -> ([(Index, raw)], [(Index, type, spec)]) waiting for the end
+        # of the current `batch`
+        self._updates = {}
+        self._batch_depth = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop the worker processes."""
+        for peer, process in zip(self._peers, self._processes):
+            if process.is_alive():
+                peer.request("stop")
+            process.join()
+            peer.conn.close()
+        self._peers = []
+        self._processes = []
+
+    def owner(self, index):
+        """The number of the worker that stores `index`."""
+        return index.row // self.block_rows % self.workers
+
+    def get_formatted(self, index, visited_cells=None):
+        """Get the evaluated and formatted value at the given cell ref; see
+        `Spreadsheet.get_formatted`."""
+        value = self._values.get(index)
+        if value is None:
+            (value,) = self._call(self.owner(index), "get", [index], [])
+            self._values[index] = value
+        return value
+
+    def prefetch(self, cell_range):
+        """Evaluate every cell in `cell_range`, with each worker evaluating
+        its own blocks in parallel, and cache the results here."""
+        blocks = defaultdict(list)
+        for block in _blocks(cell_range, self.block_rows):
+            blocks[self.owner(block.first)].append(block)
+        requests = {
+            shard: ("get_range", ranges, []) for shard, ranges in blocks.items()
+        }
+        for shard, results in self._call_all(requests).items():
+            for block, columns in zip(blocks[shard], results):
+                cells = itertools.chain(*_columns(block))
+                self._values.update(zip(cells, itertools.chain(*columns)))
+
+    def get_raw(self, index):
+        """Get the raw text that the user entered into the given cell."""
+        return self._call(self.owner(index), "get_raw", index)
+
+    def last_row(self, col=None):
+        """Return the last row holding anything, in column `col` if given,
+        or -1; see `Spreadsheet.last_row`."""
+        requests = {shard: ("last_row", col) for shard in range(self.workers)}
+        return max(self._call_all(requests).values())
+
+    def column_index(self, col):
+        """Lookup indexes (see `Spreadsheet.column_index`) aren't kept across
+        workers.
+
+        Raises:
+            NotImplementedError: always.
+        """
+        raise NotImplementedError("Columns can't be searched in a sharded sheet")
+
+    def column_width(self, col):
+        """Column statistics (see `Spreadsheet.column_width`) aren't kept
+        across workers; returns None."""
+        return None
+
+    def summarize(self, cell_range):
+        """Column statistics (see `Spreadsheet.summarize`) aren't kept
+        across workers; returns None."""
+        return None
+
+    def snapshot(self):
+        """The coordinator is only used from one thread, which sees each
+        change in full once `set` or `batch` returns, so it serves as its own
+        snapshot."""
+        return self
+
+    def fork(self, inputs):
+        """The cells are spread across workers, so there is nothing to fork;
+        see `Spreadsheet.fork`.
+
+        Raises:
+            NotImplementedError: always.
+        """
+        raise NotImplementedError("A sharded sheet can't be forked")
+
+    def set(self, index, raw):
+        """Set the value at the given cell; see `Spreadsheet.set`."""
+        self._updates_for(index)[0].append((index, raw))
+        if not self._batch_depth:
+            self._flush()
+
+    def set_format(self, index, type, spec):
+        """Set the format of the given cell; see `Spreadsheet.set_format`."""
+        self._updates_for(index)[1].append((index, type, spec))
+        if not self._batch_depth:
+            self._flush()
+
+    def insert_rows(self, row, count=1):
+        """Rows can't be moved between workers; see `Spreadsheet.insert_rows`.
+
+        Raises:
+            NotImplementedError: always.
+        """
+        raise NotImplementedError(_NO_STRUCTURE)
+
+    def delete_rows(self, row, count=1):
+        """Raises NotImplementedError, like `insert_rows`."""
+        raise NotImplementedError(_NO_STRUCTURE)
+
+    def insert_columns(self, col, count=1):
+        """Raises NotImplementedError, like `insert_rows`."""
+        raise NotImplementedError(_NO_STRUCTURE)
+
+    def delete_columns(self, col, count=1):
+        """Raises NotImplementedError, like `insert_rows`."""
+        raise NotImplementedError(_NO_STRUCTURE)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Group several `set` and `set_format` calls, like `Spreadsheet.batch`.
+
+        The changes are sent to each worker involved as one message when the
+        outermost batch ends, and the workers recalculate in parallel.
+        """
+        changed = set()
+        self._batch_depth += 1
+        try:
+            yield changed
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                changed.update(self._flush())
+
+    def _updates_for(self, index):
+        shard = self.owner(index)
+        if shard not in self._updates:
+            self._updates[shard] = ([], [])
+        return self._updates[shard]
+
+    def _flush(self):
+        updates, self._updates = self._updates, {}
+        requests = {
+            shard: ("update", sets, formats)
+            for shard, (sets, formats) in updates.items()
+        }
+        changed = set()
+        for indices in self._call_all(requests).values():
+            changed.update(indices)
+        return self._propagate(changed)
+
+    def _propagate(self, changed):
+        """Tell every worker holding a copy of a changed cell to invalidate
+        it, and repeat for whatever changes in turn.
+
+        Returns:
+            set: every cell whose value may have changed.
+        """
+        seen = set(changed)
+        frontier = seen
+        while frontier:
+            targets = defaultdict(list)
+            for index in frontier:
+                self._values.pop(index, None)
+                for shard in self._readers.pop(index, ()):
+                    targets[shard].append(index)
+                block = index.row // self.block_rows
+                readers = self._range_readers.get(block)
+                if not readers:
+                    continue
+                # The reader drops its whole copy, and reads it again if it
+                # still needs it.
+                for rng, shard in [r for r in readers if r[0].contains(index)]:
+                    readers.discard((rng, shard))
+                    targets[shard].extend(rng.indices)
+                if not readers:
+                    del self._range_readers[block]
+            requests = {
+                shard: ("invalidate", indices)
+                for shard, indices in targets.items()
+                if indices
+            }
+            frontier = set()
+            for indices in self._call_all(requests).values():
+                frontier.update(i for i in indices if i not in seen)
+            seen |= frontier
+        return seen
+
+    def _call(self, shard, op, *payload):
+        return self._call_all({shard: (op,) + payload})[shard]
+
+    def _call_all(self, requests):
+        """Send ``{shard: (op, *payload)}`` to the workers at once, and return
+        ``{shard: result}``. Workers' requests for cells they don't own are
+        served meanwhile."""
+        sent = {
+            shard: self._peers[shard].request(*request)
+            for shard, request in requests.items()
+        }
+        results = {}
+        for shard, request_id in sent.items():
+            peer = self._peers[shard]
+            while request_id not in peer.replies:
+                self._receive_any()
+            results[shard] = peer.collect(request_id)
+        return results
+
+    def _receive_any(self):
+        for conn in wait([peer.conn for peer in self._peers]):
+            # Serving one message may have read the others already.
+            if not conn.poll():
+                continue
+            shard = self._shard_of_conn[conn]
+            self._peers[shard].receive(
+                lambda op, *payload: self._serve(shard, op, *payload)
+            )
+
+    def _serve(self, shard, op, *payload):
+        """Answer a worker's request for cells owned by other workers."""
+        if op == "get":
+            indices, visited = payload
+            by_owner = defaultdict(list)
+            for index in indices:
+                by_owner[self.owner(index)].append(index)
+            requests = {
+                owner: ("get", owned, visited) for owner, owned in by_owner.items()
+            }
+            values = {}
+            for owner, result in self._call_all(requests).items():
+                values.update(zip(by_owner[owner], result))
+            for index in indices:
+                self._readers[index].add(shard)
+            return [values[index] for index in indices]
+        if op == "get_range":
+            (cell_range,), visited = payload
+            block = cell_range.first.row // self.block_rows
+            self._range_readers[block].add((cell_range, shard))
+            owner = self.owner(cell_range.first)
+            return self._call(owner, "get_range", [cell_range], visited)
+        if op == "get_raw":
+            return self.get_raw(*payload)
+        raise ValueError(f"Unknown op {op!r}")
+
+
+class _ShardEngine(Spreadsheet):
+    """The `Spreadsheet` of one worker, which fetches cells it doesn't own
+    from the coordinator."""
+
+    def __init__(self, worker):
+        super().__init__()
+        self._worker = worker
+
+    def _evaluate(self, index, visited_cells):
+        if self._worker.owns(index):
+            return super()._evaluate(index, visited_cells)
+        # The owner checks for circular references from here on.
+        visited = [i for i in visited_cells if i != index]
+        (value,) = self._worker.ask("get", [index], visited)
+        return value
+
+    def get_array(self, cell_range, visited_cells=None):
+        worker = self._worker
+        for block in _blocks(cell_range, worker.block_rows):
+            if worker.owns(block.first) or all(
+                index in self._values for index in block.indices
+            ):
+                continue
+            visited = list(visited_cells or ())
+            (columns,) = worker.ask("get_range", [block], visited)
+            cells = itertools.chain(*_columns(block))
+            for index, value in zip(cells, itertools.chain(*columns)):
+                self._store(index, value)
+        return super().get_array(cell_range, visited_cells)
+
+    def get_raw(self, index):
+        if self._worker.owns(index):
+            return super().get_raw(index)
+        return self._worker.ask("get_raw", index)
+
+    def invalidate(self, indices):
+        """Drop the cached copies of `indices`, which changed in another
+        worker, and everything computed from them."""
+        with self._lock:
+            return self._invalidate(indices)
+
+
+class _Worker:
+    """The main loop of a worker process."""
+
+    def __init__(self, conn, shard, workers, block_rows):
+        self.peer = _Peer(conn)
+        self.shard = shard
+        self.workers = workers
+        self.block_rows = block_rows
+        self.engine = _ShardEngine(self)
+        self.running = True
+
+    def owns(self, index):
+        return index.row // self.block_rows % self.workers == self.shard
+
+    def run(self):
+        while self.running:
+            self.peer.receive(self.handle)
+
+    def ask(self, op, *payload):
+        """Ask the coordinator, serving any requests that arrive meanwhile."""
+        request_id = self.peer.request(op, *payload)
+        while request_id not in self.peer.replies:
+            self.peer.receive(self.handle)
+        return self.peer.collect(request_id)
+
+    def handle(self, op, *payload):
+        engine = self.engine
+        if op == "get":
+            indices, visited = payload
+            visited = set(visited)
+            return [engine.get_formatted(index, visited) for index in indices]
+        if op == "get_range":
+            ranges, visited = payload
+            visited = set(visited)
+            return [
+                [
+                    [engine.get_formatted(index, visited) for index in column]
+                    for column in _columns(cell_range)
+                ]
+                for cell_range in ranges
+            ]
+        if op == "get_raw":
+            return engine.get_raw(*payload)
+        if op == "last_row":
+            return engine.last_row(*payload)
+        if op == "update":
+            sets, formats = payload
+            with engine.batch() as changed:
+                for index, raw in sets:
+                    engine.set(index, raw)
+                for index, type, spec in formats:
+                    engine.set_format(index, type, spec)
+            return [index for index in changed if self.owns(index)]
+        if op == "invalidate":
+            (indices,) = payload
+            changed = engine.invalidate(indices)
+            return [index for index in changed if self.owns(index)]
+        if op == "stop":
+            self.running = False
+            return None
+        raise ValueError(f"Unknown op {op!r}")
+
+
+def _blocks(cell_range, block_rows):
+    """Split `cell_range` into the parts that fall in each block of rows."""
+    first, last = cell_range
+    row = first.row
+    while row <= last.row:
+        end = min(row - row % block_rows + block_rows - 1, last.row)
+        yield Range(Index(row, first.col), Index(end, last.col))
+        row = end + 1
+
+
+def _columns(cell_range):
+    first, last = cell_range
+    for col in range(first.col, last.col + 1):
+        yield [Index(row, col) for row in range(first.row, last.row + 1)]
+
+
+def _worker_main(conn, shard, workers, block_rows):
+    _Worker(conn, shard, workers, block_rows).run()
@@ -0,0 +1,140 @@
+"""Formulas filled down a column, stored once per run of rows.
+
+Imports often contain calculated columns where every row holds the same
+relative formula (``=B2*C2``, ``=B3*C3``, ...). Instead of a `Cell` and a
+parsed `Formula` per row, the engine keeps one `SharedFormula` for the whole
+run and evaluates its rows as a batch.
+"""
+
+import bisect
+from collections import defaultdict
+
+from .models import Index, Range
+
+__all__ = ["SharedFormula", "SharedFormulas"]
+
+
+class SharedFormula:
+    """A formula filled down rows `first_row` to `last_row` of column `col`.
+
+    `formula` is the formula in the first row; row ``first_row + k`` holds the
+    same formula with every reference moved down `k` rows.
+
+    >>> from sheet.formula import parse
+    >>> shared = SharedFormula(parse("B2*C2"), 3, 1, 100)
+    >>> shared.raw(Index(9, 3))
+    '=B10*C10'
+    """
+
+    __slots__ = ("formula", "col", "first_row", "last_row")
+
+    def __init__(self, formula, col, first_row, last_row):
+        self.formula = formula
+        self.col = col
+        self.first_row = first_row
+        self.last_row = last_row
+
+    @property
+    def top(self):
+        """The Index of the first row."""
+        return Index(self.first_row, self.col)
+
+    @property
+    def span(self):
+        """The Range of cells holding this formula."""
+        return Range(self.top, Index(self.last_row, self.col))
+
+    def offset(self, index):
+        """How far the references of the formula at `index` are moved,
+        compared to `formula`."""
+        return Index(index.row - self.first_row, 0)
+
+    def raw(self, index):
+        """The raw text of the formula at `index`."""
+        return "=" + self.formula.render(self.offset(index))
+
+    def without(self, row):
+        """Return the SharedFormulas covering the rows of this one but
+        `row`: none, one or two of them."""
+        parts = []
+        if self.first_row < row:
+            parts.append(SharedFormula(self.formula, self.col, self.first_row, row - 1))
+        if row < self.last_row:
+            formula = self.formula.shifted(self.offset(Index(row + 1, self.col)))
+            parts.append(SharedFormula(formula, self.col, row + 1, self.last_row))
+        return parts
+
+    def key(self):
+        """The formula in relative notation; see `Formula.relative_to`."""
+        return self.formula.relative_to(self.top)
+
+    def __repr__(self):
+        return f"SharedFormula({self.raw(self.top)!r}, {self.span})"
+
+
+class SharedFormulas:
+    """The shared formulas of a sheet, kept sorted by row within each column so
+    that `find` is a binary search."""
+
+    def __init__(self):
+        # col -> sorted first_row of each SharedFormula in that column
+        self._starts = defaultdict(list)
+        # col -> SharedFormula, in the same order as `_starts`
+        self._formulas = defaultdict(list)
+
+    def __iter__(self):
+        for formulas in self._formulas.values():
+            yield from formulas
+
+    def find(self, index):
+        """Return the SharedFormula covering `index`, or None."""
+        starts = self._starts.get(index.col)
+        if not starts:
+            return None
+        i = bisect.bisect_right(starts, index.row) - 1
+        if i < 0:
+            return None
+        shared = self._formulas[index.col][i]
+        return shared if index.row <= shared.last_row else None
+
+    def overlapping(self, cell_range):
+        """Yield the SharedFormulas that cover any cell of `cell_range`."""
+        for col in range(cell_range.first.col, cell_range.last.col + 1):
+            starts = self._starts.get(col)
+            if not starts:
+                continue
+            i = max(bisect.bisect_right(starts, cell_range.first.row) - 1, 0)
+            for shared in self._formulas[col][i:]:
+                if shared.first_row > cell_range.last.row:
+                    break
+                if shared.last_row >= cell_range.first.row:
+                    yield shared
+
+    def copy(self):
+        """Return a copy, which `add` and `remove` on this one won't affect."""
+        copied = SharedFormulas()
+        for col, starts in self._starts.items():
+            copied._starts[col] = list(starts)
+            copied._formulas[col] = list(self._formulas[col])
+        return copied
+
+    def add(self, shared):
+        starts = self._starts[shared.col]
+        i = bisect.bisect_left(starts, shared.first_row)
+        starts.insert(i, shared.first_row)
+        self._formulas[shared.col].insert(i, shared)
+
+    def replace(self, old, new):
+        """Put `new` in place of `old`, which must start on the same row."""
+        starts = self._starts[old.col]
+        i = bisect.bisect_left(starts, old.first_row)
+        self._formulas[old.col][i] = new
+
+    def remove(self, shared):
+        starts = self._starts[shared.col]
+        i = bisect.bisect_left(starts, shared.first_row)
+        del starts[i]
+        del self._formulas[shared.col][i]
+        if not starts:
+            del self._starts[shared.col]
+            del self._formulas[shared.col]
@@ -0,0 +1,202 @@
+"""A sorted list with logarithmic updates and positional access.
+
+Items are kept in a list of sorted sublists of at most ``2 * LOAD`` items
+each, so inserting or removing an item moves at most that many others
+instead of up to the whole list. The lengths of the sublists are kept in a
+Fenwick tree, which finds the sublist holding the item at a position, and
+the number of items before a sublist, in O(log n) steps.
+"""
+
+import bisect
+
+__all__ = ["SortedList"]
+
+LOAD = 500
+
+
+class SortedList:
+    """A sorted multiset of comparable items.
+
+    If `value` is given, the sum of ``value(item)`` is kept for each sublist,
+    so `sum` can add up a slice without visiting each item in it.
+
+    >>> items = SortedList([5, 1, 3], value=float)
+    >>> items.add(2)
+    >>> list(items), items[-1], items.bisect_left(3), items.sum(1, 3)
+    ([1, 2, 3, 5], 5, 2, 5.0)
+    >>> items.remove(3)
+    >>> len(items), list(items.islice(1, 3))
+    (3, [2, 5])
+    """
+
+    def __init__(self, items=(), value=None):
+        self._value = value
+        self._len = 0
+        self._lists = []
+        # The last item of each sublist
+        self._maxes = []
+        items = sorted(items)
+        self._lists = [items[i : i + LOAD] for i in range(0, len(items), LOAD)]
+        self._rebuild()
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for sublist in self._lists:
+            yield from sublist
+
+    def __getitem__(self, pos):
+        i, j = self._locate(pos)
+        return self._lists[i][j]
+
+    def add(self, item):
+        """Insert `item`, after any equal items."""
+        lists = self._lists
+        if not lists:
+            lists.append([item])
+            self._rebuild()
+            return
+        i = bisect.bisect_right(self._maxes, item)
+        if i == len(lists):
+            i -= 1
+            lists[i].append(item)
+            self._maxes[i] = item
+        else:
+            bisect.insort(lists[i], item)
+        self._len += 1
+        if len(lists[i]) > 2 * LOAD:
+            sublist = lists[i]
+            lists[i : i + 1] = [sublist[:LOAD], sublist[LOAD:]]
+            self._rebuild()
+        else:
+            self._lengths.add(i, 1)
+            self._update_sum(i)
+
+    def remove(self, item):
+        """Remove one item equal to `item`; raise ValueError if there is
+        none."""
+        i = bisect.bisect_left(self._maxes, item)
+        if i == len(self._lists):
+            raise ValueError(f"{item!r} not in list")
+        sublist = self._lists[i]
+        j = bisect.bisect_left(sublist, item)
+        if sublist[j] != item:
+            raise ValueError(f"{item!r} not in list")
+        del sublist[j]
+        self._len -= 1
+        if not sublist:
+            del self._lists[i]
+            self._rebuild()
+            return
+        self._maxes[i] = sublist[-1]
+        self._lengths.add(i, -1)
+        self._update_sum(i)
+
+    def bisect_left(self, item):
+        """The position of the first item not less than `item`."""
+        i = bisect.bisect_left(self._maxes, item)
+        if i == len(self._lists):
+            return self._len
+        return self._lengths.prefix(i) + bisect.bisect_left(self._lists[i], item)
+
+    def bisect_right(self, item):
+        """The position after the last item not greater than `item`."""
+        i = bisect.bisect_right(self._maxes, item)
+        if i == len(self._lists):
+            return self._len
+        return self._lengths.prefix(i) + bisect.bisect_right(self._lists[i], item)
+
+    def islice(self, start, stop):
+        """Iterate over the items at positions `start` to `stop` - 1."""
+        if start >= stop:
+            return
+        i, j = self._locate(start)
+        remaining = stop - start
+        for sublist in self._lists[i:]:
+            chunk = sublist[j : j + remaining]
+            yield from chunk
+            remaining -= len(chunk)
+            if not remaining:
+                return
+            j = 0
+
+    def sum(self, start, stop):
+        """The sum of ``value(item)`` over the items at positions `start` to
+        `stop` - 1."""
+        if start >= stop:
+            return 0
+        return self._sum_before(stop) - self._sum_before(start)
+
+    def _sum_before(self, pos):
+        if pos >= self._len:
+            return sum(self._sums)
+        i, j = self._locate(pos)
+        partial = map(self._value, self._lists[i][:j])
+        return sum(self._sums[:i]) + sum(partial)
+
+    def _locate(self, pos):
+        """Return (sublist, offset) of the item at position `pos`."""
+        if pos < 0:
+            pos += self._len
+        if not 0 <= pos < self._len:
+            raise IndexError("SortedList index out of range")
+        return self._lengths.search(pos)
+
+    def _update_sum(self, i):
+        if self._value is not None:
+            self._sums[i] = sum(map(self._value, self._lists[i]))
+
+    def _rebuild(self):
+        """Recompute everything kept per sublist, after sublists were split
+        or removed."""
+        self._maxes = [sublist[-1] for sublist in self._lists]
+        self._lengths = _Fenwick([len(sublist) for sublist in self._lists])
+        self._len = sum(map(len, self._lists))
+        self._sums = [0] * len(self._lists)
+        for i in range(len(self._lists)):
+            self._update_sum(i)
+
+
+class _Fenwick:
+    """Prefix sums of a list of counts, with O(log n) updates.
+
+    >>> tree = _Fenwick([3, 0, 2, 5])
+    >>> tree.prefix(3), tree.search(4), tree.search(5)
+    (5, (2, 1), (3, 0))
+    """
+
+    def __init__(self, counts):
+        self._size = len(counts)
+        self._tree = [0] + list(counts)
+        for i in range(1, self._size + 1):
+            parent = i + (i & -i)
+            if parent <= self._size:
+                self._tree[parent] += self._tree[i]
+
+    def add(self, i, delta):
+        i += 1
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i):
+        """The sum of the first `i` counts."""
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def search(self, pos):
+        """Return ``(i, pos - prefix(i))`` for the `i` whose count covers
+        position `pos`."""
+        i = 0
+        step = 1 << self._size.bit_length()
+        while step:
+            nxt = i + step
+            if nxt <= self._size and self._tree[nxt] <= pos:
+                i = nxt
+                pos -= self._tree[nxt]
+            step >>= 1
+        return i, pos
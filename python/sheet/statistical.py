@@ -0,0 +1,153 @@
+"""Order statistics (MEDIAN, PERCENTILE, LARGE, SMALL, RANK).
+
+These need the numbers of a range in ascending order. For a single-column
+range, that is a slice of the column's `lookup.ColumnIndex.sorted` list,
+which is patched in O(log n) steps when a cell changes, so an edit doesn't
+re-sort the column for every dependent formula. Other arguments are sorted
+on each evaluation.
+"""
+
+import math
+
+from . import errors as err
+from .arrays import Array, RangeArray
+from .formula import function
+from .functions import numbers
+from .lookup import value_key
+from .sortedlist import SortedList
+
+__all__ = ["sorted_numbers"]
+
+
+class _Numbers:
+    """The numbers at positions `start` to `stop` - 1 of a `SortedList` of
+    ``(value_key, row)`` items, which are all the numbers in it."""
+
+    def __init__(self, items, start, stop):
+        self._items = items
+        self._start = start
+        self._stop = stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, i):
+        """The `i`-th smallest number, counting from 0."""
+        return self._items[self._start + i][0][1]
+
+    def count_less(self, number):
+        return self._items.bisect_left((value_key(number), -1)) - self._start
+
+    def count_greater(self, number):
+        return self._stop - self._items.bisect_left((value_key(number), math.inf))
+
+
+def sorted_numbers(args):
+    """Return the numbers in `args`, flattened as by `functions.numbers`, in
+    ascending order.
+
+    >>> ranked = sorted_numbers([3, 1, 2.5])
+    >>> len(ranked), ranked[0], ranked[2], ranked.count_greater(2)
+    (3, 1, 3, 2)
+
+    Raises:
+        errors.FormulaError: as `functions.numbers` does.
+    """
+    if len(args) == 1 and isinstance(args[0], RangeArray) and args[0].width == 1:
+        ranked = _indexed_numbers(args[0])
+        if ranked is not None:
+            return ranked
+    items = SortedList((value_key(number), 0) for number in numbers(args))
+    return _Numbers(items, 0, len(items))
+
+
+def _indexed_numbers(array):
+    """Return the numbers in `array` from its column's index, or None if the
+    index can't be used or covers more rows than `array`."""
+    first, last = array.range
+    index = array.sheet.column_index(first.col)
+    if index.busy:
+        return None
+    items = index.sorted(first.row, last.row, array.visited_cells)
+    if first.row > index.lo or index.hi > last.row:
+        return None
+    # Like `functions.numbers`, raise the first error down the range.
+    errors = []
+    for code in err.ALL:
+        key = value_key(code)
+        pos = items.bisect_left((key, -1))
+        if pos < len(items) and items[pos][0] == key:
+            errors.append((items[pos][1], code))
+    if errors:
+        raise err.FormulaError(min(errors)[1])
+    return _Numbers(items, items.bisect_left(((1,),)), items.bisect_left(((2,),)))
+
+
+def _position(k, count):
+    """Return the position, counting from 0, of the `k`-th number of
+    `count`, counting from 1."""
+    k = math.ceil(k)
+    if not 1 <= k <= count:
+        raise err.FormulaError(err.NUM)
+    return k - 1
+
+
+@function("MEDIAN")
+def median(*args):
+    ranked = sorted_numbers(args)
+    if not ranked:
+        return err.NUM
+    middle = len(ranked) // 2
+    if len(ranked) % 2:
+        return ranked[middle]
+    return (ranked[middle - 1] + ranked[middle]) / 2
+
+
+@function("PERCENTILE")
+def percentile(array, k):
+    """The `k`-th percentile, for `k` from 0 to 1, interpolating between the
+    closest ranks.
+
+    >>> values = Array([[1, 2, 3, 4]])
+    >>> percentile(values, 0.5), percentile(values, 0.9)
+    (2.5, 3.7)
+    """
+    ranked = sorted_numbers([array])
+    (k,) = numbers([k])
+    if not ranked or not 0 <= k <= 1:
+        return err.NUM
+    rank = k * (len(ranked) - 1)
+    lower = math.floor(rank)
+    if lower == rank:
+        return ranked[lower]
+    below = ranked[lower]
+    return below + (rank - lower) * (ranked[lower + 1] - below)
+
+
+@function("SMALL")
+def small(array, k):
+    """The `k`-th smallest number in `array`."""
+    ranked = sorted_numbers([array])
+    (k,) = numbers([k])
+    return ranked[_position(k, len(ranked))]
+
+
+@function("LARGE")
+def large(array, k):
+    """The `k`-th largest number in `array`."""
+    ranked = sorted_numbers([array])
+    (k,) = numbers([k])
+    return ranked[len(ranked) - 1 - _position(k, len(ranked))]
+
+
+@function("RANK")
+def rank(number, ref, order=0):
+    """The position of `number` among the numbers in `ref`: 1 for the
+    largest if `order` is 0, or for the smallest otherwise."""
+    (number,) = numbers([number])
+    ranked = sorted_numbers([ref])
+    less = ranked.count_less(number)
+    greater = ranked.count_greater(number)
+    if less + greater == len(ranked):
+        return err.NA
+    return 1 + (greater if order == 0 else less)
@@ -0,0 +1,244 @@
+"""Inserting and deleting rows and columns.
+
+A sheet shows its cells at logical positions, but `cellstore.CellStore`
+keeps them at physical ones, through an `Axis` per direction mapping the one
+to the other. Inserting or deleting rows only changes that map, a list of
+runs of consecutive positions, so the cells of a million-row sheet stay
+where they are stored. Inserted positions are given physical positions of
+their own, below every other, and deleted ones are never used again.
+
+What the engine keeps next to the cells, keyed by position (the formulas'
+dependencies, cached values, spills and shared formula runs), is few and
+far between by comparison, and is moved along by a `Shift`. Formulas keep
+absolute references, which a `Shift` rewrites only for the formulas reading
+cells that moved. References to deleted cells become ``#REF!``.
+"""
+
+import bisect
+from typing import NamedTuple
+
+from .models import Index, Range
+
+__all__ = ["Axis", "Shift"]
+
+
+class Shift(NamedTuple):
+    """Rows (`axis` 0) or columns (`axis` 1) inserted before position `at`,
+    `count` of them, or if `count` is negative, ``-count`` of them deleted
+    from `at` on.
+
+    >>> insert = Shift(0, 2, 1)
+    >>> [str(insert.moved(ref)) for ref in [Index(2, 0), Range.parse("A1:B4")]]
+    ['A4', 'A1:B5']
+    >>> delete = Shift(1, 1, -2)
+    >>> [delete.moved(Index(0, col)) for col in (0, 2, 3)]
+    [Index(row=0, col=0), None, Index(row=0, col=1)]
+    >>> str(delete.moved(Range.parse("B1:D1"))), delete.moved(Range.parse("B1:C9"))
+    ('B1:B1', None)
+    """
+
+    axis: int
+    at: int
+    count: int
+
+    @property
+    def edges(self):
+        """The positions where positions start moving differently."""
+        if self.count > 0:
+            return (self.at,)
+        return (self.at, self.at - self.count)
+
+    def position(self, position):
+        """Return where `position` moves, or None if it is deleted."""
+        if position < self.at:
+            return position
+        if self.count < 0 and position < self.at - self.count:
+            return None
+        return position + self.count
+
+    def moved(self, ref):
+        """Return where the Index or Range `ref` moves, or None if it is
+        deleted.
+
+        A range grows by the positions inserted into it and shrinks by the
+        positions deleted from it, like a range written over the same cells
+        would."""
+        if isinstance(ref, Range):
+            first = self._bound(ref.first, 0)
+            last = self._bound(ref.last, -1)
+            if first[self.axis] > last[self.axis]:
+                return None
+            return Range(first, last)
+        position = self.position(ref[self.axis])
+        if position is None:
+            return None
+        return self._at(ref, position)
+
+    def changes(self, ref):
+        """Return True if the Index or Range `ref` covers positions that
+        this inserts or deletes, and so refers to other cells once moved."""
+        if isinstance(ref, Range):
+            first, last = ref.first[self.axis], ref.last[self.axis]
+        else:
+            first = last = ref[self.axis]
+        if self.count > 0:
+            return first < self.at <= last
+        return first < self.at - self.count and last >= self.at
+
+    def rereads(self, formula, local=True, sheet=None):
+        """Return True if `formula` reads other cells once its references
+        are moved, as `formula.Formula.moved` with the same arguments does
+        it."""
+        if local and any(map(self.changes, formula.refs + formula.ranges)):
+            return True
+        return any(self.changes(ref) for name, ref in formula.external if name == sheet)
+
+    def _bound(self, index, inside):
+        """Move the first (`inside` 0) or last (`inside` -1) cell of a range,
+        keeping it at the edge of the range if it is deleted."""
+        position = self.position(index[self.axis])
+        if position is None:
+            position = self.at + inside
+        return self._at(index, position)
+
+    def _at(self, index, position):
+        if self.axis == 0:
+            return Index(position, index.col)
+        return Index(index.row, position)
+
+
+class Axis:
+    """The physical position each logical position of a row or column is
+    stored at. Immutable: `inserted` and `deleted` return a new Axis.
+
+    Positions are mapped by runs: from each logical start up to the next one,
+    positions map to consecutive physical positions, and the last run goes on
+    for ever. Inserted positions get physical positions counting down from
+    -1, which nothing else uses.
+
+    >>> axis = Axis().inserted(2, 3)
+    >>> [axis.physical(p) for p in range(7)]
+    [0, 1, -3, -2, -1, 2, 3]
+    >>> axis = axis.deleted(1, 2)
+    >>> [axis.physical(p) for p in range(5)], axis.logical(-1), axis.logical(1)
+    ([0, -2, -1, 2, 3], 2, None)
+    """
+
+    __slots__ = ("_starts", "_targets", "_lowest", "_inverse")
+
+    def __init__(self, starts=(0,), targets=(0,), lowest=0):
+        # The first logical position of each run, ascending from 0
+        self._starts = starts
+        # The physical position of the first position of each run
+        self._targets = targets
+        # The lowest physical position given to inserted positions so far
+        self._lowest = lowest
+        # (targets, runs) sorted by physical position, for `logical`, once
+        # needed
+        self._inverse = None
+
+    @property
+    def identity(self):
+        """True if every position is stored at its own position."""
+        return self._targets == (0,)
+
+    def physical(self, position):
+        """Return the physical position of the logical `position`."""
+        starts = self._starts
+        if len(starts) == 1:
+            return self._targets[0] + position
+        i = bisect.bisect_right(starts, position) - 1
+        return self._targets[i] + position - starts[i]
+
+    def logical(self, position):
+        """Return the logical position stored at the physical `position`, or
+        None if none is."""
+        if self._inverse is None:
+            starts, targets = self._starts, self._targets
+            ends = starts[1:] + (None,)
+            runs = sorted(
+                (target, start, None if end is None else end - start)
+                for start, target, end in zip(starts, targets, ends)
+            )
+            self._inverse = ([run[0] for run in runs], runs)
+        targets, runs = self._inverse
+        i = bisect.bisect_right(targets, position) - 1
+        if i < 0:
+            return None
+        target, start, length = runs[i]
+        if length is not None and position - target >= length:
+            return None
+        return start + position - target
+
+    def spans(self, first, last):
+        """Return the logical positions `first` to `last` as a list of
+        ``(first logical position, first physical position, length)`` of
+        runs of consecutive physical positions."""
+        starts, targets = self._starts, self._targets
+        i = bisect.bisect_right(starts, first) - 1
+        spans = []
+        position = first
+        while position <= last:
+            stop = last + 1
+            if i + 1 < len(starts):
+                stop = min(stop, starts[i + 1])
+            spans.append((position, targets[i] + position - starts[i], stop - position))
+            position = stop
+            i += 1
+        return spans
+
+    def runs(self):
+        """Return the runs from the last to the first, as ``(first physical
+        position, length)``, with a length of None for the last one."""
+        starts, targets = self._starts, self._targets
+        ends = starts[1:] + (None,)
+        return [
+            (target, None if end is None else end - start)
+            for start, target, end in reversed(list(zip(starts, targets, ends)))
+        ]
+
+    def contiguous_from(self, position):
+        """Return True if the positions from `position` on are stored at
+        consecutive physical positions, after every other."""
+        return position >= self._starts[-1]
+
+    def inserted(self, at, count):
+        """Return this Axis with `count` positions inserted before `at`."""
+        starts, targets = list(self._starts), list(self._targets)
+        i = _split(starts, targets, at)
+        lowest = self._lowest - count
+        starts[i:] = [at] + [start + count for start in starts[i:]]
+        targets.insert(i, lowest)
+        return _runs(starts, targets, lowest)
+
+    def deleted(self, at, count):
+        """Return this Axis without the `count` positions from `at` on."""
+        starts, targets = list(self._starts), list(self._targets)
+        i = _split(starts, targets, at)
+        j = _split(starts, targets, at + count)
+        starts[i:] = [start - count for start in starts[j:]]
+        del targets[i:j]
+        return _runs(starts, targets, self._lowest)
+
+
+def _split(starts, targets, at):
+    """Split the run containing `at` so that a run starts there, and return
+    its number."""
+    i = bisect.bisect_right(starts, at) - 1
+    if starts[i] != at:
+        targets.insert(i + 1, targets[i] + at - starts[i])
+        starts.insert(i + 1, at)
+        i += 1
+    return i
+
+
+def _runs(starts, targets, lowest):
+    """Return an Axis of the given runs, merging runs that continue each
+    other."""
+    merged_starts, merged_targets = starts[:1], targets[:1]
+    for start, target in zip(starts[1:], targets[1:]):
+        if target == merged_targets[-1] + start - merged_starts[-1]:
+            continue
+        merged_starts.append(start)
+        merged_targets.append(target)
+    return Axis(tuple(merged_starts), tuple(merged_targets), lowest)
@@ -0,0 +1,65 @@
+"""Callbacks told which cells changed value (see `Spreadsheet.subscribe`).
+
+After each commit the engine knows which cells may have changed, without
+reading anything else. A `Subscription` evaluates only those of them it
+watches, and passes on the ones whose formatted value differs from the value
+it last passed on, so a subscriber does O(changes) work rather than reading
+its whole range again.
+"""
+
+__all__ = ["Subscription"]
+
+
+class Subscription:
+    """Calls `callback` with the cells of `cells` (a `Range`, or None for
+    the whole sheet) whose values changed.
+
+    `callback` is called with a dict of Index to the new formatted value.
+    """
+
+    def __init__(self, sheet, callback, cells=None):
+        self.sheet = sheet
+        self.callback = callback
+        self.cells = cells
+        # Index -> formatted value last passed to `callback`
+        self.known = {}
+
+    def watches(self, index):
+        return self.cells is None or self.cells.contains(index)
+
+    def move(self, shift):
+        """Follow the rows or columns inserted or deleted by the
+        `structure.Shift` `shift`: the watched cells and the values known
+        for them move with their cells.
+
+        Returns:
+            bool: False if every watched cell was deleted.
+        """
+        if self.cells is not None:
+            cells = shift.moved(self.cells)
+            if cells is None:
+                return False
+            self.cells = cells
+        known = {}
+        for index, value in self.known.items():
+            index = shift.moved(index)
+            if index is not None:
+                known[index] = value
+        self.known = known
+        return True
+
+    def publish(self, changed):
+        """Call `callback` with the cells of `changed` that this subscription
+        watches, if any of their values differ from the ones it was last
+        given."""
+        diff = {}
+        known = self.known
+        for index in changed:
+            if not self.watches(index):
+                continue
+            value = self.sheet.get_formatted(index)
+            if known.get(index) != value:
+                known[index] = value
+                diff[index] = value
+        if diff:
+            self.callback(diff)
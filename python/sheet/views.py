@@ -1,8 +1,14 @@
+import bisect
+import collections
 import curses
 from typing import NamedTuple, Callable
 import time
 
+from . import errors as err
+from .engine import MANUAL
+from .filters import filter_rows
 from .models import Index, Range
+from .watch import POLL_INTERVAL
 
 # Map [arrow key] -> [delta to apply to cursor in grid space]
 ARROW_KEYS = {
@@ -20,6 +26,22 @@ KEYNAME_PASTE = "^Y"
 KEYNAME_QUIT = "^C"
 KEYNAME_FORMATTING = "^F"
 KEYNAME_SORT = "^S"
+KEYNAME_FILTER = "^R"
+KEYNAME_RECALCULATE = "^E"
+KEYNAME_NEXT_SHEET = "^N"
+KEYNAME_ROWS_COLUMNS = "^O"
+
+# Display widths of columns, fitted to their values between the two bounds;
+# one character is taken by the mark of stale cells
+DEFAULT_COLUMN_WIDTH = 9
+MIN_COLUMN_WIDTH = 5
+MAX_COLUMN_WIDTH = 40
+
+# Seconds between two frames at most; keys arriving faster are handled
+# together and drawn once
+FRAME_BUDGET = 1 / 60
+# How many recent frame times `Viewer.frame_time_percentile` looks at
+FRAME_SAMPLES = 120
 
 
 class ScreenIndex(NamedTuple):
@@ -57,6 +79,7 @@ class Rectangle(NamedTuple):
 class Layout(NamedTuple):
     grid: Rectangle
     message: Rectangle
+    status: Rectangle
     framerate: Rectangle
     row_labels: Rectangle
     edit_box: Rectangle
@@ -96,7 +119,7 @@ class Menu(NamedTuple):
 
 
 class Viewer:
-    def __init__(self, spreadsheet, stdscr):
+    def __init__(self, spreadsheet, stdscr, watch=None, recorder=None):
         # Save the current visibility state of the cursor (either 1 or 2); we
         # hide the cursor most of the time, but make it visible while editing
         # cell values.
@@ -105,12 +128,27 @@ class Viewer:
         self.stdscr = stdscr
         # A cache of layout information; will be set in `self.measure`
         self.layout = None
+        # A replay.Recorder tracing the keys handled and the changes they
+        # make, or None
+        self.recorder = recorder
         # the instance of engine.Spreadsheet that we are viewing
         self.spreadsheet = spreadsheet
+        if recorder is not None:
+            self.spreadsheet = recorder.wrap(spreadsheet)
+        # the engine.Snapshot being drawn; taken anew every frame so that a
+        # frame never mixes values from before and after another writer's
+        # changes
+        self.snapshot = None
+        # the cells whose values are out of date in manual calculation, as of
+        # `snapshot`; they are drawn with a mark
+        self.stale = frozenset()
         # the top-left visible cell.
         self.top_left = Index(0, 0)
         # the cell that our cursor is currently on.
         self.cursor = Index(0, 0)
+        # sheet name -> (cursor, top_left) when we last switched away from
+        # that sheet of the workbook
+        self.sheet_positions = {}
 
         # Highlighting controls to allow the user to select a rectangular
         # range of cells.
@@ -127,6 +165,13 @@ class Viewer:
         self.message = "Welcome to the spreadsheet!"
         # The state of the formula editor, or None if we are not editing now.
         self.edit_box = None
+        # Called with the text of the editor when it is committed, or None to
+        # set the cell under the cursor.
+        self.edit_commit = None
+        # While filtering, the rows shown, in order, as an array('l') of row
+        # numbers; None to show every row. Cells are drawn through it, and
+        # `cursor` and `top_left` are always on rows in it.
+        self.row_map = None
         # The function that will be called to handle the next key press.
         # Expected to take a single parameter `key` which is the return value
         # of `getch` or a similar call.
@@ -148,8 +193,24 @@ class Viewer:
             ],
             on_selected=self.select_formatting,
         )
-        # Framerate indicator
-        self.last_frame_time = 0.0
+        self.structure_menu = Menu(
+            "Rows/columns",
+            [
+                ("r", "insert rows", "insert_rows"),
+                ("c", "insert columns", "insert_columns"),
+                ("R", "delete rows", "delete_rows"),
+                ("C", "delete columns", "delete_columns"),
+            ],
+            on_selected=self.edit_structure,
+        )
+        # Seconds taken by the last FRAME_SAMPLES frames, from handling the
+        # keys to drawing the result; see `frame_time_percentile`
+        self.frame_times = collections.deque(maxlen=FRAME_SAMPLES)
+        # A watch.CsvTail to poll while waiting for keys, or None
+        self.watch = watch
+        # Milliseconds `wait_for_input` waits for a key, or -1 for ever
+        self.input_timeout = -1 if watch is None else int(POLL_INTERVAL * 1000)
+        self.stdscr.timeout(self.input_timeout)
 
     @property
     def selection(self):
@@ -173,13 +234,17 @@ class Viewer:
         framerate = Rectangle.fromhw(
             bottomy, width - FRAMERATE_WIDTH - 1, 1, FRAMERATE_WIDTH
         )
-        message = Rectangle.fromhw(bottomy, 1, 1, width - framerate.width - 2)
+        STATUS_WIDTH = min(40, width // 3)
+        status = Rectangle.fromhw(
+            bottomy, framerate.top_left.x - STATUS_WIDTH - 1, 1, STATUS_WIDTH
+        )
+        message = Rectangle.fromhw(bottomy, 1, 1, status.top_left.x - 2)
         bottomy -= message.height - 1
 
         # spreadsheet grid. first figure out the width of the row labels
         nrows = bottomy - topy - 2
         # 1 for column header, 1 bc last row isn't drawn
-        max_cell = self.top_left + (nrows, 0)
+        max_cell = Index(self.displayed_rows(nrows + 1)[-1], 0)
         row_label_width = len(max_cell.row_label) + 1  # 1 for padding
         row_labels = Rectangle.fromhw(topy, 0, nrows, row_label_width)
         grid = Rectangle(
@@ -188,6 +253,7 @@ class Viewer:
         self.layout = Layout(
             grid=grid,
             message=message,
+            status=status,
             framerate=framerate,
             row_labels=row_labels,
             edit_box=edit_box,
@@ -196,38 +262,46 @@ class Viewer:
 
     def draw(self):
         """Draw the entire view to `self.stdscr`."""
+        self.snapshot = self.spreadsheet.snapshot()
+        self.stale = frozenset()
+        if self.spreadsheet.calculation == MANUAL:
+            self.stale = self.spreadsheet.stale_cells()
+            if self.stale and not self.message:
+                self.message = (
+                    f"{len(self.stale)} cells out of date, "
+                    f"{KEYNAME_RECALCULATE} to recalculate"
+                )
         grid = self.layout.grid
-        nrows = self.get_rows_displayed()
+        rows = self.displayed_rows(self.get_rows_displayed())
         x = 0
-        col_top_left = self.top_left
+        col = self.top_left.col
         while x <= grid.width:
-            self.draw_column(
-                Range(col_top_left, col_top_left + (nrows - 1, 0)),
-                pos=grid.top_left + (0, x),
-            )
-            col_top_left += (0, 1)
-            x += self.get_width(col_top_left.col)
-        self.draw_row_labels()
+            self.draw_column(col, rows, pos=grid.top_left + (0, x))
+            col += 1
+            x += self.get_width(col)
+        self.draw_row_labels(rows)
         self.draw_message()
+        self.draw_status()
         self.draw_framerate()
         self.draw_shortcuts()
         self.draw_editor()
 
-    def draw_row_labels(self):
-        """Draw the numerical labels of the currently displayed rows."""
+    def draw_row_labels(self, rows):
+        """Draw the numerical labels of the displayed `rows`."""
         (y, x) = self.layout.row_labels.top_left
         # draw the blank upper-left corner
         self.stdscr.addstr(y, x, " " * self.layout.row_labels.width, curses.A_REVERSE)
-        nrows = self.get_rows_displayed()
-        for i in range(nrows):
-            label = _align_right(
-                (self.top_left + (i, 0)).row_label, self.layout.row_labels.width
-            )
+        for i, row in enumerate(rows):
+            label = _align_right(Index(row, 0).row_label, self.layout.row_labels.width)
             self.stdscr.addstr(y + 1 + i, x, label, curses.A_REVERSE)
 
     def get_width(self, col):
-        """Returns the display width of the given column."""
-        return 9
+        """Returns the display width of the given column, fitted to its
+        longest value."""
+        widest = self.spreadsheet.column_width(col)
+        if widest is None:
+            return DEFAULT_COLUMN_WIDTH
+        return max(MIN_COLUMN_WIDTH, min(MAX_COLUMN_WIDTH, widest + 1))
 
     def get_cols_displayed(self):
         """Get the # of columns that are completely visible on the screen."""
@@ -242,18 +316,37 @@ class Viewer:
         """Returns the # of rows that are visible on the screen."""
         return self.layout.grid.height - 1
 
-    def draw_column(self, col_range, pos):
+    def displayed_rows(self, count):
+        """Returns the rows of up to `count` lines of the grid, from the top."""
+        if self.row_map is None:
+            return range(self.top_left.row, self.top_left.row + count)
+        start = self.position_of(self.top_left.row)
+        return self.row_map[start : start + count]
+
+    def position_of(self, row):
+        """Returns the line of the (unscrolled) grid showing `row`."""
+        if self.row_map is None:
+            return row
+        return bisect.bisect_left(self.row_map, row)
+
+    def row_at(self, position):
+        """Returns the row shown on line `position` of the (unscrolled) grid,
+        the inverse of `position_of`."""
+        if self.row_map is None:
+            return position
+        return self.row_map[position]
+
+    def draw_column(self, col, rows, pos):
         """Draw the given section of the spreadsheet, including column header.
 
         Draws in a rectangle from (y, x) to
-            (y + col_range.height + 1, x + self.get_width(col))
+            (y + len(rows) + 1, x + self.get_width(col))
 
         Arguments:
-            col_range: the column to draw.
+            col: the column to draw.
+            rows: the rows of the column to draw, from the top.
             pos: the screen position to start drawing
         """
-        col = col_range.first.col
-        assert col == col_range.last.col
         width = min(self.get_width(col), self.layout.grid.bottom_right.x - pos.x)
 
         if width == 0:
@@ -267,15 +360,16 @@ class Viewer:
             self.stdscr.addstr(*pos, " " * width, curses.A_REVERSE)
             return
         # draw the header
-        label = " " + _align_center(col_range.first.column_label, width - 1)
+        label = " " + _align_center(Index(0, col).column_label, width - 1)
         self.stdscr.addstr(*pos, label, curses.A_REVERSE)
         # draw the values
         values = [
-            (index, self.spreadsheet.get_formatted(index))
-            for index in col_range.indices
+            (index, self.snapshot.get_formatted(index))
+            for index in (Index(row, col) for row in rows)
         ]
         for dy, (index, value) in enumerate(values):
-            text = " " + _align_right(value, width - 1)
+            mark = "~" if index in self.stale else " "
+            text = mark + _align_right(value, width - 1)
             attr = 0
             if self.selecting_from is None:
                 if self.cursor == index:
@@ -293,9 +387,26 @@ class Viewer:
         text = _align_center(self.message, rect.width)
         self.stdscr.addstr(*rect.top_left, text)
 
+    def draw_status(self):
+        """Draw the count, sum and average of the selected cells, if more
+        than one is selected. Rows hidden by a filter count too."""
+        rect = self.layout.status
+        text = ""
+        selection = self.selection
+        if selection.width * selection.height > 1:
+            summary = self.spreadsheet.summarize(selection)
+            if summary is not None and summary.numbers:
+                text = (
+                    f"Sum {summary.total:g} Count {summary.cells} "
+                    f"Average {summary.average:g}"
+                )
+            elif summary is not None and summary.cells:
+                text = f"Count {summary.cells}"
+        self.stdscr.addstr(*rect.top_left, _align_right(text, rect.width))
+
     def draw_framerate(self):
         rect = self.layout.framerate
-        text = _align_right("%.2f" % self.last_frame_time, rect.width)
+        text = _align_right("%.2f" % self.frame_time_percentile(95), rect.width)
         self.stdscr.addstr(*rect.top_left, text)
 
     def draw_editor(self):
@@ -305,7 +416,7 @@ class Viewer:
         rect = self.layout.edit_box
         if self.edit_box is None:
             curses.curs_set(0)
-            formatted = self.spreadsheet.get_formatted(self.cursor)
+            formatted = self.snapshot.get_formatted(self.cursor)
             self.stdscr.addstr(*rect.top_left, formatted)
         else:
             curses.curs_set(self.initial_cursor_visibility)
@@ -342,6 +453,13 @@ class Viewer:
         shortcut(KEYNAME_BEGIN_COPY, "copy")
         shortcut(KEYNAME_PASTE, "paste")
         shortcut(KEYNAME_SORT, "sort")
+        shortcut(KEYNAME_FILTER, "filter")
+        shortcut(KEYNAME_ROWS_COLUMNS, "rows/cols")
+        workbook = self.spreadsheet.workbook
+        if workbook is not None and len(workbook) > 1:
+            shortcut(KEYNAME_NEXT_SHEET, "next sheet")
+        if self.spreadsheet.calculation == MANUAL:
+            shortcut(KEYNAME_RECALCULATE, "recalc")
         shortcut(KEYNAME_QUIT, "exit")
         if self.selecting_from:
             shortcut("^G", "cancel")
@@ -371,16 +489,31 @@ class Viewer:
             self.enter_menu(self.formatting_menu)
         elif name == KEYNAME_SORT:
             self.enter_sort_menu()
+        elif name == KEYNAME_FILTER:
+            self.message = (
+                f"Show rows where column {self.cursor.column_label} is, e.g., "
+                "'>100' (empty shows all)"
+            )
+            self.begin_editing("", commit=self.apply_filter)
+        elif name == KEYNAME_RECALCULATE:
+            changed = self.spreadsheet.recalculate()
+            self.message = f"Recalculated {len(changed)} cells"
+        elif name == KEYNAME_NEXT_SHEET:
+            self.next_sheet()
+        elif name == KEYNAME_ROWS_COLUMNS:
+            self.enter_menu(self.structure_menu)
         elif action in BACKSPACE_KEYS:
             for index in self.selection.indices:
                 self.spreadsheet.set(index, "")
         else:
             self.message = f"Unknown shortcut {name}"
 
-    def begin_editing(self, initial_text):
-        """Start editing the value of the cell."""
+    def begin_editing(self, initial_text, commit=None):
+        """Start editing the value of the cell, or if `commit` is given, some
+        text to call it with."""
         self.finish_selecting()
         self.edit_box = EditBox(text=initial_text, cursor=len(initial_text))
+        self.edit_commit = commit
         self.key_handler = self.handle_key_edit
 
     def finish_editing(self, commit):
@@ -389,10 +522,63 @@ class Viewer:
         If `commit` is true, sets the cell value to whatever is in the text
         box; otherwise, discards the text box value."""
         if commit:
-            self.spreadsheet.set(self.cursor, self.edit_box.text)
+            if self.edit_commit is None:
+                self.spreadsheet.set(self.cursor, self.edit_box.text)
+            else:
+                self.edit_commit(self.edit_box.text)
         self.edit_box = None
+        self.edit_commit = None
         self.key_handler = self.handle_key_default
 
+    def apply_filter(self, criterion):
+        """Show only the rows whose value in the cursor's column meets
+        `criterion`, or every row if it is empty.
+
+        The rows are found once, so edits don't hide or show rows until the
+        filter is applied again."""
+        if not criterion:
+            self.row_map = None
+            return
+        label = self.cursor.column_label
+        try:
+            rows = filter_rows(self.spreadsheet, self.cursor.col, criterion)
+        except err.FormulaError:
+            rows = None
+        except NotImplementedError as e:
+            self.message = str(e)
+            return
+        if not rows:
+            self.message = f"No rows where {label} is {criterion}"
+            return
+        self.row_map = rows
+        self.cursor = Index(rows[0], self.cursor.col)
+        self.top_left = Index(rows[0], self.top_left.col)
+        self.message = f"{len(rows)} rows where {label} is {criterion}"
+
+    def next_sheet(self):
+        """Show the next sheet of the workbook, or the first one after the
+        last, where the cursor was when we last left it.
+
+        Only the cells drawn are read, so the other sheets keep their cached
+        values and aren't evaluated again."""
+        workbook = self.spreadsheet.workbook
+        if workbook is None or len(workbook) < 2:
+            self.message = "There are no other sheets"
+            return
+        names = list(workbook)
+        current = self.spreadsheet.name
+        self.sheet_positions[current] = (self.cursor, self.top_left)
+        name = names[(names.index(current) + 1) % len(names)]
+        self.spreadsheet = workbook[name]
+        if self.recorder is not None:
+            self.spreadsheet = self.recorder.wrap(self.spreadsheet)
+        self.cursor, self.top_left = self.sheet_positions.get(
+            name, (Index(0, 0), Index(0, 0))
+        )
+        self.row_map = None
+        self.finish_selecting()
+        self.message = f"Sheet {name}"
+
     def begin_selecting(self):
         """Enter range-selection mode.
 
@@ -433,8 +619,10 @@ class Viewer:
         current edit, then handle the key in navigation mode."""
         name = get_keyname(action)
         if action in ENTER_KEYS:
+            editing_cell = self.edit_commit is None
             self.finish_editing(True)
-            self.move_cursor(Index(1, 0))
+            if editing_cell:
+                self.move_cursor(Index(1, 0))
         elif is_character(action):
             char = get_character(action)
             self.edit_box = self.edit_box.insert(char)
@@ -456,12 +644,19 @@ class Viewer:
         """Move the cell cursor.
 
         If necessary, update `self.top_left` to ensure that the cell cursor is
-        visible."""
-        self.cursor = (self.cursor + delta).max((0, 0))
-        self.top_left = self.top_left.min(self.cursor)
-        self.top_left = self.top_left.max(
-            self.cursor - (self.get_rows_displayed() - 1, self.get_cols_displayed() - 1)
+        visible. While filtering, moves between the rows shown."""
+        # Work in lines of the grid rather than rows.
+        cursor = Index(self.position_of(self.cursor.row), self.cursor.col)
+        top_left = Index(self.position_of(self.top_left.row), self.top_left.col)
+        cursor = (cursor + delta).max((0, 0))
+        if self.row_map is not None:
+            cursor = cursor.min((len(self.row_map) - 1, cursor.col))
+        top_left = top_left.min(cursor)
+        top_left = top_left.max(
+            cursor - (self.get_rows_displayed() - 1, self.get_cols_displayed() - 1)
         )
+        self.cursor = Index(self.row_at(cursor.row), cursor.col)
+        self.top_left = Index(self.row_at(top_left.row), top_left.col)
 
     def handle_key_menu(self, action):
         name = get_keyname(action)
@@ -490,6 +685,26 @@ class Viewer:
         for index in self.selection.indices:
             self.spreadsheet.set_format(index, ftype, spec)
 
+    def edit_structure(self, name):
+        """Insert or delete as many rows or columns as the selection spans,
+        before or from its first one, with the Spreadsheet method `name`."""
+        selection = self.selection
+        verb, noun = name.split("_")
+        if noun == "rows":
+            at, count = selection.first.row, selection.height
+        else:
+            at, count = selection.first.col, selection.width
+        try:
+            getattr(self.spreadsheet, name)(at, count)
+        except NotImplementedError as e:
+            self.message = str(e)
+            return
+        # The rows shown by a filter have moved.
+        self.row_map = None
+        self.finish_selecting()
+        done = {"insert": "Inserted", "delete": "Deleted"}[verb]
+        self.message = f"{done} {count} {noun}"
+
     def enter_sort_menu(self):
         if self.selecting_from is None:
             self.message = "Select a range first with ^-[space]"
@@ -522,22 +737,87 @@ class Viewer:
         self.spreadsheet.sort(self.selection, col, ascending)
 
     def loop(self):
-        """Main loop. Refresh the layout, draw, then interpret a character."""
+        """Main loop. Refresh the layout, draw, then interpret the keys
+        pressed meanwhile."""
         now = time.perf_counter()
         while not self.quit:
             self.stdscr.erase()
             self.measure()
             self.draw()
             self.message = ""
-            self.last_frame_time = time.perf_counter() - now
+            self.frame_times.append(time.perf_counter() - now)
             try:
-                action = self.stdscr.getch()
+                actions = self.read_input(now)
             except KeyboardInterrupt:
                 break  # quit
             now = time.perf_counter()
-            if action != curses.ERR:
+            self.handle_keys(actions)
+
+    def read_input(self, started):
+        """Wait for a key, then return it along with every key pressed until
+        `FRAME_BUDGET` seconds after the last frame `started`.
+
+        When keys arrive faster than frames are drawn, like a held arrow key
+        over a slow connection, they are all handled before the next frame
+        instead of one frame each."""
+        actions = [self.wait_for_input()]
+        try:
+            while True:
+                remaining = started + FRAME_BUDGET - time.perf_counter()
+                self.stdscr.timeout(max(0, int(remaining * 1000)))
+                action = self.stdscr.getch()
+                if action == curses.ERR:
+                    return actions
+                actions.append(action)
+        finally:
+            self.stdscr.timeout(self.input_timeout)
+
+    def handle_keys(self, actions):
+        """Handle `actions` in order, moving the cursor once for each run of
+        the same arrow key."""
+        repeated = 0
+        for n, action in enumerate(actions):
+            if self.quit:
+                return
+            if action == curses.ERR:
+                continue
+            if self.recorder is not None:
+                self.recorder.record(self, action)
+            if action in ARROW_KEYS and self.key_handler == self.handle_key_default:
+                repeated += 1
+                if n + 1 < len(actions) and actions[n + 1] == action:
+                    continue
+                delta = ARROW_KEYS[action]
+                self.move_cursor(Index(delta.row * repeated, delta.col * repeated))
+                repeated = 0
+            else:
                 self.key_handler(action)
 
+    def frame_time_percentile(self, percentile):
+        """Return the `percentile`th percentile (0 to 100) of the times taken
+        by the recent frames, in seconds, or 0 before the first frame."""
+        if not self.frame_times:
+            return 0.0
+        return time_percentile(sorted(self.frame_times), percentile)
+
+    def wait_for_input(self):
+        """Return the next key pressed, or `curses.ERR` as soon as rows were
+        appended to the watched file, so that they get drawn."""
+        while True:
+            action = self.stdscr.getch()
+            if action != curses.ERR or self.watch is None or self.watch.poll():
+                return action
+
+
+def time_percentile(times, percentile):
+    """Return the `percentile`th percentile (0 to 100) of the sorted, non-empty
+    list `times`: the time at that rank, with no interpolation.
+
+    >>> time_percentile([0.1, 0.2, 0.3, 0.4], 50)
+    0.3
+    """
+    return times[min(len(times) - 1, len(times) * percentile // 100)]
+
 
 def _align_right(s, width):
     """Returns `s` left-padded to `width` with whitespace.
@@ -0,0 +1,70 @@
+"""Load CSV files, and keep loading the rows appended to them.
+
+`CsvTail` remembers how far into the file it has read. Each `CsvTail.poll`
+reads only the bytes appended since, and sets their cells in one
+`Spreadsheet.batch`, so only formulas that read the new rows (like a
+``=SUM(A1:A100000)`` covering them) are recalculated.
+"""
+
+import csv
+import io
+import logging
+import os
+
+from .models import Index
+
+__all__ = ["CsvTail", "POLL_INTERVAL"]
+
+# Seconds between polls of a watched file
+POLL_INTERVAL = 0.05
+
+
+class CsvTail:
+    """Reads the rows of the CSV file at `path` into `sheet` as they are
+    appended.
+
+    A line is only read once it is complete, so a row that is still being
+    written appears on a later poll. If the file shrinks, it is assumed to
+    have been replaced and is read again from the start, over the cells
+    already in the sheet. Quoted values spanning several lines are not
+    supported.
+    """
+
+    def __init__(self, path, sheet):
+        self.path = path
+        self.sheet = sheet
+        # Bytes of the file read so far, always up to the end of a line
+        self.offset = 0
+        # The row the next line goes in
+        self.row = 0
+
+    def poll(self):
+        """Read the lines appended since the last poll.
+
+        Returns:
+            set: the cells whose values may have changed.
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except OSError as e:
+            logging.warning(f"Cannot watch {self.path}: {e}")
+            return set()
+        if size < self.offset:
+            logging.info(f"{self.path} shrank; reading it again")
+            self.offset = self.row = 0
+        if size == self.offset:
+            return set()
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        end = data.rfind(b"\n") + 1
+        if not end:
+            return set()
+        self.offset += end
+        text = data[:end].decode("utf-8", errors="replace")
+        with self.sheet.batch() as changed:
+            for values in csv.reader(io.StringIO(text, newline="")):
+                for col, value in enumerate(values):
+                    self.sheet.set(Index(self.row, col), value)
+                self.row += 1
+        return changed
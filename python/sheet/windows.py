@@ -0,0 +1,114 @@
+"""Aggregates over every window of `n` consecutive items of a list.
+
+The list is split into blocks of `n` items. Each block keeps the aggregate of
+every prefix and every suffix of itself, so a window, which covers the end
+of one block and the start of the next, is the combination of one suffix and
+one prefix: O(1) per window for any associative aggregate, including
+minimums and maximums, and without the rounding errors of subtracting
+running totals. Changing an item only recomputes its block.
+"""
+
+__all__ = ["SlidingWindows"]
+
+
+class SlidingWindows:
+    """The aggregates of the windows of `n` items of a list.
+
+    `leaf` turns an item into an aggregate, and `combine` combines the
+    aggregates of two neighbouring runs of items, the earlier one first.
+    Items may be appended to the list between calls to `get`; any other
+    change must be reported with `discard`.
+
+    >>> import operator
+    >>> items = [4, 1, 5, 2, 6, 3]
+    >>> windows = SlidingWindows(3, lambda item: item, operator.add)
+    >>> [windows.get(items, last) for last in range(6)]
+    [4, 5, 10, 8, 13, 11]
+    >>> items[3] = 0
+    >>> windows.discard(3)
+    >>> windows.get(items, 4)
+    11
+    """
+
+    def __init__(self, n, leaf, combine):
+        self.n = n
+        self._leaf = leaf
+        self._combine = combine
+        # The aggregate of each item and the ones before it in its block
+        self._prefix = []
+        # The aggregate of each item and the ones after it in its block
+        self._suffix = []
+        # Numbers of the blocks whose aggregates are out of date
+        self._stale = set()
+        # Numbers of blocks whose prefixes are up to date but not suffixes;
+        # a block's suffixes are only needed, and computed, once it is full
+        self._no_suffixes = set()
+
+    def get(self, items, last):
+        """Return the aggregate of ``items[last - n + 1 : last + 1]``, or of
+        ``items[: last + 1]`` if that is shorter."""
+        n = self.n
+        if len(items) > len(self._prefix):
+            self._grow(items)
+        first = last - n + 1
+        self._refresh(items, last // n)
+        if first <= 0 or first % n == 0:
+            return self._prefix[last]
+        # The window starts in a full block before the one it ends in.
+        block = first // n
+        self._refresh(items, block)
+        if block in self._no_suffixes:
+            self._no_suffixes.discard(block)
+            self._compute_suffixes(items, block)
+        return self._combine(self._suffix[first], self._prefix[last])
+
+    def discard(self, i):
+        """Note that the item at position `i` may have changed."""
+        self._stale.add(i // self.n)
+
+    def _grow(self, items):
+        old = len(self._prefix)
+        length = len(items)
+        n = self.n
+        self._prefix.extend([None] * (length - old))
+        self._suffix.extend([None] * (length - old))
+        block = old // n
+        if old % n and block not in self._stale:
+            # Appending to a block only adds prefixes.
+            prefix = self._prefix
+            leaf = self._leaf
+            combine = self._combine
+            for i in range(old, min((block + 1) * n, length)):
+                prefix[i] = combine(prefix[i - 1], leaf(items[i]))
+            self._no_suffixes.add(block)
+            block += 1
+        self._stale.update(range(block, (length + n - 1) // n))
+
+    def _refresh(self, items, block):
+        """Recompute the prefixes and suffixes of `block` if it is stale."""
+        if block not in self._stale:
+            return
+        self._stale.discard(block)
+        leaf = self._leaf
+        combine = self._combine
+        start = block * self.n
+        stop = min(start + self.n, len(items))
+        prefix = self._prefix
+        total = prefix[start] = leaf(items[start])
+        for i in range(start + 1, stop):
+            total = prefix[i] = combine(total, leaf(items[i]))
+        if stop - start == self.n:
+            self._no_suffixes.discard(block)
+            self._compute_suffixes(items, block)
+        else:
+            self._no_suffixes.add(block)
+
+    def _compute_suffixes(self, items, block):
+        leaf = self._leaf
+        combine = self._combine
+        start = block * self.n
+        stop = start + self.n
+        suffix = self._suffix
+        total = suffix[stop - 1] = leaf(items[stop - 1])
+        for i in range(stop - 2, start - 1, -1):
+            total = suffix[i] = combine(leaf(items[i]), total)
@@ -0,0 +1,132 @@
+"""Workbooks of several named sheets that read each other's cells.
+
+Each sheet of a `Workbook` is an ordinary `Spreadsheet`, with its own cells,
+caches and dependency graph. A formula reading another sheet, like
+``=Sheet2!A1*2``, keeps that reference out of its own sheet's graph: it is
+recorded in a small graph per sheet it reads (see
+`Spreadsheet._set_external_precedents`), indexed by the cells it reads there.
+
+When a sheet commits a change, the workbook follows those edges to the
+formulas of the other sheets reading the changed cells, and invalidates them
+and everything computed from them in their own sheets, repeating for
+whatever they change in turn. Sheets that don't read the changed cells,
+directly or not, aren't touched: they keep their cached values, and their
+version doesn't change. Rows or columns inserted into a sheet, or deleted
+from it, rewrite the references to it in the formulas of the other sheets
+reading it, the same way.
+
+Sheets share one lock, so a formula can read any sheet while its own is
+being written. A `Snapshot` of one sheet reads the other sheets from
+snapshots taken when it first reads them, which may be of later versions
+than its own.
+"""
+
+import threading
+
+from .engine import Spreadsheet
+from .models import Index
+
+__all__ = ["Workbook"]
+
+
+class Workbook:
+    """Named sheets whose formulas can read each other, with references like
+    ``Sheet2!A1`` or ``'Q1 sales'!B2:B9``.
+
+    >>> book = Workbook(["Prices", "Orders"])
+    >>> book["Prices"].set(Index(0, 0), "4")
+    >>> book["Orders"].set(Index(0, 0), "=Prices!A1*3")
+    >>> book["Prices"].set(Index(0, 0), "5")
+    >>> book["Orders"].get_formatted(Index(0, 0))
+    '15'
+
+    Args:
+        names (list of str): the names of the first sheets, in order.
+    """
+
+    def __init__(self, names=("Sheet1",)):
+        # name -> Spreadsheet, in the order the sheets were added
+        self.sheets = {}
+        # Held by writers of any sheet, see `Spreadsheet._lock`
+        self._lock = threading.RLock()
+        # Spreadsheet -> the cells whose values it dropped, for the sheets
+        # whose formulas were rewritten after rows or columns of another
+        # moved, waiting for that sheet to commit; see `_shifted`
+        self._rewritten = {}
+        for name in names:
+            self.add_sheet(name)
+
+    def __getitem__(self, name):
+        return self.sheets[name]
+
+    def __iter__(self):
+        """Iterate over the sheet names, in order."""
+        return iter(self.sheets)
+
+    def __len__(self):
+        return len(self.sheets)
+
+    def add_sheet(self, name):
+        """Add an empty sheet called `name` after the others, and return it.
+
+        Formulas already referring to `name` read the new sheet from now on.
+
+        Raises:
+            ValueError: if `name` is empty, contains a quote, or is taken.
+        """
+        if not name or "'" in name:
+            raise ValueError(f"Invalid sheet name {name!r}")
+        with self._lock:
+            if name in self.sheets:
+                raise ValueError(f"There already is a sheet named {name!r}")
+            sheet = Spreadsheet()
+            sheet.workbook = self
+            sheet.name = name
+            sheet._lock = self._lock
+            self.sheets[name] = sheet
+            self._propagate(sheet, None)
+        return sheet
+
+    def is_read(self, name):
+        """Return True if formulas of any sheet read cells of the sheet called
+        `name`."""
+        with self._lock:
+            return any(
+                name in sheet._external and sheet._external[name].formulas()
+                for sheet in self.sheets.values()
+            )
+
+    def _shifted(self, source, shift):
+        """Rewrite the formulas of the other sheets reading `source`, in
+        which the `structure.Shift` `shift` inserted or deleted rows or
+        columns. They are published by the next `_propagate`, when `source`
+        commits."""
+        for sheet in self.sheets.values():
+            if sheet is source:
+                continue
+            dropped = sheet._external_shifted(source.name, shift)
+            if dropped is not None and not sheet._batch_depth:
+                self._rewritten.setdefault(sheet, set()).update(dropped)
+
+    def _propagate(self, source, changed):
+        """Invalidate everything computed from the cells `changed` of
+        `source` in the other sheets, through any number of sheets, then
+        publish the sheets that changed as new versions.
+
+        Every sheet is invalidated before any is published, so that the
+        subscriptions and pivots of one sheet never read values of another
+        that are about to be dropped. If `changed` is None, everything read
+        from `source` is invalidated.
+        """
+        dropped, self._rewritten = self._rewritten, {}
+        frontier = [(source.name, changed)]
+        frontier.extend((sheet.name, set(cells)) for sheet, cells in dropped.items())
+        while frontier:
+            name, changed = frontier.pop()
+            for sheet in self.sheets.values():
+                invalidated = sheet._external_changed(name, changed)
+                if invalidated:
+                    dropped.setdefault(sheet, set()).update(invalidated)
+                    frontier.append((sheet.name, invalidated))
+        for sheet, changed in dropped.items():
+            sheet._publish(changed, propagate=False)
@@ -0,0 +1,90 @@
+import pytest
+
+from sheet import columnstats, replay
+from sheet.columnstats import summarize
+from sheet.engine import MANUAL, Spreadsheet
+from sheet.models import Index, Range
+from sheet.views import MIN_COLUMN_WIDTH, Viewer
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(columnstats, "BLOCK", 4)
+
+
+def values(sheet, col, first_row, last_row):
+    return [
+        sheet.get_formatted(Index(row, col)) for row in range(first_row, last_row + 1)
+    ]
+
+
+def test_summaries_follow_changes():
+    sheet = Spreadsheet()
+    for row in range(20):
+        sheet.set(Index(row, 0), str(row))
+        sheet.set(Index(row, 1), f"=A{row + 1}*2")
+    assert sheet.summarize(Range.parse("B3:B18")) == summarize(values(sheet, 1, 2, 17))
+    sheet.set(Index(5, 0), "pear")
+    sheet.set(Index(30, 1), "=SUM(A1:A20)")
+    sheet.set(Index(2, 1), "")
+    for first, last in [(0, 40), (2, 17), (5, 6), (3, 30)]:
+        expected = summarize(values(sheet, 1, first, last))
+        assert sheet.summarize(Range(Index(first, 1), Index(last, 1))) == expected
+    assert sheet.column_width(1) == max(map(len, values(sheet, 1, 0, 40)))
+    summary = sheet.summarize(Range.parse("A1:B40"))
+    counts = (summary.cells, summary.numbers, summary.errors, summary.text)
+    assert counts == (40, 38, 0, 2)
+
+
+def test_manual_calculation_summarizes_values_shown():
+    sheet = Spreadsheet()
+    sheet.set(Index(0, 0), "1")
+    sheet.set(Index(0, 1), "=A1*1000")
+    assert sheet.column_width(1) == 0
+    assert sheet.get_formatted(Index(0, 1)) == "1000"
+    assert sheet.column_width(1) == 4
+    sheet.set_calculation(MANUAL)
+    sheet.set(Index(0, 0), "10")
+    assert sheet.column_width(1) == 4
+    sheet.recalculate()
+    assert sheet.column_width(1) == 5
+
+
+def test_viewer_fits_columns_and_sums_the_selection():
+    sheet = Spreadsheet()
+    sheet.set(Index(0, 0), "a rather long value")
+    sheet.set(Index(0, 1), "1")
+    sheet.set(Index(1, 1), "2.5")
+    with replay._headless():
+        screen = replay.HeadlessScreen()
+        viewer = Viewer(sheet, screen)
+        assert viewer.get_width(0) == len("a rather long value") + 1
+        assert viewer.get_width(1) == viewer.get_width(2) == MIN_COLUMN_WIDTH
+        viewer.selecting_from = Index(0, 1)
+        viewer.cursor = Index(2, 1)
+        texts = []
+        screen.addstr = lambda *args: texts.append(args[2 if len(args) > 2 else 0])
+        viewer.measure()
+        viewer.draw()
+    assert "Sum 3.5 Count 2 Average 1.75" in [text.strip() for text in texts]
+
+
+def test_only_evaluated_and_selected_cells_are_read():
+    sheet = Spreadsheet()
+    with sheet.batch():
+        for row in range(40):
+            sheet.set(Index(row, 0), str(row))
+            sheet.set(Index(row, 1), f"=A{row + 1}*{row}")
+    assert sheet.column_width(1) == 0
+    assert sheet._values == {}
+    assert sheet.get_formatted(Index(39, 1)) == "1521"
+    assert sheet.column_width(1) == 4
+    summary = sheet.summarize(Range.parse("B2:B5"))
+    assert (summary.cells, summary.total) == (4, 1 + 4 + 9 + 16)
+    assert {index.row for index in sheet._values if index.col == 1} == {1, 2, 3, 4, 39}
+    sheet.set(Index(39, 0), "1")
+    assert sheet.column_width(1) == 2
+    assert (
+        sheet.summarize(Range.parse("B1:B40")).total
+        == sum(row * row for row in range(39)) + 39
+    )
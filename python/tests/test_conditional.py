@@ -0,0 +1,75 @@
+from sheet import errors as err
+from sheet.conditional import matching_rows, parse_criterion
+from sheet.engine import Spreadsheet
+from sheet.models import Index
+
+
+def fill(sheet, rows):
+    with sheet.batch():
+        for row, values in enumerate(rows):
+            for col, value in enumerate(values):
+                sheet.set(Index(row, col), value)
+
+
+def formulas(sheet, *texts):
+    for row, text in enumerate(texts):
+        sheet.set(Index(row, 5), text)
+    return [sheet.get_formatted(Index(row, 5)) for row in range(len(texts))]
+
+
+def test_criteria():
+    sheet = Spreadsheet()
+    fill(
+        sheet,
+        [["apple", "3"], ["Pear", "5"], ["apple", "x"], ["150", "7"], ["", "11"]],
+    )
+    assert formulas(
+        sheet,
+        '=COUNTIF(A1:A5, "APPLE")',
+        '=SUMIF(A1:A5, "apple", B1:B5)',
+        '=SUMIF(A1:A5, ">100")',
+        '=COUNTIF(A1:A5, ">=b")',
+        '=COUNTIF(A1:A5, "<>apple")',
+        '=SUMIF(A1:A5, "", B1:B5)',
+        '=AVERAGEIF(B1:B5, ">4")',
+        '=AVERAGEIF(B1:B5, ">100")',
+        '=SUMIF(B1:B5, "<>x")',
+    ) == ["2", "3", "150", "1", "3", "11", "7.666666666666667", err.DIV0, "26"]
+
+
+def test_criteria_follow_changes():
+    sheet = Spreadsheet()
+    fill(sheet, [[str(row)] for row in range(100)])
+    assert formulas(
+        sheet, '=SUMIF(A1:A100, ">=90")', "=COUNTIF(A1:A100, 5)", "=SUMIF(A1:A10, 5)"
+    ) == ["945", "1", "5"]
+    sheet.set(Index(95, 0), "5")
+    sheet.set(Index(3, 0), "=A5*1000")
+    assert [sheet.get_formatted(Index(row, 5)) for row in range(3)] == [
+        "4850",
+        "2",
+        "5",
+    ]
+    # Errors only matter in the cells that are summed.
+    sheet.set(Index(4, 0), "#N/A")
+    assert sheet.get_formatted(Index(0, 5)) == "850"
+    assert sheet.get_formatted(Index(2, 5)) == "5"
+    assert formulas(sheet, '=SUMIF(A1:A10, "<>1")') == [err.NA]
+
+
+def test_matching_rows():
+    sheet = Spreadsheet()
+    fill(sheet, [[value] for value in ["3", "x", "", "10", "3", "y"]])
+    index = sheet.column_index(0)
+
+    def rows(criterion, first_row=0, last_row=5):
+        op, key = parse_criterion(criterion)
+        return matching_rows(index, op, key, first_row, last_row)
+
+    assert rows("3") == [0, 4]
+    assert rows("<>3") == [1, 2, 3, 5]
+    assert rows(">=3") == [0, 3, 4]
+    assert rows(">=3", 1, 3) == [3]
+    assert rows("<z") == [1, 5]
+    assert rows("") == [2]
+    assert rows("<") == []
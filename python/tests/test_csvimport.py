@@ -0,0 +1,73 @@
+import csv
+
+from sheet import csvimport
+from sheet.engine import Spreadsheet
+from sheet.models import Index
+from sheet.sharding import ShardedSpreadsheet
+
+ROWS = [
+    ["region", "units", "note"],
+    ["north", "3", '"quoted, with a\nnewline"'],
+    ["south", "", "=B2*2"],
+    ["north"],
+    [],
+    ["east", "7", '"a ""quote"""', "extra"],
+    ["west", "=B6+1", ""],
+]
+
+
+def write_csv(path, copies):
+    lines = [",".join(row) for row in ROWS] * copies
+    path.write_text("\n".join(lines) + "\n")
+    return len(lines)
+
+
+def cells(sheet, rows):
+    return [
+        (sheet.get_raw(Index(row, col)), sheet.get_formatted(Index(row, col)))
+        for row in range(rows)
+        for col in range(5)
+    ]
+
+
+def test_split_csv_starts_chunks_at_rows(tmp_path):
+    path = tmp_path / "data.csv"
+    write_csv(path, 20)
+    data = path.read_bytes()
+    chunks = csvimport.split_csv(str(path), 16)
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(data)
+    for (_, end), (start, _) in zip(chunks, chunks[1:]):
+        assert end == start
+        assert data[:start].count(b'"') % 2 == 0 and data[start - 1 : start] == b"\n"
+
+
+def test_import_matches_setting_every_cell(tmp_path, monkeypatch):
+    path = tmp_path / "data.csv"
+    rows = write_csv(path, 50)
+    expected = Spreadsheet()
+    with path.open(newline="") as f, expected.batch():
+        for row, values in enumerate(csv.reader(f)):
+            for col, value in enumerate(values):
+                expected.set(Index(row, col), value)
+    # Enough chunks for several of them to go through each worker.
+    monkeypatch.setattr(csvimport, "MIN_CHUNK", 256)
+    sheet = Spreadsheet()
+    assert csvimport.import_csv(str(path), sheet, workers=2) == rows
+    assert cells(sheet, rows) == cells(expected, rows)
+    assert len(sheet.cells) == len(expected.cells)
+    # A reference to an empty value is #NULL, as for a cell set to "".
+    sheet.set(Index(0, 4), "=B3")
+    assert sheet.get_formatted(Index(0, 4)) == "#NULL!"
+
+    # A sheet that isn't empty has each cell set.
+    for target in sheet, expected:
+        target.set(Index(0, 4), "=SUM(B1:B9)")
+    assert sheet.get_formatted(Index(0, 4)) == "21"
+    sheet.set(Index(1, 1), "30")
+    csvimport.import_csv(str(path), sheet, workers=1)
+    assert cells(sheet, rows) == cells(expected, rows)
+
+    with ShardedSpreadsheet(workers=2, block_rows=16) as sharded:
+        csvimport.import_csv(str(path), sharded, workers=2)
+        # Leaving out the first row, where `expected` has a formula in E1
+        assert cells(sharded, 40)[5:] == cells(expected, 40)[5:]
@@ -0,0 +1,84 @@
+import itertools
+
+import pytest
+
+from sheet.datatable import data_table
+from sheet.engine import Spreadsheet
+from sheet.models import Index
+
+
+def build(sheet):
+    with sheet.batch():
+        sheet.set(Index(0, 0), "100")
+        sheet.set(Index(0, 1), "3")
+        sheet.set(Index(0, 2), "0")
+        for row in range(1, 40):
+            sheet.set(Index(row, 0), str(row))
+            sheet.set(Index(row, 1), f"=A{row + 1}*B1")
+            sheet.set(Index(row, 2), f"=B{row + 1}+C{row}")
+        sheet.set(Index(0, 3), "=A2:A4*2")
+        sheet.set(Index(0, 4), "=SUM(D1:D3)+A1")
+        sheet.set(Index(0, 5), "=SUM(A2:A40)")
+
+
+OUTPUTS = [Index(39, 2), Index(0, 4), Index(0, 5), Index(20, 1)]
+
+
+def expected(inputs, scenarios):
+    sheet = Spreadsheet()
+    build(sheet)
+    rows = []
+    for scenario in scenarios:
+        for index, raw in zip(inputs, scenario):
+            sheet.set(index, raw)
+        rows.append([sheet.get_formatted(index) for index in OUTPUTS])
+    return rows
+
+
+def test_scenarios_are_evaluated_in_workers_and_written_back():
+    sheet = Spreadsheet()
+    build(sheet)
+    before = [sheet.get_formatted(index) for index in OUTPUTS]
+    scenarios = [[str(value)] for value in range(-5, 15)]
+    inputs = [Index(0, 1)]
+
+    with sheet.batch() as changed:
+        rows = data_table(sheet, inputs, scenarios, OUTPUTS, Index(50, 0), 2)
+    assert rows == expected(inputs, scenarios)
+    assert changed == {Index(50 + r, c) for r in range(20) for c in range(5)}
+    assert [sheet.get_formatted(index) for index in OUTPUTS] == before
+    assert sheet.get_raw(Index(52, 0)) == "-3"
+    assert [sheet.get_formatted(Index(52, c)) for c in range(1, 5)] == rows[2]
+
+
+def test_inputs_in_shared_formulas_and_spills():
+    sheet = Spreadsheet()
+    build(sheet)
+    assert sheet._shared.find(Index(10, 2)) is not None
+    inputs = [Index(0, 1), Index(10, 2), Index(1, 3)]
+    scenarios = [
+        list(scenario)
+        for scenario in itertools.product(["2", "=A1"], ["7", ""], ["1", "x"])
+    ]
+
+    rows = data_table(sheet, inputs, scenarios, OUTPUTS, workers=3)
+    assert rows == expected(inputs, scenarios)
+    with pytest.raises(ValueError):
+        data_table(sheet, inputs, [["1"]], OUTPUTS)
+
+
+def test_forks_only_evaluate_the_cells_computed_from_their_inputs():
+    sheet = Spreadsheet()
+    build(sheet)
+    sheet.set(Index(0, 6), "=A1*2")
+    assert sheet.get_formatted(Index(0, 5)) == "780"
+    fork = sheet.fork([Index(30, 0)])
+    fork.set(Index(30, 0), "1000")
+    assert fork.get_formatted(Index(0, 5)) == "1750"
+    assert fork.get_formatted(Index(39, 2)) == str(3 * (780 + 970))
+    assert fork.get_formatted(Index(0, 6)) == "200"
+    assert set(fork._values) <= fork._cone
+    assert Index(20, 1) not in fork._cone
+    assert sheet.get_formatted(Index(30, 0)) == "30"
+    with pytest.raises(ValueError):
+        fork.set(Index(0, 0), "1")
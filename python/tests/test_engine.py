@@ -0,0 +1,317 @@
+from sheet import errors as err
+from sheet.engine import MANUAL, Spreadsheet
+from sheet.models import Index, Range
+
+
+def make_sheet(rows):
+    sheet = Spreadsheet()
+    for row, values in enumerate(rows):
+        for col, value in enumerate(values):
+            sheet.set(Index(row, col), value)
+    return sheet
+
+
+def column(sheet, col, nrows):
+    return [sheet.get_formatted(Index(row, col)) for row in range(nrows)]
+
+
+def test_references_follow_changes():
+    sheet = make_sheet([["1", "=A1*2", "=B1+A1"]])
+    assert sheet.get_formatted(Index(0, 2)) == "3"
+    sheet.set(Index(0, 0), "5")
+    assert sheet.get_formatted(Index(0, 2)) == "15"
+
+
+def test_functions():
+    sheet = make_sheet([["1", "x"], ["2.5", ""], ["", "#N/A"]])
+    sheet.set(Index(0, 2), "=SUM(A1:A3) + COUNT(A1:B2)")
+    sheet.set(Index(1, 2), "=ROUND(AVERAGE(A1:A3), 0)")
+    sheet.set(Index(2, 2), "=SUM(A1:B3)")
+    assert column(sheet, 2, 3) == ["5.5", "2", err.NA]
+
+
+def test_formulas_cannot_reach_python():
+    sheet = Spreadsheet()
+    sheet.set(Index(0, 0), '=__import__("os").getpid()')
+    sheet.set(Index(1, 0), "=open")
+    sheet.set(Index(2, 0), "=().__class__")
+    assert column(sheet, 0, 3) == [err.ERROR, err.NAME, err.ERROR]
+
+
+def test_array_formula_spills():
+    sheet = make_sheet([["1", "10"], ["2", "20"], ["0", "30"]])
+    sheet.set(Index(0, 2), "=A1:A3*B1:B3")
+    assert column(sheet, 2, 4) == ["10", "40", "0", ""]
+    sheet.set(Index(1, 1), "x")
+    assert column(sheet, 2, 3) == ["10", err.VALUE, "0"]
+    sheet.set(Index(0, 3), "=B1:B3/A1:A3")
+    assert sheet.get_formatted(Index(2, 3)) == err.DIV0
+
+
+def test_array_comparison_spills():
+    sheet = make_sheet([["1"], ["5"], ["x"], ["nan"]])
+    sheet.set(Index(0, 1), "=A1:A4>2")
+    sheet.set(Index(0, 2), "=A1:A4*2")
+    assert column(sheet, 1, 4) == ["False", "True", "True", "True"]
+    assert column(sheet, 2, 4) == ["2", "10", err.VALUE, err.VALUE]
+
+
+def test_blocked_spill():
+    sheet = make_sheet([["1"], ["2"], ["3"]])
+    sheet.set(Index(0, 1), "=A1:A3*2")
+    sheet.set(Index(1, 1), "in the way")
+    assert column(sheet, 1, 3) == [err.SPILL, "in the way", ""]
+    sheet.set(Index(1, 1), "")
+    assert column(sheet, 1, 3) == ["2", "4", "6"]
+
+
+def test_reference_into_spill():
+    sheet = make_sheet([["1"], ["2"]])
+    sheet.set(Index(0, 1), "=A1:A2+1")
+    sheet.set(Index(0, 2), "=B2*10")
+    assert sheet.get_formatted(Index(0, 2)) == "30"
+    sheet.set(Index(1, 0), "5")
+    assert sheet.get_formatted(Index(0, 2)) == "60"
+
+
+def test_filled_down_formulas_are_shared():
+    sheet = make_sheet([[str(row), "2", f"=A{row + 1}*B{row + 1}"] for row in range(5)])
+    assert Index(3, 2) not in sheet.cells
+    assert sheet.get_raw(Index(3, 2)) == "=A4*B4"
+    assert column(sheet, 2, 5) == ["0", "2", "4", "6", "8"]
+    sheet.set(Index(3, 0), "10")
+    assert column(sheet, 2, 5) == ["0", "2", "4", "20", "8"]
+    sheet.set(Index(2, 2), "=A3+1")
+    assert column(sheet, 2, 5) == ["0", "2", "3", "20", "8"]
+    sheet.set(Index(2, 2), "=A3*B3")
+    assert [s.span for s in sheet._shared] == [Range.parse("C1:C5")]
+
+
+def test_running_total_down_a_shared_formula():
+    rows = [["1", "=A1"]] + [["1", f"=B{row}+A{row + 1}"] for row in range(1, 3000)]
+    sheet = make_sheet(rows)
+    assert sheet.get_formatted(Index(2999, 1)) == "3000"
+    sheet.set(Index(0, 0), "5")
+    assert sheet.get_formatted(Index(2999, 1)) == "3004"
+
+
+def test_edits_only_evaluate_the_dropped_rows_of_shared_formulas(monkeypatch):
+    sheet = Spreadsheet()
+    with sheet.batch():
+        for row in range(5000):
+            sheet.set(Index(row, 0), str(row))
+            sheet.set(Index(row, 1), f"=MAX(A{row + 1}, 100)")
+    assert sheet.get_formatted(Index(4999, 1)) == "4999"
+    looked_up = []
+    lookup = sheet._lookup
+    monkeypatch.setattr(
+        sheet, "_lookup", lambda index: looked_up.append(index) or lookup(index)
+    )
+    sheet.set(Index(10, 0), "500")
+    sheet.set(Index(4000, 0), "-1")
+    assert sheet.get_formatted(Index(10, 1)) == "500"
+    assert sheet.get_formatted(Index(4000, 1)) == "100"
+    assert len(looked_up) < 20
+    # Rows added to the run weren't evaluated yet.
+    sheet.set(Index(5000, 1), "=MAX(A5001, 100)")
+    sheet.set(Index(5000, 0), "7")
+    assert sheet.get_formatted(Index(5000, 1)) == "100"
+
+
+def test_shared_rows_reached_from_another_shared_formula():
+    # A3 reads C2, whose batch also evaluates C4, which reads A3: not a cycle.
+    rows = [["", "", ""]] + [
+        [f"=SUM(C{row}:C{row})", "", f"=MAX(A{row})"] for row in range(1, 5)
+    ]
+    sheet = make_sheet(rows)
+    values = [
+        sheet.get_formatted(Index(row, col)) for row in range(5) for col in (0, 2)
+    ]
+    assert values == [
+        "",
+        "",
+        "0",
+        err.NULL,
+        err.NULL,
+        "0",
+        "0",
+        err.NULL,
+        err.NULL,
+        "0",
+    ]
+
+
+def test_bulk_set_under_range_formulas(monkeypatch):
+    rows = 2000
+    sheet = Spreadsheet()
+    with sheet.batch():
+        for row in range(rows):
+            sheet.set(Index(row, 0), str(row))
+            sheet.set(Index(row, 1), f"=COUNT(A1:A{rows}) + A{row + 1}")
+    assert sheet.get_formatted(Index(rows - 1, 1)) == str(2 * rows - 1)
+    returned = []
+    dependents = sheet.graph.dependents
+    monkeypatch.setattr(
+        sheet.graph,
+        "dependents",
+        lambda *args: returned.append(dependents(*args)) or returned[-1],
+    )
+    with sheet.batch():
+        for row in range(rows):
+            sheet.set(Index(row, 0), str(row + 1))
+    # Each formula is found once through the range, not once per cell in it.
+    assert sum(map(len, returned)) <= 2 * rows
+    assert sheet.get_formatted(Index(rows - 1, 1)) == str(2 * rows)
+
+
+def test_snapshot_sees_one_version():
+    sheet = make_sheet([["1", "=A1*2"], ["2", "=A2*2"], ["3", "=A3*2"]])
+    sheet.set(Index(0, 2), "=B1+B2+B3")
+    assert sheet.get_formatted(Index(0, 2)) == "12"
+    old = sheet.snapshot()
+    with sheet.batch():
+        sheet.set(Index(0, 0), "10")
+        sheet.set(Index(3, 1), "=A4*2")
+        # Uncommitted writes aren't visible to snapshots.
+        assert sheet.snapshot().get_formatted(Index(0, 1)) == "2"
+    assert sheet.get_formatted(Index(0, 2)) == "30"
+    assert column(old, 1, 4) == ["2", "4", "6", ""]
+    assert old.get_raw(Index(3, 1)) == ""
+    assert old.get_formatted(Index(0, 2)) == "12"
+    new = sheet.snapshot()
+    assert new.version == old.version + 1
+    assert column(new, 1, 4) == ["20", "4", "6", err.REF]
+    del old, new
+    sheet.set(Index(0, 0), "1")
+    assert sheet._history == []
+
+
+def test_snapshots_of_many_versions():
+    sheet = make_sheet([["0", "=A1*2"]])
+    snapshots = []
+    for i in range(1, 50):
+        snapshots.append(sheet.snapshot())
+        sheet.set(Index(0, 0), str(i))
+    assert [s.get_formatted(Index(0, 1)) for s in snapshots] == [
+        str(2 * i) for i in range(49)
+    ]
+    del snapshots[:40]
+    sheet.set(Index(0, 0), "x")
+    assert len(sheet._cell_history[Index(0, 0)]) == 10
+    assert snapshots[0].get_formatted(Index(0, 0)) == "40"
+
+
+def test_snapshots_are_consistent_across_threads():
+    import threading
+
+    sheet = make_sheet([["0", "0", "=A1+B1"]])
+    failures = []
+    done = threading.Event()
+
+    def read():
+        while not done.is_set():
+            snapshot = sheet.snapshot()
+            a, b, total = (snapshot.get_formatted(Index(0, col)) for col in range(3))
+            if a != b or int(total) != 2 * int(a):
+                failures.append((a, b, total))
+
+    readers = [threading.Thread(target=read) for _ in range(3)]
+    for reader in readers:
+        reader.start()
+    for i in range(1, 300):
+        with sheet.batch():
+            sheet.set(Index(0, 0), str(i))
+            sheet.set(Index(0, 1), str(i))
+    done.set()
+    for reader in readers:
+        reader.join()
+    assert failures == []
+    assert sheet.get_formatted(Index(0, 2)) == "598"
+
+
+def test_snapshots_never_read_newer_cells():
+    sheet = make_sheet([["1"]])
+    snapshot = sheet.snapshot()
+    stored = sheet.cells.stored
+
+    def write_first(physical):
+        # A writer commits between the reader's two lookups.
+        del sheet.cells.stored
+        sheet.set(Index(0, 0), "=2")
+        return stored(physical)
+
+    sheet.cells.stored = write_first
+    assert snapshot.get_raw(Index(0, 0)) == "1"
+    assert sheet.get_raw(Index(0, 0)) == "=2"
+
+
+def test_plain_text_is_dictionary_encoded():
+    regions = ["north", "south", "east", "west"]
+    sheet = make_sheet([[regions[row % 4], "=A%d" % (row + 1)] for row in range(1000)])
+    sheet.set(Index(5, 0), "3")
+    sheet.set_format(Index(5, 0), "number", "%.2f")
+    store = sheet.cells
+    assert len(store._texts) == 5
+    # Only the formatted cell is kept as a Cell; the formulas are shared.
+    assert list(store._cells) == [Index(5, 0)]
+    assert len(store) == 1000
+    assert sheet.get_raw(Index(4, 0)) == "north"
+    assert sheet.get_formatted(Index(5, 0)) == "3.00"
+    assert sheet.snapshot().get_raw(Index(999, 0)) == "west"
+    sheet.set(Index(4, 0), "")
+    assert sheet.get_raw(Index(4, 0)) == ""
+    assert sheet.get_formatted(Index(7, 1)) == "west"
+
+
+def test_subscribers_get_changed_values():
+    sheet = make_sheet([["1", "=A1+1"], ["2", "=A2+1"]])
+    everything = []
+    subscription = sheet.subscribe(everything.append)
+    column_b = []
+    sheet.subscribe(column_b.append, Range.parse("B1:B2"))
+    with sheet.batch():
+        sheet.set(Index(0, 0), "5")
+        sheet.set(Index(1, 0), "2")
+    assert everything == [
+        {Index(0, 0): "5", Index(0, 1): "6", Index(1, 0): "2", Index(1, 1): "3"}
+    ]
+    assert column_b == [{Index(0, 1): "6", Index(1, 1): "3"}]
+    sheet.set(Index(1, 0), "=1+1")
+    assert len(everything) == len(column_b) == 1
+    sheet.unsubscribe(subscription)
+    sheet.set(Index(1, 0), "7")
+    assert len(everything) == 1
+    assert column_b[-1] == {Index(1, 1): "8"}
+
+
+def test_manual_calculation():
+    sheet = make_sheet([["1", "=A1*2"], ["2", "=A2*2"], ["3", "=A3*2"]])
+    sheet.set(Index(0, 2), "=SUM(B1:B3)")
+    assert sheet.get_formatted(Index(0, 2)) == "12"
+    sheet.set_calculation(MANUAL)
+    sheet.set(Index(0, 0), "10")
+    # Only the edited cell is evaluated again until recalculating.
+    assert column(sheet, 0, 3) == ["10", "2", "3"]
+    assert sheet.get_formatted(Index(0, 2)) == "12"
+    assert sheet.stale_cells() == {Index(0, 1), Index(0, 2)}
+    before = sheet.snapshot()
+    assert sheet.recalculate() == {Index(0, 0), Index(0, 1), Index(0, 2)}
+    assert sheet.get_formatted(Index(0, 2)) == "30"
+    assert before.get_formatted(Index(0, 2)) == "12"
+    assert sheet.stale_cells() == set()
+    assert sheet.recalculate() == set()
+
+    # The next recalculation evaluates the cells in the same order.
+    chain = sheet._calc_chain
+    assert list(chain[1]) == [Index(0, 0), Index(0, 1), Index(0, 2)]
+    sheet.set(Index(0, 0), "100")
+    sheet.recalculate()
+    assert sheet._calc_chain is chain
+    assert sheet.get_formatted(Index(0, 2)) == "210"
+    # A new formula changes the graph, so the order is found again.
+    sheet.set(Index(1, 2), "=C1+1")
+    assert sheet.get_formatted(Index(1, 2)) == "211"
+    sheet.set(Index(0, 0), "0")
+    sheet.recalculate()
+    assert sheet._calc_chain is not chain
+    assert column(sheet, 2, 2) == ["10", "11"]
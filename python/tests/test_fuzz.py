@@ -0,0 +1,530 @@
+"""Random edits applied to both the engine and a reference evaluator, which
+must agree on every cell.
+
+The reference stores raw text and formats, and evaluates every formula from
+scratch each time it is read, with an interpreter of its own for the formulas
+generated here: no caches, shared formulas, kernels or indexes, and none of
+the engine's parsing, compilation or formula functions either. It only
+follows the rules formulas are documented to follow, such as reading their
+single-cell references first, and Python's arithmetic.
+
+Formulas only reference rows above their own, so there are no cycles, whose
+values depend on the order cells are read in. Inserting or deleting rows and
+columns keeps it that way.
+"""
+
+import math
+import re
+from unittest import mock
+
+import pytest
+
+from sheet import columnstats
+from sheet import errors as err
+from sheet.engine import MANUAL, Spreadsheet
+from sheet.formula import parse
+from sheet.models import Index, Range
+
+hypothesis = pytest.importorskip("hypothesis")
+st = hypothesis.strategies
+
+ROWS = 8
+COLS = 4
+CELLS = [Index(row, col) for row in range(ROWS) for col in range(COLS)]
+
+# A reference or range in the text of a formula
+REF_RE = re.compile(r"(?P<first>[A-Z]+[0-9]+)(?::(?P<last>[A-Z]+[0-9]+))?")
+
+# A token of a formula, for `ReferenceSheet`
+TOKEN_RE = re.compile(
+    r"""\s*(?:
+    (?P<string>"[^"]*")
+    |(?P<range>[A-Z]+[0-9]+:[A-Z]+[0-9]+)
+    |(?P<ref>[A-Z]+[0-9]+)(?![A-Z(])
+    |(?P<name>[A-Z]+)
+    |(?P<number>[0-9]+(?:\.[0-9]+)?)
+    |(?P<op>[-+*/(),])
+    )""",
+    re.VERBOSE,
+)
+
+NUMBER_RE = re.compile(r"[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?")
+
+
+class _Code(Exception):
+    """Makes a formula of the reference evaluate to the error code `code`."""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+def _value(text):
+    """The value a formula reads from a cell showing `text`."""
+    if text == "":
+        return None
+    if not NUMBER_RE.fullmatch(text):
+        return text
+    if re.fullmatch(r"[+-]?[0-9]+", text):
+        return int(text)
+    return float(text)
+
+
+def _key(value):
+    """Blanks, then numbers, then text ignoring case."""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, str):
+        return (2, value.casefold())
+    return (1, value)
+
+
+def _numbers(values):
+    """The numbers among `values`, raising the first error among them."""
+    result = []
+    for value in values:
+        if isinstance(value, str):
+            if value in err.ALL:
+                raise _Code(value)
+        elif value is not None:
+            result.append(value)
+    return result
+
+
+def _number(value):
+    """A single number argument."""
+    if isinstance(value, str):
+        raise _Code(value if value in err.ALL else err.VALUE)
+    if value is None:
+        raise _Code(err.ERROR)
+    return value
+
+
+def _window(values, n):
+    """The numbers in the last `n` of `values`."""
+    n = int(_number(n))
+    if n < 1:
+        raise _Code(err.NUM)
+    return _numbers(values[-n:])
+
+
+def _criterion(criterion):
+    op, operand = re.fullmatch(r"(<>|<=|>=|<|>|=)?(.*)", criterion).groups()
+    return op or "=", _key(_value(operand))
+
+
+def _countif(values, criterion):
+    return len(_selected(values, criterion))
+
+
+def _sumif(values, criterion):
+    return sum(_numbers(_selected(values, criterion)))
+
+
+def _selected(values, criterion):
+    op, key = _criterion(criterion)
+    compare = {
+        "=": lambda a, b: a == b,
+        "<>": lambda a, b: a != b,
+        "<": lambda a, b: a < b,
+        "<=": lambda a, b: a <= b,
+        ">": lambda a, b: a > b,
+        ">=": lambda a, b: a >= b,
+    }[op]
+    return [
+        value
+        for value in values
+        if (op in ("=", "<>") or _key(value)[0] == key[0]) and compare(_key(value), key)
+    ]
+
+
+def _match(value, values):
+    keys = [_key(v) for v in values]
+    if _key(value) not in keys:
+        raise _Code(err.NA)
+    return keys.index(_key(value))
+
+
+def _average(values):
+    numbers = _numbers(values)
+    if not numbers:
+        raise _Code(err.DIV0)
+    return sum(numbers) / len(numbers)
+
+
+def _median(values):
+    numbers = sorted(_numbers(values))
+    if not numbers:
+        raise _Code(err.NUM)
+    middle = len(numbers) // 2
+    if len(numbers) % 2:
+        return numbers[middle]
+    return (numbers[middle - 1] + numbers[middle]) / 2
+
+
+def _rank(value, values):
+    value = _number(value)
+    numbers = _numbers(values)
+    if value not in numbers:
+        raise _Code(err.NA)
+    return 1 + sum(1 for number in numbers if number > value)
+
+
+def _large(values, k):
+    numbers = sorted(_numbers(values), reverse=True)
+    k = math.ceil(_number(k))
+    if not 1 <= k <= len(numbers):
+        raise _Code(err.NUM)
+    return numbers[k - 1]
+
+
+# name -> function of the values of its arguments, ranges as lists
+FUNCTIONS = {
+    "SUM": lambda values: sum(_numbers(values)),
+    "AVERAGE": _average,
+    "MIN": lambda values: min(_numbers(values), default=0),
+    "MAX": lambda values: max(_numbers(values), default=0),
+    "COUNTIF": _countif,
+    "SUMIF": _sumif,
+    "MATCH": lambda value, values, mode: _match(value, values) + 1,
+    "VLOOKUP": lambda value, values, col, mode: values[_match(value, values)],
+    "MOVINGSUM": lambda values, n: sum(_window(values, n)),
+    "MOVINGMAX": lambda values: max(_numbers(values), default=0),
+    "MEDIAN": _median,
+    "RANK": _rank,
+    "LARGE": _large,
+}
+
+
+class ReferenceSheet:
+    """Evaluates every cell from scratch each time it is read."""
+
+    def __init__(self):
+        # Index -> [raw text, format type, format spec], for every cell set
+        self.cells = {}
+
+    def set(self, index, raw):
+        self.cells[index] = [raw] + self.cells.get(index, ["", "default", None])[1:]
+
+    def set_format(self, index, type, spec):
+        raw = self.cells.get(index, [""])[0]
+        self.cells[index] = [raw, type, spec]
+
+    def get_raw(self, index):
+        return self.cells.get(index, [""])[0]
+
+    def insert_rows(self, row, count):
+        self._shift(0, row, count)
+
+    def delete_rows(self, row, count):
+        self._shift(0, row, -count)
+
+    def insert_columns(self, col, count):
+        self._shift(1, col, count)
+
+    def delete_columns(self, col, count):
+        self._shift(1, col, -count)
+
+    def _shift(self, axis, at, count):
+        """Move every cell, and rewrite the text of every formula."""
+
+        def moved(index, inside=None):
+            position = index[axis]
+            if position >= at:
+                if count < 0 and position < at - count:
+                    if inside is None:
+                        return None
+                    position = at + inside
+                else:
+                    position += count
+            return (
+                Index(position, index.col) if axis == 0 else Index(index.row, position)
+            )
+
+        def rewrite(match):
+            if match["last"] is None:
+                index = moved(Index.parse(match["first"]))
+                return "#REF!" if index is None else str(index)
+            first = moved(Index.parse(match["first"]), 0)
+            last = moved(Index.parse(match["last"]), -1)
+            return "#REF!" if first[axis] > last[axis] else f"{first}:{last}"
+
+        cells = {}
+        for index, (raw, type, spec) in self.cells.items():
+            index = moved(index)
+            if index is None:
+                continue
+            if raw.startswith("="):
+                raw = REF_RE.sub(rewrite, raw)
+            cells[index] = [raw, type, spec]
+        self.cells = cells
+
+    def get_formatted(self, index):
+        raw, type, spec = self.cells.get(index, ["", "default", None])
+        if raw.startswith("="):
+            try:
+                value = self._evaluate(raw[1:])
+                value = "0" if value is None else str(value)
+            except _Code as e:
+                value = e.code
+        else:
+            value = raw
+        if type == "default" or value == "" or value in err.ALL:
+            return value
+        try:
+            return spec % float(value)
+        except ValueError:
+            return err.VALUE
+
+    def _read(self, index):
+        """The value of a single-cell reference to `index`."""
+        text = self.get_formatted(index)
+        if text == "":
+            raise _Code(err.NULL if index in self.cells else err.REF)
+        if text in err.ALL:
+            raise _Code(text)
+        return _value(text)
+
+    def _evaluate(self, text):
+        if "#REF!" in text:
+            raise _Code(err.REF)
+        tokens = []
+        pos = 0
+        while pos < len(text.rstrip()):
+            match = TOKEN_RE.match(text, pos)
+            tokens.append((match.lastgroup, match[match.lastgroup]))
+            pos = match.end()
+        # Single-cell references are read before anything is evaluated.
+        refs = {
+            token: self._read(Index.parse(token))
+            for kind, token in tokens
+            if kind == "ref"
+        }
+        try:
+            value, rest = self._sum(tokens, refs)
+        except ZeroDivisionError:
+            raise _Code(err.DIV0)
+        except TypeError:
+            raise _Code(err.ERROR)
+        assert not rest, text
+        return value
+
+    def _sum(self, tokens, refs):
+        value, tokens = self._product(tokens, refs)
+        while tokens and tokens[0][1] in "+-":
+            op = tokens[0][1]
+            other, tokens = self._product(tokens[1:], refs)
+            value = value + other if op == "+" else value - other
+        return value, tokens
+
+    def _product(self, tokens, refs):
+        value, tokens = self._unary(tokens, refs)
+        while tokens and tokens[0][1] in "*/":
+            op = tokens[0][1]
+            other, tokens = self._unary(tokens[1:], refs)
+            value = value * other if op == "*" else value / other
+        return value, tokens
+
+    def _unary(self, tokens, refs):
+        if tokens[0][1] == "-":
+            value, tokens = self._unary(tokens[1:], refs)
+            return -value, tokens
+        kind, token = tokens[0]
+        if kind == "number":
+            return (float(token) if "." in token else int(token)), tokens[1:]
+        if kind == "string":
+            return token[1:-1], tokens[1:]
+        if kind == "ref":
+            return refs[token], tokens[1:]
+        if kind == "range":
+            cells = Range.parse(token)
+            values = [
+                _value(self.get_formatted(Index(row, cells.first.col)))
+                for row in range(cells.first.row, cells.last.row + 1)
+            ]
+            return values, tokens[1:]
+        assert kind == "name" and tokens[1][1] == "(", tokens
+        tokens = tokens[2:]
+        args = []
+        while tokens[0][1] != ")":
+            arg, tokens = self._sum(tokens, refs)
+            args.append(arg)
+            if tokens[0][1] == ",":
+                tokens = tokens[1:]
+        return FUNCTIONS[token](*args), tokens[1:]
+
+
+def _label(row, col):
+    return str(Index(row, col))
+
+
+@st.composite
+def formulas(draw, row):
+    """A formula for a cell of `row`, reading only rows above it."""
+    above = st.integers(0, row - 1)
+    col = st.integers(0, COLS - 1)
+    ref = st.builds(_label, above, col)
+    first = draw(above)
+    last = draw(st.integers(first, row - 1))
+    rng_col = draw(col)
+    rng = f"{_label(first, rng_col)}:{_label(last, rng_col)}"
+    number = st.sampled_from(["0", "1", "2", "2.5", "-3"])
+    template = draw(
+        st.sampled_from(
+            [
+                "{a}+{b}",
+                "{a}*{n}-{b}",
+                "{a}/{b}",
+                "-{a}",
+                "SUM({r})",
+                "AVERAGE({r})",
+                "MIN({r})+MAX({r})",
+                'COUNTIF({r}, ">{n}")',
+                'SUMIF({r}, "<{n}")',
+                "MATCH({a}, {r}, 0)",
+                "VLOOKUP({a}, {r}, 1, 0)",
+                "MOVINGSUM({r}, {n})",
+                "MOVINGMAX({r})",
+                "MEDIAN({r})",
+                "RANK({a}, {r})",
+                "LARGE({r}, 2)",
+            ]
+        )
+    )
+    return "=" + template.format(a=draw(ref), b=draw(ref), r=rng, n=draw(number))
+
+
+@st.composite
+def values(draw, index):
+    kinds = ["number", "text", "blank"] + (["formula"] * 3 if index.row else [])
+    kind = draw(st.sampled_from(kinds))
+    if kind == "number":
+        return str(draw(st.sampled_from([0, 1, 2, 3, 7, -1, 2.5, 10])))
+    if kind == "text":
+        return draw(st.sampled_from(["x", "X", "y", "#N/A"]))
+    if kind == "blank":
+        return ""
+    return draw(formulas(index.row))
+
+
+@st.composite
+def set_op(draw):
+    index = draw(st.sampled_from(CELLS))
+    return ("set", index, draw(values(index)))
+
+
+@st.composite
+def fill_op(draw):
+    """The same relative formula filled down part of a column."""
+    col = draw(st.integers(0, COLS - 1))
+    first = draw(st.integers(1, ROWS - 1))
+    last = draw(st.integers(first, ROWS - 1))
+    formula = draw(formulas(1))
+    offsets = [Index(row - 1, 0) for row in range(first, last + 1)]
+    return ("fill", col, first, formula, offsets)
+
+
+FORMATS = [("default", None), ("number", "%.0f"), ("number", "%.2f")]
+
+STRUCTURE = ["insert_rows", "delete_rows", "insert_columns", "delete_columns"]
+
+operations = st.one_of(
+    set_op(),
+    set_op(),
+    fill_op(),
+    st.tuples(st.just("set_format"), st.sampled_from(CELLS), st.sampled_from(FORMATS)),
+    st.tuples(st.just("batch"), st.lists(set_op(), max_size=6)),
+    st.tuples(st.just("read"), st.lists(st.sampled_from(CELLS), max_size=8)),
+    st.tuples(st.sampled_from(STRUCTURE), st.integers(0, ROWS - 1), st.integers(1, 2)),
+)
+
+
+def apply(sheet, op):
+    kind = op[0]
+    if kind == "set":
+        sheet.set(op[1], op[2])
+    elif kind == "fill":
+        _, col, first, formula, offsets = op
+        parsed = parse(formula[1:])
+        for row, offset in enumerate(offsets, first):
+            sheet.set(Index(row, col), "=" + parsed.render(offset))
+    elif kind == "set_format":
+        sheet.set_format(op[1], *op[2])
+    elif kind == "batch":
+        if isinstance(sheet, Spreadsheet):
+            with sheet.batch():
+                for inner in op[1]:
+                    apply(sheet, inner)
+        else:
+            for inner in op[1]:
+                apply(sheet, inner)
+    elif kind in STRUCTURE:
+        getattr(sheet, kind)(op[1], op[2])
+    elif kind == "read":
+        for index in op[1]:
+            sheet.get_formatted(index)
+
+
+def check(sheet, reference):
+    for index in CELLS:
+        expected = reference.get_formatted(index)
+        assert sheet.get_formatted(index) == expected, f"{index}"
+        assert sheet.get_raw(index) == reference.get_raw(index), f"{index}"
+    for col in range(COLS):
+        column = [reference.get_formatted(Index(row, col)) for row in range(ROWS)]
+        for first, last in [(0, ROWS - 1), (1, 5)]:
+            cells = Range(Index(first, col), Index(last, col))
+            expected = columnstats.summarize(column[first : last + 1])
+            # Blocks are added up in another order than the rows.
+            expected = expected._replace(total=pytest.approx(expected.total))
+            assert sheet.summarize(cells) == expected, f"{cells}"
+
+
+@hypothesis.settings(max_examples=300, deadline=None)
+@hypothesis.given(st.lists(operations, max_size=25))
+def test_engine_agrees_with_reference(ops):
+    # Reading every cell after every change checks that each change
+    # invalidates everything it should.
+    sheet = Spreadsheet()
+    reference = ReferenceSheet()
+    # Small blocks of column statistics, so that ranges span several.
+    with mock.patch.object(columnstats, "BLOCK", 3):
+        for op in ops:
+            apply(sheet, op)
+            apply(reference, op)
+            check(sheet, reference)
+
+
+@hypothesis.settings(max_examples=100, deadline=None)
+@hypothesis.given(st.lists(operations, max_size=12))
+def test_snapshots_agree_with_reference(ops):
+    sheet = Spreadsheet()
+    reference = ReferenceSheet()
+    for op in ops:
+        snapshot = sheet.snapshot()
+        before = {index: reference.get_formatted(index) for index in CELLS}
+        apply(sheet, op)
+        apply(reference, op)
+        assert {index: snapshot.get_formatted(index) for index in CELLS} == before
+    check(sheet, reference)
+
+
+@hypothesis.settings(max_examples=100, deadline=None)
+@hypothesis.given(st.lists(st.one_of(operations, st.just(("recalculate",)))))
+def test_recalculating_agrees_with_reference(ops):
+    # Values read in manual calculation may be out of date, but none may be
+    # left so once recalculated.
+    sheet = Spreadsheet()
+    reference = ReferenceSheet()
+    sheet.set_calculation(MANUAL)
+    for op in ops:
+        if op[0] == "recalculate":
+            sheet.recalculate()
+            continue
+        apply(sheet, op)
+        apply(reference, op)
+        for index in CELLS:
+            sheet.get_formatted(index)
+    sheet.recalculate()
+    assert sheet.stale_cells() == set()
+    check(sheet, reference)
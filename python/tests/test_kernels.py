@@ -0,0 +1,93 @@
+from sheet import engine
+from sheet import errors as err
+from sheet.engine import Spreadsheet
+from sheet.models import Index
+
+ROWS = [
+    ["6", "3", "1"],
+    ["1", "0", "1"],
+    ["x", "2", "1"],
+    ["", "2", "1"],
+    ["=1/0", "2", "1"],
+    ["2.5", "=A4", "1"],
+    ["4", "2", "1"],
+    ["9", "3"],
+]
+
+
+def filled_sheet():
+    sheet = Spreadsheet()
+    for row, values in enumerate(ROWS):
+        for col, value in enumerate(values):
+            sheet.set(Index(row, col), value)
+    for row in range(len(ROWS)):
+        sheet.set(Index(row, 3), f"=A{row + 1}/B{row + 1}-C{row + 1}")
+    sheet.set_format(Index(6, 3), "number", "%.2f")
+    return sheet
+
+
+def column(sheet, col, nrows):
+    return [sheet.get_formatted(Index(row, col)) for row in range(nrows)]
+
+
+def test_kernel_matches_row_by_row(monkeypatch):
+    sheet = filled_sheet()
+    assert sheet._shared.find(Index(3, 3)) is not None
+    compiled = column(sheet, 3, len(ROWS))
+    assert compiled == [
+        "1.0",
+        err.DIV0,
+        err.ERROR,
+        err.NULL,
+        err.DIV0,
+        err.NULL,
+        "1.00",
+        err.REF,
+    ]
+    monkeypatch.setattr(engine, "kernel", lambda formula: None)
+    assert column(filled_sheet(), 3, len(ROWS)) == compiled
+
+
+def test_kernel_recalculates_changed_rows():
+    sheet = filled_sheet()
+    column(sheet, 3, len(ROWS))
+    sheet.set(Index(1, 1), "4")
+    sheet.set(Index(2, 0), "8")
+    assert column(sheet, 3, 3) == ["1.0", "-0.75", "3.0"]
+
+
+def test_kernel_reached_from_another_shared_formula():
+    # A3 reads C2, whose kernel also computes C4, which reads A3: not a cycle.
+    sheet = Spreadsheet()
+    for row in range(1, 5):
+        sheet.set(Index(row, 0), f"=SUM(C{row}:C{row})")
+        sheet.set(Index(row, 2), f"=A{row}+A{row}")
+    sheet.set(Index(0, 0), "1")
+    values = [
+        sheet.get_formatted(Index(row, col)) for row in range(5) for col in (0, 2)
+    ]
+    assert values == ["1", "", "0", "2", "2", "0", "0", "4", "4", "0"]
+
+
+def test_kernel_reads_only_the_changed_rows(monkeypatch):
+    sheet = Spreadsheet()
+    with sheet.batch():
+        for row in range(5000):
+            sheet.set(Index(row, 0), str(row))
+            sheet.set(Index(row, 1), f"=A{row + 1}*2")
+    assert sheet.get_formatted(Index(4999, 1)) == "9998"
+    read = []
+    get_array = sheet.get_array
+    monkeypatch.setattr(
+        sheet,
+        "get_array",
+        lambda cell_range, visited: read.append(cell_range)
+        or get_array(cell_range, visited),
+    )
+    with sheet.batch():
+        sheet.set(Index(10, 0), "1")
+        sheet.set(Index(11, 0), "2")
+        sheet.set(Index(4000, 0), "3")
+    assert column(sheet, 1, 12)[10:] == ["2", "4"]
+    assert sheet.get_formatted(Index(4000, 1)) == "6"
+    assert sorted(str(cell_range) for cell_range in read) == ["A11:A12", "A4001:A4001"]
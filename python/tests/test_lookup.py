@@ -0,0 +1,91 @@
+from sheet import errors as err
+from sheet.engine import Spreadsheet
+from sheet.lookup import ColumnIndex
+from sheet.models import Index
+
+
+def fill(sheet, rows):
+    with sheet.batch():
+        for row, values in enumerate(rows):
+            for col, value in enumerate(values):
+                sheet.set(Index(row, col), value)
+
+
+def column(sheet, col, nrows):
+    return [sheet.get_formatted(Index(row, col)) for row in range(nrows)]
+
+
+def test_vlookup():
+    sheet = Spreadsheet()
+    fill(sheet, [["10", "ten"], ["20", "twenty"], ["30", "thirty"]])
+    sheet.set(Index(0, 3), "=VLOOKUP(20, A1:B3, 2, False)")
+    sheet.set(Index(1, 3), "=VLOOKUP(25, A1:B3, 2)")
+    sheet.set(Index(2, 3), "=VLOOKUP(25, A1:B3, 2, False)")
+    sheet.set(Index(3, 3), "=VLOOKUP(20, A1:B3, 3, False)")
+    assert sheet.get_formatted(Index(0, 3)) == "twenty"
+    assert sheet.get_formatted(Index(1, 3)) == "twenty"
+    assert sheet.get_formatted(Index(2, 3)) == err.NA
+    assert sheet.get_formatted(Index(3, 3)) == err.REF
+
+
+def test_match_and_xlookup():
+    sheet = Spreadsheet()
+    fill(sheet, [["apple", "1"], ["Pear", "2"], ["fig", "3"]])
+    sheet.set(Index(0, 2), '=MATCH("pear", A1:A3, 0)')
+    sheet.set(Index(1, 2), '=XLOOKUP("FIG", A1:A3, B1:B3)')
+    sheet.set(Index(2, 2), '=XLOOKUP("kiwi", A1:A3, B1:B3, "none")')
+    sheet.set(Index(3, 2), "=MATCH(2.5, B1:B3)")
+    assert sheet.get_formatted(Index(0, 2)) == "2"
+    assert sheet.get_formatted(Index(1, 2)) == "3"
+    assert sheet.get_formatted(Index(2, 2)) == "none"
+    assert sheet.get_formatted(Index(3, 2)) == "2"
+
+
+def test_lookup_sees_changes():
+    sheet = Spreadsheet()
+    fill(sheet, [["a"], ["b"], ["c"], ["=A1"]])
+    sheet.set(Index(0, 1), '=MATCH("x", A1:A4, 0)')
+    sheet.set(Index(1, 1), '=MATCH("a", A2:A4, 0)')
+    assert sheet.get_formatted(Index(0, 1)) == err.NA
+    assert sheet.get_formatted(Index(1, 1)) == "3"
+    sheet.set(Index(2, 0), "x")
+    assert sheet.get_formatted(Index(0, 1)) == "3"
+    sheet.set(Index(0, 0), "z")
+    assert sheet.get_formatted(Index(1, 1)) == err.NA
+
+
+def test_filled_down_lookups_share_one_index(monkeypatch):
+    rows = 2000
+    sheet = Spreadsheet()
+    with sheet.batch():
+        for row in range(rows):
+            sheet.set(Index(row, 0), str(rows - row))
+            sheet.set(Index(row, 1), f"=MATCH({rows - row}, A1:A{rows}, 0)")
+            sheet.set(Index(row, 2), f"=MATCH(A{row + 1}, A{row + 1}:A{row + 10}, 0)")
+    assert Index(1, 2) not in sheet.cells
+    read = []
+    real_read = ColumnIndex._read
+
+    def counting_read(index, first_row, last_row, visited_cells):
+        read.append(last_row - first_row + 1)
+        return real_read(index, first_row, last_row, visited_cells)
+
+    monkeypatch.setattr(ColumnIndex, "_read", counting_read)
+    assert column(sheet, 1, rows) == [str(row + 1) for row in range(rows)]
+    assert column(sheet, 2, rows) == ["1"] * rows
+    # Every row of column A was read into the index once.
+    assert sum(read) == rows + 9
+    sheet.set(Index(0, 0), "0")
+    assert column(sheet, 1, 2) == [err.NA, "2"]
+    assert sum(read) == rows + 9
+
+
+def test_rows_of_an_index_outside_the_range_are_not_circular():
+    sheet = Spreadsheet()
+    # A2 and A3 are stored as one shared formula, reading the row above.
+    sheet.set(Index(1, 0), "=MATCH(1, A1:A1, 0)")
+    sheet.set(Index(2, 0), "=MATCH(1, A2:A2, 0)")
+    assert column(sheet, 0, 3) == ["", err.NA, err.NA]
+    sheet.set(Index(0, 0), "1")
+    # Updating the index for A2 refreshes A3 too, which reads A2.
+    assert column(sheet, 0, 3) == ["1", "1", "1"]
@@ -1,4 +1,6 @@
-from sheet.models import Index
+import pytest
+
+from sheet.models import Index, Range
 
 
 def test_parse_roundtrip():
@@ -7,3 +9,18 @@ def test_parse_roundtrip():
             i = Index(row=row, col=col)
             s = str(i)
             assert Index.parse(s) == i
+
+
+def test_parse_rejects_invalid_labels():
+    assert Index.parse("aA7") == Index(6, 26)
+    for label in ["", "A", "12", "AB1", "A1B", " A1", "A-1", "A١"]:
+        with pytest.raises(ValueError):
+            Index.parse(label)
+
+
+def test_range_indices():
+    cells = Range.parse("B2:C4")
+    assert list(cells.indices) == [
+        Index(row, col) for row in range(1, 4) for col in range(1, 3)
+    ]
+    assert all(type(index) is Index for index in cells.indices)
@@ -0,0 +1,68 @@
+from sheet import errors as err
+from sheet import moving
+from sheet.engine import Spreadsheet
+from sheet.models import Index
+
+
+def test_moving_aggregates():
+    sheet = Spreadsheet()
+    for row, value in enumerate(["4", "x", "1", "5", "", "2"]):
+        sheet.set(Index(row, 0), value)
+    texts = [
+        "=MOVINGSUM(A1:A6, 3)",
+        "=MOVINGAVG(A1:A6, 4)",
+        "=MOVINGMIN(A1:A4)",
+        "=MOVINGMAX(A1:A6, 2)",
+        "=MOVINGAVG(A5:A5)",
+        "=MOVINGSUM(A1:A6, 0)",
+        "=MOVINGMAX(A1:A6 * 2, 3)",
+    ]
+    for row, text in enumerate(texts):
+        sheet.set(Index(row, 5), text)
+    assert [sheet.get_formatted(Index(row, 5)) for row in range(len(texts))] == [
+        "7",
+        "2.6666666666666665",
+        "1",
+        "2",
+        err.DIV0,
+        err.NUM,
+        "10",
+    ]
+    sheet.set(Index(4, 0), "#N/A")
+    assert sheet.get_formatted(Index(0, 5)) == err.NA
+
+
+def test_windows_slide_down_a_column(monkeypatch):
+    sheet = Spreadsheet()
+    rows = 1000
+    with sheet.batch():
+        for row in range(rows):
+            sheet.set(Index(row, 0), str(row % 7))
+        for row in range(9, rows):
+            window = f"A{row - 8}:A{row + 1}"
+            sheet.set(Index(row, 1), f"=MOVINGAVG({window})")
+            sheet.set(Index(row, 2), f"=MOVINGMAX({window})")
+            sheet.set(Index(row, 3), f"=AVERAGE({window})")
+            sheet.set(Index(row, 4), f"=MAX({window})")
+    leaves = []
+    real_leaf = moving._leaf
+
+    def counting_leaf(key):
+        leaves.append(key)
+        return real_leaf(key)
+
+    monkeypatch.setattr(moving, "_leaf", counting_leaf)
+
+    def column(col):
+        return [sheet.get_formatted(Index(row, col)) for row in range(9, rows)]
+
+    assert column(1) == column(3)
+    assert column(2) == column(4)
+    # Each value went into at most one prefix and one suffix per function.
+    assert len(leaves) <= 4 * rows
+    del leaves[:]
+    sheet.set(Index(500, 0), "100")
+    assert column(1) == column(3)
+    assert column(2) == column(4)
+    # Only the block of 10 rows holding the edited value was recomputed.
+    assert len(leaves) == 4 * 10
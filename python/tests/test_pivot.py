@@ -0,0 +1,77 @@
+import pytest
+
+from sheet import errors as err
+from sheet.engine import Spreadsheet
+from sheet.models import Index, Range
+
+
+def block(sheet, cells):
+    first, last = Range.parse(cells)
+    return [
+        [sheet.get_formatted(Index(row, col)) for col in range(first.col, last.col + 1)]
+        for row in range(first.row, last.row + 1)
+    ]
+
+
+def test_pivot_follows_its_source():
+    sheet = Spreadsheet()
+    data = [
+        ["east", "a", "10"],
+        ["west", "a", "5"],
+        ["East", "b", "x"],
+        ["east", "a", "2.5"],
+        ["", "", "7"],
+    ]
+    with sheet.batch():
+        for row, values in enumerate(data):
+            for col, value in enumerate(values):
+                sheet.set(Index(row, col), value)
+    summary = sheet.pivot(
+        Range.parse("A1:C6"),
+        keys=[0, 1],
+        values=[(2, "sum"), (2, "COUNT"), (2, "MAX"), (2, "AVERAGE")],
+        target=Index(0, 4),
+    )
+    assert block(sheet, "E1:J4") == [
+        ["east", "a", "12.5", "2", "10", "6.25"],
+        ["west", "a", "5", "1", "5", "5.0"],
+        ["East", "b", "0", "0", "0", err.DIV0],
+        ["", "", "", "", "", ""],
+    ]
+    # Moving a row between groups rewrites those groups only.
+    written = []
+    real_set = sheet.set
+    sheet.set = lambda index, raw: written.append(str(index)) or real_set(index, raw)
+    real_set(Index(0, 1), "b")
+    assert block(sheet, "E1:J4") == [
+        ["east", "a", "2.5", "1", "2.5", "2.5"],
+        ["west", "a", "5", "1", "5", "5.0"],
+        ["East", "b", "10", "1", "10", "10.0"],
+        ["", "", "", "", "", ""],
+    ]
+    assert sorted(written) == sorted(
+        f"{col}{row}" for col in "EFGHIJ" for row in (1, 3)
+    )
+    # An emptied group's row goes, and the rows below move up.
+    real_set(Index(1, 0), "east")
+    real_set(Index(5, 0), "north")
+    real_set(Index(5, 2), "#N/A")
+    assert block(sheet, "E1:J4") == [
+        ["east", "a", "7.5", "2", "5", "3.75"],
+        ["East", "b", "10", "1", "10", "10.0"],
+        ["north", "", err.NA, err.NA, err.NA, err.NA],
+        ["", "", "", "", "", ""],
+    ]
+    sheet.remove_pivot(summary)
+    real_set(Index(5, 0), "")
+    assert block(sheet, "E3:E3") == [["north"]]
+
+
+def test_pivot_checks_its_arguments():
+    sheet = Spreadsheet()
+    with pytest.raises(ValueError):
+        sheet.pivot(Range.parse("A1:B9"), [0], [(2, "SUM")], Index(0, 3))
+    with pytest.raises(ValueError):
+        sheet.pivot(Range.parse("A1:B9"), [0], [(1, "MEDIAN")], Index(0, 3))
+    with pytest.raises(ValueError):
+        sheet.pivot(Range.parse("A1:B9"), [0], [(1, "SUM")], Index(5, 1))
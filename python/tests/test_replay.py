@@ -0,0 +1,93 @@
+import curses
+import io
+
+from sheet import replay
+from sheet.engine import MANUAL, Spreadsheet
+from sheet.models import Index
+from sheet.views import Viewer
+from sheet.workbook import Workbook
+
+KEYS = [
+    curses.KEY_DOWN,
+    curses.KEY_DOWN,
+    curses.KEY_RIGHT,
+    ord("4"),
+    ord("2"),
+    10,
+    curses.KEY_UP,
+    6,  # ^F
+    6,  # ^F: 1.23
+    25,  # ^Y, with nothing copied
+]
+
+
+def record(keys, sheet=None):
+    trace = io.StringIO()
+    recorder = replay.Recorder(trace)
+    with replay._headless():
+        sheet = Spreadsheet() if sheet is None else sheet
+        viewer = Viewer(sheet, replay.HeadlessScreen(), recorder=recorder)
+        viewer.measure()
+        viewer.handle_keys(keys)
+    recorder.close()
+    trace.seek(0)
+    return replay.read_trace(trace)
+
+
+def test_record_and_replay():
+    trace = record(KEYS)
+    assert [entry["type"] for entry in trace] == [
+        "navigate",
+        "navigate",
+        "navigate",
+        "edit",
+        "edit",
+        "edit",
+        "navigate",
+        "format",
+        "format",
+        "paste",
+    ]
+    assert trace[5]["calls"] == [["set", "B3", "42"]]
+    assert trace[8]["calls"] == [["set_format", "B3", "number", "%0.2f"]]
+
+    sheet = Spreadsheet()
+    latencies, failed, diverged = replay.replay(trace, sheet)
+    assert (failed, diverged) == (0, 0)
+    assert sorted((kind, len(times)) for kind, times in latencies.items()) == [
+        ("edit", 3),
+        ("format", 2),
+        ("navigate", 4),
+        ("paste", 1),
+    ]
+    assert sheet.get_raw(Index(2, 1)) == "42"
+    assert replay.report(latencies).splitlines()[1].startswith("navigate       4")
+
+    sheet.set(Index(2, 1), "1")
+    assert replay.replay(trace[:6], sheet)[2] == 0
+    assert replay.replay(trace[8:9], Spreadsheet())[2] == 1
+
+
+def test_recalculate_key():
+    sheet = Spreadsheet()
+    sheet.set(Index(0, 0), "1")
+    sheet.set(Index(1, 0), "=A1+1")
+    sheet.get_formatted(Index(1, 0))
+    sheet.set_calculation(MANUAL)
+    keys = [ord("5"), 10, 5]  # ^E
+    trace = record(keys, sheet)
+    assert [entry["type"] for entry in trace] == ["edit", "edit", "recalc"]
+    assert trace[2]["calls"] == [["recalculate"]]
+    assert sheet.get_formatted(Index(1, 0)) == "6"
+
+
+def test_next_sheet_key():
+    book = Workbook(["Data", "Summary"])
+    book["Data"].set(Index(0, 0), "2")
+    keys = [curses.KEY_DOWN, 14, ord("="), ord("D"), ord("a"), ord("t"), ord("a")]
+    keys += [ord("!"), ord("A"), ord("1"), 10, 14]  # ^N, edit, ^N
+    trace = record(keys, book["Data"])
+    assert trace[1]["type"] == trace[-1]["type"] == "navigate"
+    assert trace[-2]["calls"] == [["set", "A1", "=Data!A1"]]
+    assert book["Summary"].get_formatted(Index(0, 0)) == "2"
+    assert book["Data"].get_raw(Index(1, 0)) == ""
@@ -0,0 +1,76 @@
+import asyncio
+
+from sheet.engine import Spreadsheet
+from sheet.server import SheetClient, SheetServer
+
+
+def run_with_server(tmp_path, scenario):
+    async def main():
+        sheet = Spreadsheet()
+        path = str(tmp_path / "sheet.sock")
+        listener = await SheetServer(sheet).start_unix(path)
+        async with listener:
+            clients = [await SheetClient.connect_unix(path) for _ in range(2)]
+            try:
+                return await asyncio.wait_for(scenario(*clients), timeout=5)
+            finally:
+                for client in clients:
+                    await client.close()
+
+    return asyncio.run(main())
+
+
+def test_batch_and_get_block(tmp_path):
+    async def scenario(writer, reader):
+        responses = await writer.batch(
+            [
+                {"op": "set", "cells": {"A1": "2", "B1": "=A1*10"}},
+                {"op": "set", "cells": {"A2": "3", "B2": "=A2*10"}},
+                {"op": "get", "range": "A1:B2"},
+            ]
+        )
+        assert [r.get("ok") for r in responses[:2]] == [True, True]
+        assert responses[2]["values"] == [["2", "20"], ["3", "30"]]
+        block = await reader.request("get_raw", range="B1:B2")
+        assert block["values"] == [["=A1*10"], ["=A2*10"]]
+        bad = await reader.request("get", range="nope")
+        assert "error" in bad
+
+    run_with_server(tmp_path, scenario)
+
+
+def test_subscribers_are_notified_of_changes(tmp_path):
+    async def scenario(writer, watcher):
+        await writer.request("set", cells={"A1": "1", "B1": "=A1+1", "C1": "x"})
+        initial = await watcher.request("subscribe", range="B1:B5")
+        assert initial["values"] == [["2"], [""], [""], [""], [""]]
+        # Pipelined: both writes are sent before either response arrives.
+        await asyncio.gather(
+            writer.request("set", cells={"A1": "5"}),
+            writer.request("set", cells={"C1": "y"}),
+        )
+        assert await watcher.notifications.get() == {"B1": "6"}
+        assert watcher.notifications.empty()
+
+    run_with_server(tmp_path, scenario)
+
+
+def test_bad_requests_get_errors(tmp_path):
+    async def scenario(client, other):
+        responses = await client.batch(
+            [
+                {"op": "set", "cells": {"A1": "1"}},
+                {"op": "set", "cells": [1]},
+                {"op": "get", "range": 5},
+                {"op": "set_format", "range": "A1", "type": "number", "spec": "%.2f"},
+            ]
+        )
+        assert ["error" in r for r in responses] == [True, True, True, False]
+        # The first write was in the same group as a bad one, so wasn't
+        # applied, and the connection is still usable.
+        values = await client.request("get", range="A1")
+        assert values["values"] == [[""]]
+        await client.request("set", cells={"A1": 2})
+        assert (await other.request("get", range="A1"))["values"] == [["2.00"]]
+
+    run_with_server(tmp_path, scenario)
@@ -0,0 +1,75 @@
+import pytest
+
+from sheet import errors as err
+from sheet import replay
+from sheet.models import Index, Range
+from sheet.sharding import ShardedSpreadsheet
+from sheet.views import Viewer
+
+
+@pytest.fixture
+def sheet():
+    with ShardedSpreadsheet(workers=3, block_rows=2) as sheet:
+        yield sheet
+
+
+def test_references_across_shards(sheet):
+    with sheet.batch():
+        for row in range(10):
+            sheet.set(Index(row, 0), str(row + 1))
+        sheet.set(Index(0, 1), "=A1")
+        for row in range(1, 10):
+            sheet.set(Index(row, 1), f"=B{row}+A{row + 1}")
+    sheet.prefetch(Range.parse("A1:B10"))
+    assert sheet.get_formatted(Index(9, 1)) == "55"
+    sheet.set(Index(0, 0), "11")
+    assert sheet.get_formatted(Index(9, 1)) == "65"
+    assert sheet.get_raw(Index(9, 1)) == "=B9+A10"
+
+
+def test_ranges_across_shards(sheet):
+    with sheet.batch():
+        for row in range(6):
+            sheet.set(Index(row, 0), str(row))
+        sheet.set(Index(0, 1), "=SUM(A1:A6)")
+        sheet.set(Index(0, 2), "=A1:A6*2")
+    assert sheet.get_formatted(Index(0, 1)) == "15"
+    assert sheet.get_formatted(Index(1, 2)) == "2"
+    assert len(sheet._range_readers) == 2
+    sheet.set(Index(5, 0), "10")
+    # Only the copy of the changed block was dropped.
+    assert len(sheet._range_readers) == 1
+    assert sheet.get_formatted(Index(0, 1)) == "20"
+
+
+def test_circular_reference_across_shards(sheet):
+    sheet.set(Index(0, 0), "=A5")
+    sheet.set(Index(4, 0), "=A1")
+    assert sheet.get_formatted(Index(0, 0)) == err.CIRCULAR_REFERENCE
+
+
+def test_prefetch(sheet):
+    with sheet.batch():
+        for row in range(5):
+            sheet.set(Index(row, 0), str(row))
+            sheet.set(Index(row, 1), f"=A{row + 1}*10")
+    sheet.prefetch(Range.parse("A1:B5"))
+    assert [sheet.get_formatted(Index(row, 1)) for row in range(5)] == [
+        "0",
+        "10",
+        "20",
+        "30",
+        "40",
+    ]
+
+
+def test_filters_are_not_supported(sheet):
+    sheet.set(Index(1, 0), "5")
+    sheet.set(Index(6, 1), "=A2")
+    assert sheet.last_row() == 6
+    assert sheet.last_row(0) == 1
+    with replay._headless():
+        viewer = Viewer(sheet, replay.HeadlessScreen())
+        viewer.apply_filter(">1")
+    assert viewer.row_map is None
+    assert viewer.message == "Columns can't be searched in a sharded sheet"
@@ -0,0 +1,64 @@
+from sheet import errors as err
+from sheet.engine import Spreadsheet
+from sheet.lookup import ColumnIndex
+from sheet.models import Index
+
+
+def formulas(sheet, *texts):
+    for row, text in enumerate(texts):
+        sheet.set(Index(row, 5), text)
+    return [sheet.get_formatted(Index(row, 5)) for row in range(len(texts))]
+
+
+def test_order_statistics():
+    sheet = Spreadsheet()
+    for row, value in enumerate(["7", "1", "x", "", "4", "10"]):
+        sheet.set(Index(row, 0), value)
+    assert formulas(
+        sheet,
+        "=MEDIAN(A1:A6)",
+        "=MEDIAN(A1:A6, 2)",
+        "=PERCENTILE(A1:A6, 0.25)",
+        "=SMALL(A1:A6, 1)",
+        "=LARGE(A1:A6, 2)",
+        "=LARGE(A1:A6, 5)",
+        "=RANK(7, A1:A6)",
+        "=RANK(7, A1:A6, 1)",
+        "=RANK(2, A1:A6)",
+        "=MEDIAN(B1:B6)",
+    ) == ["5.5", "4", "3.25", "1", "7", err.NUM, "2", "3", err.NA, err.NUM]
+    sheet.set(Index(2, 0), "#N/A")
+    assert sheet.get_formatted(Index(0, 5)) == err.NA
+    # The first error down the range wins, as when scanning it.
+    sheet.set(Index(1, 0), "#REF!")
+    assert sheet.get_formatted(Index(0, 5)) == err.REF
+
+
+def test_edits_patch_the_sorted_column(monkeypatch):
+    sheet = Spreadsheet()
+    rows = 2000
+    with sheet.batch():
+        for row in range(rows):
+            sheet.set(Index(row, 0), str(rows - row))
+    read = []
+    real_read = ColumnIndex._read
+
+    def counting_read(index, first_row, last_row, visited_cells):
+        read.append(last_row - first_row + 1)
+        return real_read(index, first_row, last_row, visited_cells)
+
+    monkeypatch.setattr(ColumnIndex, "_read", counting_read)
+    assert formulas(
+        sheet,
+        f"=MEDIAN(A1:A{rows})",
+        f"=SMALL(A1:A{rows}, 3)",
+        f"=RANK(1, A1:A{rows})",
+    ) == ["1000.5", "3", str(rows)]
+    sheet.set(Index(0, 0), "0")
+    assert [sheet.get_formatted(Index(row, 5)) for row in range(3)] == [
+        "999.5",
+        "2",
+        str(rows - 1),
+    ]
+    # The column was read once; the edit only moved one value.
+    assert sum(read) == rows
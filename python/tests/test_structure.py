@@ -0,0 +1,135 @@
+from sheet import errors as err
+from sheet import replay
+from sheet.engine import Spreadsheet
+from sheet.models import Index, Range
+from sheet.views import Viewer
+from sheet.workbook import Workbook
+
+
+def column(sheet, col, nrows):
+    return [sheet.get_formatted(Index(row, col)) for row in range(nrows)]
+
+
+def raw_column(sheet, col, nrows):
+    return [sheet.get_raw(Index(row, col)) for row in range(nrows)]
+
+
+def test_references_follow_inserted_and_deleted_rows():
+    sheet = Spreadsheet()
+    for row in range(4):
+        sheet.set(Index(row, 0), str(row + 1))
+    sheet.set(Index(0, 1), "=A4*10")
+    sheet.set(Index(4, 0), "=SUM(A1:A4)")
+    sheet.set(Index(5, 0), "=A2+A3")
+    assert column(sheet, 0, 6) == ["1", "2", "3", "4", "10", "5"]
+    assert sheet.get_formatted(Index(0, 1)) == "40"
+
+    with sheet.batch() as changed:
+        sheet.insert_rows(2, 2)
+    # Only the range grew to read other cells.
+    assert changed == {Index(6, 0)}
+    assert raw_column(sheet, 0, 8)[6:] == ["=SUM(A1:A6)", "=A2+A5"]
+    assert sheet.get_raw(Index(0, 1)) == "=A6*10"
+    assert column(sheet, 0, 8) == ["1", "2", "", "", "3", "4", "10", "5"]
+    assert sheet.get_formatted(Index(0, 1)) == "40"
+
+    sheet.set(Index(2, 0), "100")
+    assert sheet.get_formatted(Index(6, 0)) == "110"
+    sheet.delete_rows(1, 2)
+    assert raw_column(sheet, 0, 6) == ["1", "", "3", "4", "=SUM(A1:A4)", "=#REF!+A3"]
+    assert column(sheet, 0, 6) == ["1", "", "3", "4", "8", err.REF]
+    sheet.delete_rows(0, 4)
+    assert raw_column(sheet, 0, 2) == ["=SUM(#REF!)", "=#REF!+#REF!"]
+    assert sheet.last_row() == 1
+
+
+def test_columns_shared_formulas_and_spills():
+    sheet = Spreadsheet()
+    with sheet.batch():
+        for row in range(20):
+            sheet.set(Index(row, 0), str(row))
+            sheet.set(Index(row, 2), str(row * 2))
+        for row in range(1, 12):
+            sheet.set(Index(row, 1), f"=SUM(A{row}:A{row + 4})")
+        sheet.set(Index(0, 3), "=C1:C3*2")
+    assert len(list(sheet._shared)) == 1
+    sums = column(sheet, 1, 12)
+
+    sheet.insert_columns(1)
+    assert sheet.get_raw(Index(3, 2)) == "=SUM(A3:A7)"
+    assert sheet.get_raw(Index(0, 4)) == "=D1:D3*2"
+    assert column(sheet, 2, 12) == sums
+    assert column(sheet, 4, 3) == ["0", "4", "8"]
+
+    # A deletion cuts the range of some rows short, whatever their row.
+    sheet.delete_rows(5, 3)
+    expected = [
+        str(sum(v for v in range(row - 1, row + 4) if not 5 <= v < 8))
+        for row in range(1, 12)
+    ]
+    del expected[4:7]
+    assert column(sheet, 2, 9)[1:] == expected
+    assert raw_column(sheet, 2, 9)[3:6] == ["=SUM(A3:A5)", "=SUM(A4:A5)", "=SUM(A6:A9)"]
+
+    sheet.delete_columns(3)
+    assert sheet.get_raw(Index(0, 3)) == "=#REF!*2"
+    assert column(sheet, 3, 2) == [err.REF, ""]
+
+
+def test_snapshots_keep_their_rows():
+    sheet = Spreadsheet()
+    sheet.set(Index(0, 0), "1")
+    sheet.set(Index(1, 0), "2")
+    sheet.set(Index(2, 0), "=A1+A2")
+    assert sheet.get_formatted(Index(2, 0)) == "3"
+    before = sheet.snapshot()
+    sheet.delete_rows(0)
+    sheet.insert_rows(0, 2)
+    after = sheet.snapshot()
+    sheet.set(Index(2, 0), "5")
+    assert column(before, 0, 4) == ["1", "2", "3", ""]
+    assert before.get_raw(Index(2, 0)) == "=A1+A2"
+    assert column(after, 0, 4) == ["", "", "2", err.REF]
+    assert column(sheet, 0, 4) == ["", "", "5", err.REF]
+
+
+def test_references_from_other_sheets_are_rewritten():
+    book = Workbook(["Data", "Summary"])
+    data, summary = book["Data"], book["Summary"]
+    for row in range(3):
+        data.set(Index(row, 0), str(row + 1))
+    summary.set(Index(0, 0), "=SUM(Data!A1:A3)")
+    summary.set(Index(1, 0), "=Data!A3 * 2")
+    summary.set(Index(2, 0), "=Data!A1")
+    summary.set(Index(3, 0), "=A1 + A3")
+    assert column(summary, 0, 4) == ["6", "6", "1", "7"]
+    version = summary.version
+
+    data.insert_rows(1)
+    data.set(Index(1, 0), "10")
+    assert raw_column(summary, 0, 3) == ["=SUM(Data!A1:A4)", "=Data!A4 * 2", "=Data!A1"]
+    assert column(summary, 0, 4) == ["16", "6", "1", "17"]
+    assert summary.version > version
+
+    data.delete_rows(0)
+    assert summary.get_raw(Index(2, 0)) == "=#REF!"
+    assert column(summary, 0, 4) == ["15", "6", err.REF, err.REF]
+
+
+def test_viewer_inserts_and_deletes_the_selected_rows():
+    sheet = Spreadsheet()
+    for row in range(4):
+        sheet.set(Index(row, 0), str(row))
+    summary = sheet.pivot(Range.parse("A1:A4"), [0], [(0, "COUNT")], Index(0, 2))
+    with replay._headless():
+        viewer = Viewer(sheet, replay.HeadlessScreen())
+        viewer.cursor = Index(1, 0)
+        viewer.selecting_from = Index(2, 0)
+        viewer.edit_structure("insert_rows")
+        assert viewer.message == "Inserted 2 rows"
+        assert column(sheet, 0, 6) == ["0", "", "", "1", "2", "3"]
+        viewer.cursor = Index(0, 2)
+        viewer.edit_structure("delete_columns")
+    # The summary stopped when its target was deleted.
+    assert summary not in sheet._pivots
+    assert column(sheet, 2, 5) == ["1", "1", "1", "1", ""]
@@ -0,0 +1,58 @@
+import asyncio
+
+from sheet.engine import Spreadsheet
+from sheet.models import Index
+from sheet.server import SheetClient, SheetServer
+from sheet.watch import CsvTail
+
+
+def test_tail_reads_appended_lines(tmp_path):
+    path = tmp_path / "log.csv"
+    path.write_text("1,a\n2,b\n")
+    sheet = Spreadsheet()
+    sheet.set(Index(0, 2), "=SUM(A1:A100)")
+    sheet.set(Index(1, 2), "=B1")
+    tail = CsvTail(str(path), sheet)
+    assert tail.poll() == {Index(row, col) for row in range(2) for col in range(3)}
+    assert sheet.get_formatted(Index(0, 2)) == "3"
+    assert tail.poll() == set()
+    with path.open("a") as f:
+        f.write('3,"c, d"\n4')
+    # Only the complete line is read, and B1 doesn't depend on it.
+    assert tail.poll() == {Index(2, 0), Index(2, 1), Index(0, 2)}
+    assert sheet.get_formatted(Index(2, 1)) == "c, d"
+    with path.open("a") as f:
+        f.write("0\n")
+    tail.poll()
+    assert sheet.get_formatted(Index(0, 2)) == "46"
+    path.write_text("5\n")
+    tail.poll()
+    assert sheet.get_formatted(Index(0, 0)) == "5"
+
+
+def test_server_follows_the_file(tmp_path):
+    path = tmp_path / "log.csv"
+    path.write_text("1\n")
+
+    async def main():
+        sheet = Spreadsheet()
+        sheet.set(Index(0, 1), "=SUM(A1:A10)")
+        tail = CsvTail(str(path), sheet)
+        tail.poll()
+        server = SheetServer(sheet)
+        socket = str(tmp_path / "sheet.sock")
+        listener = await server.start_unix(socket)
+        following = asyncio.ensure_future(server.follow(tail, interval=0.01))
+        async with listener:
+            client = await SheetClient.connect_unix(socket)
+            try:
+                initial = await client.request("subscribe", range="B1")
+                with path.open("a") as f:
+                    f.write("2\n")
+                changed = await asyncio.wait_for(client.notifications.get(), 5)
+                return initial["values"], changed
+            finally:
+                following.cancel()
+                await client.close()
+
+    assert asyncio.run(main()) == ([["1"]], {"B1": "3"})
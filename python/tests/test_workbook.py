@@ -0,0 +1,95 @@
+from sheet import errors as err
+from sheet.engine import MANUAL
+from sheet.models import Index, Range
+from sheet.workbook import Workbook
+
+
+def make_book(sheets):
+    book = Workbook(list(sheets))
+    for name, rows in sheets.items():
+        for row, values in enumerate(rows):
+            for col, value in enumerate(values):
+                book[name].set(Index(row, col), value)
+    return book
+
+
+def column(sheet, col, nrows):
+    return [sheet.get_formatted(Index(row, col)) for row in range(nrows)]
+
+
+def test_cross_sheet_references():
+    book = make_book(
+        {
+            "Data": [["pear", "3"], ["fig", "4"]],
+            "Q1 sales": [["10"]],
+            "Summary": [
+                ["=SUM(Data!B1:B2)"],
+                ['=VLOOKUP("fig", Data!A1:B2, 2, 0)'],
+                ["='Q1 sales'!A1 * Data!B1"],
+                ["=Missing!A1"],
+                ["=Data!B1:B2 * 2"],
+            ],
+        }
+    )
+    summary = book["Summary"]
+    assert column(summary, 0, 6) == ["7", "4", "30", err.REF, "6", "8"]
+    assert summary.get_raw(Index(2, 0)) == "='Q1 sales'!A1 * Data!B1"
+
+    book["Data"].set(Index(1, 1), "5")
+    book["Q1 sales"].set(Index(0, 0), "2")
+    assert column(summary, 0, 6) == ["8", "5", "6", err.REF, "6", "10"]
+
+    book.add_sheet("Missing")
+    book["Missing"].set(Index(0, 0), "1")
+    assert summary.get_formatted(Index(3, 0)) == "1"
+
+
+def test_only_dependent_sheets_are_recalculated():
+    book = make_book(
+        {
+            "A": [["1"]],
+            "B": [["=A!A1+1"]],
+            "C": [["=B!A1*10"]],
+            "D": [["=5"]],
+        }
+    )
+    sheets = [book[name] for name in "ABCD"]
+    assert [sheet.get_formatted(Index(0, 0)) for sheet in sheets] == [
+        "1",
+        "2",
+        "20",
+        "5",
+    ]
+    versions = [sheet.version for sheet in sheets]
+    sheets[0].set(Index(0, 0), "2")
+    assert [s.version - v for s, v in zip(sheets, versions)] == [1, 1, 1, 0]
+    assert book["D"]._values == {Index(0, 0): "5"}
+    assert book["C"].get_formatted(Index(0, 0)) == "30"
+
+
+def test_circular_reference_across_sheets():
+    book = make_book({"A": [["=B!A1"]], "B": [["=A!A1"]]})
+    assert book["A"].get_formatted(Index(0, 0)) == err.CIRCULAR_REFERENCE
+
+
+def test_subscribers_and_snapshots_of_dependent_sheets():
+    book = make_book({"A": [["1"]], "B": [["=A!A1*2"]]})
+    diffs = []
+    book["B"].subscribe(diffs.append, Range.parse("A1:A1"))
+    before = book["B"].snapshot()
+    assert before.get_formatted(Index(0, 0)) == "2"
+    book["A"].set(Index(0, 0), "4")
+    assert diffs == [{Index(0, 0): "8"}]
+    assert before.get_formatted(Index(0, 0)) == "2"
+    assert book["B"].snapshot().get_formatted(Index(0, 0)) == "8"
+
+
+def test_manual_calculation_of_a_dependent_sheet():
+    book = make_book({"A": [["1"]], "B": [["=A!A1*2", "=A1+1"]]})
+    assert column(book["B"], 1, 1) == ["3"]
+    book["B"].set_calculation(MANUAL)
+    book["A"].set(Index(0, 0), "4")
+    assert book["B"].get_formatted(Index(0, 1)) == "3"
+    assert book["B"].stale_cells() == {Index(0, 1)}
+    book["B"].recalculate()
+    assert book["B"].get_formatted(Index(0, 1)) == "9"